@@ -17,6 +17,7 @@ from bokeh.models.widgets import Tabs
 sys.path.append(os.getcwd())
 sys.path.append('./ECLAPI-8.0.12/lib')
 from report import Report
+from scheduler import Scheduler
 
 if os.environ['USER'].lower() == 'desiobserver':
     os.environ['NL_DIR'] = '/n/home/desiobserver/nightlogs'
@@ -54,8 +55,9 @@ class Obs_Report(Report):
         self.get_checklist_layout()
         self.get_nl_layout()
         self.get_ns_layout()
+        self.get_trends_layout()
         
-        self.layout = Tabs(tabs=[self.intro_tab, self.ns_tab], css_classes=['tabs-header'], sizing_mode="scale_both")
+        self.layout = Tabs(tabs=[self.intro_tab, self.ns_tab, self.trends_tab], css_classes=['tabs-header'], sizing_mode="scale_both")
 
     def run(self):
         self.get_layout()
@@ -88,15 +90,21 @@ class Obs_Report(Report):
         self.ns_date_btn.on_click(self.get_nightsum)
         self.ns_next_date_btn.on_click(self.ns_next_date)
         self.ns_last_date_btn.on_click(self.ns_last_date)
+        self.search_btn.on_click(self.search_nightlogs)
+        self.trends_btn.on_click(self.update_trends)
+        self.layout.on_change('active', self.trends_shown)
         self.nonobs_btn_exp.on_click(self.nonobs_entry_exp)
         self.nonobs_btn_prob.on_click(self.nonobs_entry_prob)
         self.all_button.on_click(self.add_all_to_bad_list)
         self.partial_button.on_click(self.add_some_to_bad_list)
         self.bad_add.on_click(self.bad_exp_add)
+        self.exp_filter_btn.on_click(self.exp_filter)
+        self.exp_page_prev_btn.on_click(self.exp_page_prev)
+        self.exp_page_next_btn.on_click(self.exp_page_next)
         
 OBS = Obs_Report()
 OBS.run()
 curdoc().title = 'DESI Night Log'
 curdoc().add_root(OBS.layout)
-curdoc().add_periodic_callback(OBS.current_nl, 30000) #Every 30 seconds
-curdoc().add_periodic_callback(OBS.get_exposure_list, 30000) #Every 30 seconds
+SCHED = Scheduler(OBS, curdoc()) #Updates Current NightLog and exposure list once connected
+SCHED.start()
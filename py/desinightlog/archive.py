@@ -0,0 +1,222 @@
+"""
+Consolidated archive of the NightLog entries of all nights, as a Parquet dataset partitioned by night.
+
+    NL_DIR/ops/archive/<table>/night=<YYYYMMDD>/part.parquet
+
+Each table collects one kind of input file of the nights (plan, milestone, problem, exposure
+comments, weather, time use and bad exposures) from both locations, with a location column.
+The archive is updated incrementally: a night is only rewritten when one of its input files
+changed (manifest.json keeps their mtimes and sizes). The submission updates its own night,
+and all nights can be brought up to date from the command line:
+
+    cd py/desinightlog
+    python archive.py [--first 20230101] [--last 20231231]
+
+Scans use pyarrow.dataset, so the night range and filters are applied to the partitions and
+row groups before the data is read, e.g.
+
+    import pyarrow.dataset as ds
+    archive.scan('problem', filter=ds.field('Problem').isin(['FVC']), first_night=20230101)
+
+pyarrow is needed for this module only (it is installed in the Docker image); the rest of the
+NightLog does not depend on it, and a submission without it logs a warning instead of archiving.
+
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+
+import artifacts
+import sources as src
+
+#table -> (NightLog attribute of the input file, columns, dtypes of the columns that are not strings)
+TABLES = {'plan': ('objectives', ['Time', 'Objective'], {}),
+          'milestone': ('milestone', ['Time', 'Desc', 'Exp_Start', 'Exp_Stop', 'Exp_Excl', 'user'], {}),
+          'problem': ('obs_pb', ['Name', 'Time', 'Problem', 'alarm_id', 'action', 'img_name'], {}),
+          'exposure': ('obs_exp', ['Time', 'Exp_Start', 'Quality', 'Comment', 'Name', 'img_name'], {}),
+          'weather': ('weather', ['Time', 'desc', 'temp', 'wind', 'humidity', 'seeing', 'tput', 'skylevel'], {}),
+          'time_use': ('time_use', ['obs_time', 'test_time', 'inst_loss', 'weather_loss', 'tel_loss', 'total', '18deg', '12deg'],
+                       {c: 'float64' for c in ['obs_time', 'test_time', 'inst_loss', 'weather_loss', 'tel_loss', 'total', '18deg', '12deg']}),
+          'bad_exp': ('bad_exp_list', ['EXPID', 'BAD', 'BADCAMS', 'COMMENT', 'CAMMASK'], {'EXPID': 'int64', 'BAD': 'bool', 'CAMMASK': 'int64'})}
+
+
+def available():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.dataset
+    except ImportError:
+        return False
+    return True
+
+def schema(table):
+    """Schema of the files of a table. night is the partition column
+    """
+    import pyarrow as pa
+    _, columns, dtypes = TABLES[table]
+    types = {'float64': pa.float64(), 'int64': pa.int64(), 'bool': pa.bool_()}
+    return pa.schema([(c, types.get(dtypes.get(c), pa.string())) for c in columns] + [('location', pa.string())])
+
+
+class Archive(object):
+    def __init__(self, nl_dir=None, archive_dir=None, logger=None):
+        self.nl_dir = nl_dir or os.environ['NL_DIR']
+        self.archive_dir = archive_dir or os.path.join(self.nl_dir, 'ops', 'archive')
+        self.manifest_file = os.path.join(self.archive_dir, 'manifest.json')
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_file):
+            return json.load(open(self.manifest_file, 'r'))
+        return {table: {} for table in TABLES}
+
+    def _save_manifest(self, manifest):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        artifacts.write_text(self.manifest_file, json.dumps(manifest))
+
+    def partition(self, table, night):
+        return os.path.join(self.archive_dir, table, 'night={}'.format(int(night)), 'part.parquet')
+
+    def read_sources(self, table, sources):
+        """The input files of a night as one DataFrame with the columns of the table
+        """
+        _, columns, dtypes = TABLES[table]
+        dfs = []
+        for loc, (filen, _) in sorted(sources.items()):
+            try:
+                df = pd.read_csv(filen, dtype=str, keep_default_na=False)
+            except pd.errors.EmptyDataError:
+                continue
+            df = df.reindex(columns=columns)
+            df['location'] = loc
+            dfs.append(df)
+        if len(dfs) == 0:
+            return pd.DataFrame(columns=columns + ['location'])
+        df = pd.concat(dfs, ignore_index=True)
+        for col, dtype in dtypes.items():
+            if dtype == 'bool':
+                df[col] = df[col].astype(str).str.lower().isin(['true', '1'])
+            elif dtype == 'int64':
+                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(np.int64)
+            else:
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+        return df
+
+    def _write(self, table, night, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        filen = self.partition(table, night)
+        os.makedirs(os.path.dirname(filen), exist_ok=True)
+        out = pa.BufferOutputStream()
+        pq.write_table(pa.Table.from_pandas(df, schema=schema(table), preserve_index=False), out)
+        artifacts.write_bytes(filen, out.getvalue().to_pybytes())
+
+    def _remove(self, table, night):
+        filen = self.partition(table, night)
+        if os.path.exists(filen):
+            os.remove(filen)
+            os.rmdir(os.path.dirname(filen))
+
+    def update_night(self, night):
+        """Rewrites the partitions of a night whose input files changed. Returns the tables that were updated
+        """
+        with self.lock:
+            manifest = self._load_manifest()
+            updated = self._update_night(night, manifest)
+            if len(updated) > 0:
+                self._save_manifest(manifest)
+            return updated
+
+    def _update_night(self, night, manifest):
+        night = str(night)
+        updated = []
+        for table in TABLES:
+            sources = src.by_location(night, TABLES[table][0], self.logger)
+            state = {loc: stat for loc, (_, stat) in sources.items()}
+            if manifest.setdefault(table, {}).get(night, {}) == state:
+                continue
+            if len(sources) == 0:
+                self._remove(table, night)
+                manifest[table].pop(night, None)
+            else:
+                self._write(table, night, self.read_sources(table, sources))
+                manifest[table][night] = state
+            updated.append(table)
+        return updated
+
+    def update(self, first_night=None, last_night=None):
+        """Brings the archive up to date for the nights between first_night and last_night
+        """
+        with self.lock:
+            manifest = self._load_manifest()
+            n_updated = 0
+            for night in src.nights(self.nl_dir, first_night, last_night):
+                try:
+                    if len(self._update_night(night, manifest)) > 0:
+                        n_updated += 1
+                except Exception as e:
+                    self.logger.info('Could not archive night {}: {}'.format(night, e))
+            self._save_manifest(manifest)
+            return n_updated
+
+    def dataset(self, table):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        return ds.dataset(os.path.join(self.archive_dir, table), format='parquet', partitioning='hive',
+                          schema=schema(table).append(pa.field('night', pa.int32())))
+
+    def scan(self, table, columns=None, filter=None, first_night=None, last_night=None):
+        """Rows of a table as a DataFrame. filter is a pyarrow.dataset expression; it and the night
+        range are pushed down to the Parquet files
+        """
+        import pyarrow.dataset as ds
+        if not os.path.exists(os.path.join(self.archive_dir, table)):
+            return pd.DataFrame(columns=(columns or TABLES[table][1] + ['location', 'night']))
+        expr = filter
+        for cond in [ds.field('night') >= int(first_night) if first_night is not None else None,
+                     ds.field('night') <= int(last_night) if last_night is not None else None]:
+            if cond is not None:
+                expr = cond if expr is None else expr & cond
+        return self.dataset(table).to_table(columns=columns, filter=expr).to_pandas()
+
+
+_archive = None
+
+def get_archive(logger=None):
+    """Archive of NL_DIR shared by all sessions of the process
+    """
+    global _archive
+    if _archive is None:
+        _archive = Archive(logger=logger)
+    return _archive
+
+def scan(table, columns=None, filter=None, first_night=None, last_night=None):
+    return get_archive().scan(table, columns, filter, first_night, last_night)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Update the Parquet archive of the NightLog entries of all nights')
+    parser.add_argument('--first', default=None, help='First night (YYYYMMDD)')
+    parser.add_argument('--last', default=None, help='Last night (YYYYMMDD)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if not available():
+        print('pyarrow is not installed')
+        sys.exit(1)
+
+    start = time.time()
+    n = Archive().update(args.first, args.last)
+    print('Archived {} nights in {:.1f}s'.format(n, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
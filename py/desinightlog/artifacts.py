@@ -0,0 +1,95 @@
+"""
+Writes generated files (rendered NightLog, exposure list, time use, ...) only when their content changed.
+
+The new content is compared with the hash of the file on disk, so unchanged outputs are not
+written again on every update. Files are written to a temporary file in the same directory and
+renamed over the old one, so a reader at the other site never sees a partly written file.
+
+"""
+
+import io
+import os
+import socket
+import hashlib
+import threading
+
+_hashes = {} #path -> (mtime_ns, size, sha1) of the file as last read or written
+_lock = threading.Lock()
+
+
+def _digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+def _file_digest(path):
+    """sha1 of the file on disk, read again only if the file changed since it was last seen
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    cached = _hashes.get(path)
+    if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+    with open(path, 'rb') as f:
+        digest = _digest(f.read())
+    _hashes[path] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+def tmp_path(path):
+    """Temporary file next to path, unique to this host, process and thread, to be renamed over path
+    """
+    return '{}.{}-{}-{}.tmp'.format(path, socket.gethostname(), os.getpid(), threading.get_ident())
+
+def write_bytes(path, data):
+    """Writes data to path atomically unless the file already has this content. Returns True if written
+    """
+    digest = _digest(data)
+    with _lock:
+        if _file_digest(path) == digest:
+            return False
+        tmp = tmp_path(path)
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        st = os.stat(path)
+        _hashes[path] = (st.st_mtime_ns, st.st_size, digest)
+        return True
+
+def write_text(path, text):
+    return write_bytes(path, text.encode('utf-8'))
+
+def write_csv(df, path, **kwargs):
+    """DataFrame.to_csv(path, **kwargs) that skips unchanged content
+    """
+    return write_text(path, df.to_csv(**kwargs))
+
+
+class TextArtifact(io.StringIO):
+    """File-like object for writing a text file in pieces. The file is written by close(),
+    only if its content changed
+
+        f = TextArtifact(path)
+        f.write(...)
+        f.close()
+    """
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.changed = None
+
+    def close(self):
+        if not self.closed:
+            self.changed = write_text(self.path, self.getvalue())
+        super().close()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            super().close() #the old file is kept
+            return False
+        self.close()
+        return False
+
+    def __del__(self):
+        #An artifact that was never closed is discarded rather than written when garbage collected
+        if not self.closed:
+            super().close()
@@ -0,0 +1,239 @@
+"""
+Store for the survey bad exposure list (NL_DIR/ops/bad_exp_list.csv), used by the data pipeline.
+
+The bad exposures are kept in one csv file per night with an index from EXPID to night, so a
+submission only reads and writes the partition of its own night. The flat bad_exp_list.csv is
+regenerated from the partitions only when it is out of date. When a night only adds new
+exposures, the new rows are appended to it instead of rewriting the whole file.
+
+The partitions also hold CAMMASK, the bitmask of bad cameras (cameras.py). The flat file keeps
+the columns the pipeline reads. The index keeps the CAMMASK of every EXPID as well, so queries by
+camera over any range of nights use one table in memory (BadExpStore.table), which is read again
+only when the index file changes.
+
+"""
+
+import os
+import json
+import glob
+import logging
+
+import numpy as np
+import pandas as pd
+
+import cameras
+import artifacts
+
+COLUMNS = ['NIGHT','EXPID','BAD','BADCAMS','COMMENT'] #Columns of the flat file
+STORE_COLUMNS = COLUMNS + ['CAMMASK']
+DTYPES = {"NIGHT":int, "EXPID": int,"BAD":bool,"BADCAMS":str,"COMMENT":str}
+STORE_DTYPES = dict(DTYPES, CAMMASK=np.int64)
+
+
+def with_mask(df):
+    df = df[COLUMNS].astype(DTYPES)
+    df['CAMMASK'] = cameras.masks_from_badcams(df.BADCAMS, df.BAD)
+    return df
+
+
+class BadExpStore(object):
+    def __init__(self, survey_dir, logger=None):
+        self.survey_dir = survey_dir
+        self.store_dir = os.path.join(survey_dir, 'bad_exp')
+        self.index_file = os.path.join(self.store_dir, 'index.json')
+        self.logger = logger or logging.getLogger(__name__)
+        self._index = None
+        self._index_mtime = None
+        self._table = None
+        self._table_mtime = None
+
+    ##Index: EXPID -> NIGHT and CAMMASK, plus the state of the flat file when it was last in sync
+    def _load_index(self):
+        """The index, read again if the file was changed, e.g. by another process
+        """
+        mtime = os.path.getmtime(self.index_file) if os.path.exists(self.index_file) else None
+        if self._index is None or mtime != self._index_mtime:
+            if mtime is not None:
+                index = json.load(open(self.index_file, 'r'))
+            else:
+                index = {'expids': {}, 'cammask': {}, 'flat_mtime': None, 'flat_dirty': True}
+            self._index = index
+            self._index_mtime = mtime
+            if 'cammask' not in index:
+                #Index written before the masks were kept in it
+                index['cammask'] = {}
+                for night in self.nights():
+                    df = self.read_night(night)
+                    index['cammask'].update({str(int(e)): int(m) for e, m in zip(df.EXPID, df.CAMMASK)})
+                self._save_index()
+        return self._index
+
+    def _save_index(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        artifacts.write_text(self.index_file, json.dumps(self._index))
+        self._index_mtime = os.path.getmtime(self.index_file)
+
+    def partition(self, night):
+        return os.path.join(self.store_dir, '{}.csv'.format(int(night)))
+
+    def read_night(self, night):
+        filen = self.partition(night)
+        if os.path.exists(filen):
+            df = pd.read_csv(filen)
+            if 'CAMMASK' not in df.columns:
+                df = with_mask(df)
+            return df.astype(STORE_DTYPES)
+        return pd.DataFrame(columns=STORE_COLUMNS).astype(STORE_DTYPES)
+
+    def _write_night(self, night, df):
+        os.makedirs(self.store_dir, exist_ok=True)
+        filen = self.partition(night)
+        if len(df) == 0:
+            if os.path.exists(filen):
+                os.remove(filen)
+            return
+        artifacts.write_csv(df[STORE_COLUMNS].sort_values(by='EXPID'), filen, index=False)
+
+    ##Updates
+    def merge_night(self, night, new_df):
+        """Merges the bad exposures of a night into the store, the new rows taking precedence.
+        Returns the rows that were added and whether existing rows were changed
+        """
+        index = self._load_index()
+        new_df = with_mask(new_df.drop_duplicates(subset=['EXPID'], keep='last'))
+
+        #Exposures listed before under another night
+        updated = False
+        for other in set(index['expids'].get(str(e)) for e in new_df.EXPID) - set([None, int(night)]):
+            df = self.read_night(other)
+            self._write_night(other, df[~df.EXPID.isin(new_df.EXPID)])
+            updated = True
+
+        df = self.read_night(night)
+        merged = pd.concat([df, new_df]).drop_duplicates(subset=['EXPID'], keep='last').sort_values(by='EXPID').reset_index(drop=True)
+        added = new_df[~new_df.EXPID.isin(df.EXPID)]
+        if not updated:
+            before = df.sort_values(by='EXPID').reset_index(drop=True)
+            updated = not merged[merged.EXPID.isin(before.EXPID)].reset_index(drop=True).equals(before)
+        if len(added) == 0 and not updated:
+            return added, False
+
+        self._write_night(night, merged)
+        for e, m in zip(new_df.EXPID, new_df.CAMMASK):
+            index['expids'][str(int(e))] = int(night)
+            index['cammask'][str(int(e))] = int(m)
+        if updated:
+            index['flat_dirty'] = True
+        self._save_index()
+        return added, updated
+
+    def import_flat(self, flat_path):
+        """Rebuilds the store from the flat file, e.g. the first time or after it was changed by svn update
+        """
+        df = pd.read_csv(flat_path)
+        df = with_mask(df.drop_duplicates(subset=['EXPID'], keep='last'))
+        for filen in glob.glob(os.path.join(self.store_dir, '*.csv')):
+            os.remove(filen)
+        for night, night_df in df.groupby('NIGHT'):
+            self._write_night(night, night_df)
+        self._index = {'expids': {str(int(e)): int(n) for e, n in zip(df.EXPID, df.NIGHT)},
+                       'cammask': {str(int(e)): int(m) for e, m in zip(df.EXPID, df.CAMMASK)},
+                       'flat_mtime': os.path.getmtime(flat_path), 'flat_dirty': False}
+        self._save_index()
+        self.logger.info('Imported {} bad exposures from {}'.format(len(df), flat_path))
+
+    def sync_from_flat(self, flat_path):
+        """Imports the flat file if it was changed outside of the store
+        """
+        index = self._load_index()
+        if os.path.exists(flat_path) and index['flat_mtime'] != os.path.getmtime(flat_path):
+            self.import_flat(flat_path)
+
+    def update_flat(self, flat_path, added=None):
+        """Brings the flat file up to date. Rows that were only added are appended, otherwise the
+        file is regenerated from all nights. Returns True if the file was changed
+        """
+        index = self._load_index()
+        if not index['flat_dirty'] and (added is None or len(added) == 0):
+            return False
+        if not index['flat_dirty'] and os.path.exists(flat_path):
+            added[COLUMNS].to_csv(flat_path, mode='a', header=False, index=False)
+        else:
+            dfs = [pd.read_csv(f) for f in sorted(glob.glob(os.path.join(self.store_dir, '*.csv')))]
+            df = pd.concat(dfs) if len(dfs) > 0 else pd.DataFrame(columns=COLUMNS)
+            artifacts.write_csv(df[COLUMNS].astype(DTYPES), flat_path, index=False)
+        index['flat_dirty'] = False
+        index['flat_mtime'] = os.path.getmtime(flat_path)
+        self._save_index()
+        return True
+
+    def mark_dirty(self):
+        """Forces the flat file to be regenerated at the next update_flat, e.g. if it could not be committed
+        """
+        self._load_index()['flat_dirty'] = True
+        self._save_index()
+
+    ##Lookups
+    def night_of(self, expid):
+        return self._load_index()['expids'].get(str(int(expid)))
+
+    def lookup(self, expid):
+        """Row of the bad exposure list for this EXPID, or None
+        """
+        night = self.night_of(expid)
+        if night is None:
+            return None
+        df = self.read_night(night)
+        df = df[df.EXPID == int(expid)]
+        if len(df) == 0:
+            return None
+        return df.iloc[0]
+
+    def nights(self):
+        return sorted(int(os.path.splitext(os.path.basename(f))[0]) for f in glob.glob(os.path.join(self.store_dir, '*.csv')))
+
+    def table(self):
+        """EXPID, NIGHT and CAMMASK of all bad exposures, sorted by EXPID
+        """
+        index = self._load_index()
+        if self._table is None or self._table_mtime != self._index_mtime:
+            expids = np.array([int(e) for e in index['expids']], dtype=np.int64)
+            df = pd.DataFrame({'EXPID': expids,
+                               'NIGHT': np.array(list(index['expids'].values()), dtype=np.int64),
+                               'CAMMASK': np.array([index['cammask'].get(e, 0) for e in index['expids']], dtype=np.int64)})
+            self._table = df.sort_values(by='EXPID').reset_index(drop=True)
+            self._table_mtime = self._index_mtime
+        return self._table
+
+    def get_range(self, start=None, end=None, details=True):
+        """Bad exposures of the nights between start and end (YYYYMMDD, inclusive). Without details, only
+        EXPID, NIGHT and CAMMASK from the table in memory
+        """
+        df = self.table()
+        keep = np.ones(len(df), dtype=bool)
+        if start is not None:
+            keep &= df.NIGHT.values >= int(start)
+        if end is not None:
+            keep &= df.NIGHT.values <= int(end)
+        df = df[keep]
+        if not details:
+            return df.reset_index(drop=True)
+        return self._details(df)
+
+    def _details(self, df):
+        """All the columns of the rows of the table df, read from the partitions of their nights
+        """
+        nights = sorted(set(df.NIGHT))
+        if len(nights) == 0:
+            return pd.DataFrame(columns=STORE_COLUMNS).astype(STORE_DTYPES)
+        rows = pd.concat([self.read_night(n) for n in nights])
+        return rows[rows.EXPID.isin(df.EXPID)].reset_index(drop=True)
+
+    def find(self, petal, arm=None, start=None, end=None, first_night=None, last_night=None, details=False):
+        """Bad exposures where a camera (or any camera of a petal) is bad, between EXPIDs start and end.
+        Only the partitions of the nights found are read, and only with details
+        """
+        df = cameras.select(self.get_range(first_night, last_night, details=False), petal, arm, start, end)
+        if details:
+            return self._details(df)
+        return df.reset_index(drop=True)
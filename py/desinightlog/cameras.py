@@ -0,0 +1,111 @@
+"""
+Bitmask representation of the bad cameras of an exposure.
+
+Each of the 30 cameras (10 petals x 3 arms) is one bit: bit = 3*petal + arm, with arms b=0, r=1, z=2.
+BADCAMS strings like 'b0r0z3' (and 'a5' for all arms of petal 5) are converted into these masks,
+so questions over many exposures are answered with numpy array operations.
+
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+ARMS = 'brz'
+NPETALS = 10
+NCAMERAS = NPETALS * len(ARMS)
+ALL = (1 << NCAMERAS) - 1
+
+_cam_re = re.compile(r'([abrz])(\d)')
+
+
+def camera_bit(petal, arm):
+    return 1 << (3*int(petal) + ARMS.index(arm))
+
+def petal_bits(petal):
+    return 0b111 << (3*int(petal))
+
+def badcams_to_mask(badcams, bad=False):
+    """Mask of one exposure from its BADCAMS string. A fully bad exposure has every camera set
+    """
+    if bad:
+        return ALL
+    mask = 0
+    for arm, petal in _cam_re.findall(str(badcams)):
+        if arm == 'a':
+            mask |= petal_bits(petal)
+        else:
+            mask |= camera_bit(petal, arm)
+    return mask
+
+def mask_to_badcams(mask):
+    """BADCAMS string of a mask, using 'a<petal>' when all arms of a petal are set
+    """
+    mask = int(mask)
+    cams = ''
+    for petal in range(NPETALS):
+        if mask & petal_bits(petal) == petal_bits(petal):
+            cams += 'a{}'.format(petal)
+        else:
+            for arm in ARMS:
+                if mask & camera_bit(petal, arm):
+                    cams += '{}{}'.format(arm, petal)
+    return cams
+
+def masks_from_badcams(badcams, bad=None):
+    """Masks for a column of BADCAMS strings (and optionally the BAD column), without a Python loop over the rows
+    """
+    badcams = pd.Series(badcams).astype(str).reset_index(drop=True)
+    masks = np.zeros(len(badcams), dtype=np.int64)
+    cams = badcams.str.extractall(r'(?P<arm>[abrz])(?P<petal>\d)')
+    if len(cams) > 0:
+        petal = cams['petal'].astype(np.int64).values
+        arm = cams['arm'].map({'b': 0, 'r': 1, 'z': 2, 'a': -1}).values
+        bits = np.where(arm < 0, np.int64(0b111) << (3*petal), np.int64(1) << (3*petal + np.maximum(arm, 0)))
+        rows = cams.index.get_level_values(0).values
+        np.bitwise_or.at(masks, rows, bits)
+    if bad is not None:
+        masks[pd.Series(bad).reset_index(drop=True).astype(str).str.lower().isin(['true', '1']).values] = ALL
+    return masks
+
+
+##Queries on arrays of masks
+def has_camera(masks, petal, arm=None):
+    """True for the exposures where the camera (or any camera of the petal if arm is None) is bad
+    """
+    bits = petal_bits(petal) if arm is None else camera_bit(petal, arm)
+    return (np.asarray(masks, dtype=np.int64) & bits) != 0
+
+def union(masks):
+    """Cameras bad in any of the exposures
+    """
+    masks = np.asarray(masks, dtype=np.int64)
+    if len(masks) == 0:
+        return 0
+    return int(np.bitwise_or.reduce(masks))
+
+def intersection(masks):
+    """Cameras bad in all of the exposures
+    """
+    masks = np.asarray(masks, dtype=np.int64)
+    if len(masks) == 0:
+        return 0
+    return int(np.bitwise_and.reduce(masks))
+
+def camera_counts(masks):
+    """Number of exposures each camera is bad in, as an array of shape (NPETALS, 3) indexed [petal, arm]
+    """
+    masks = np.asarray(masks, dtype=np.int64)
+    bits = (masks[:, None] >> np.arange(NCAMERAS)) & 1
+    return bits.sum(axis=0).reshape(NPETALS, len(ARMS))
+
+def select(df, petal, arm=None, start=None, end=None):
+    """Rows of a bad exposure table (with EXPID and CAMMASK) where the camera is bad, within an EXPID range
+    """
+    keep = has_camera(df.CAMMASK.values, petal, arm)
+    if start is not None:
+        keep &= df.EXPID.values >= int(start)
+    if end is not None:
+        keep &= df.EXPID.values <= int(end)
+    return df[keep]
@@ -0,0 +1,156 @@
+"""
+Stand-in of the DESI eLog (ECL) HTTP server, for tests and development without the eLog.
+
+The server keeps the entries in memory and answers list, get and post requests under /E/ like
+the ECL XML API. It can be made slow or to fail the next requests, to exercise the timeouts,
+retries and reconnects of elog.ElogClient. StubConnection is the client side, used by ElogClient
+in place of ECLAPI.ECLConnection when ECL_URL starts with stub+, e.g.
+
+    cd py/desinightlog
+    python eclstub.py --port 8091
+    ECL_URL=stub+http://localhost:8091/ECL/desi bokeh serve ObserverReport
+
+"""
+
+import json
+import time
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class ECLStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0)):
+        super().__init__(address, StubHandler)
+        self.entries = []
+        self.lock = threading.Lock()
+        self.delay = 0 #seconds before each answer
+        self.fail = 0 #number of the next requests answered with a 500
+        self.requests = 0
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'stub+http://{}:{}/ECL/desi'.format(*self.server_address[:2])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='eclstub', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _answer(self, status, body, content_type='application/json'):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start(self):
+        """Applies the delay and failures of the server. Returns False if the request fails
+        """
+        with self.server.lock:
+            self.server.requests += 1
+            fail = self.server.fail > 0
+            if fail:
+                self.server.fail -= 1
+        time.sleep(self.server.delay)
+        if fail:
+            self._answer(500, json.dumps({'error': 'failure requested'}))
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._start():
+            return
+        url = urllib.parse.urlparse(self.path)
+        args = dict(urllib.parse.parse_qsl(url.query))
+        with self.server.lock:
+            entries = list(self.server.entries)
+        if url.path.endswith('/E/xml_list'):
+            since = time.time() - float(args['a'][:-4])*86400 if args.get('a', '').endswith('days') else 0
+            ids = [e['id'] for e in reversed(entries) if args.get('c') in [None, e['category']] and e['time'] >= since]
+            self._answer(200, json.dumps(ids[:int(args['l'])] if 'l' in args else ids))
+        elif url.path.endswith('/E/xml_get'):
+            found = [e for e in entries if e['id'] == int(args.get('e', -1))]
+            if len(found) == 0:
+                self._answer(404, '', 'text/xml')
+            else:
+                self._answer(200, '<entry id="{id}" category="{category}"><subject>{subject}</subject><text>{text}</text></entry>'.format(**found[0]), 'text/xml')
+        else:
+            self._answer(404, '')
+
+    def do_POST(self):
+        if not self._start():
+            return
+        if not self.path.endswith('/E/xml_post'):
+            self._answer(404, '')
+            return
+        entry = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            entry.update(id=len(self.server.entries) + 1, time=time.time())
+            self.server.entries.append(entry)
+        self._answer(200, json.dumps({'id': entry['id']}))
+
+
+class StubConnection(object):
+    """Client of ECLStub with the methods of ECLConnection that elog.py uses. Entries are posted as dicts
+    """
+    def __init__(self, url, username=None, password=None, timeout=300):
+        self.url = url[len('stub+'):] if url.startswith('stub+') else url
+        self.timeout = timeout
+
+    def _request(self, path, args=None, data=None):
+        url = '{}/E/{}'.format(self.url, path)
+        if args:
+            url += '?' + urllib.parse.urlencode({k: v for k, v in args.items() if v is not None})
+        request = urllib.request.Request(url, data=None if data is None else json.dumps(data).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return response.status, response.read().decode('utf-8')
+
+    def list(self, category=None, form=None, limit=None, tag=None, after=None):
+        return json.loads(self._request('xml_list', {'c': category, 'l': limit, 'a': after})[1])
+
+    def get(self, entry_id):
+        try:
+            return self._request('xml_get', {'e': int(entry_id)})[1]
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def post(self, entry):
+        return self._request('xml_post', data=entry)
+
+    def close(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stand-in of the eLog server')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--delay', type=float, default=0, help='Seconds before each answer')
+    args = parser.parse_args()
+    stub = ECLStub(('127.0.0.1', args.port))
+    stub.delay = args.delay
+    print('eLog stand-in at ECL_URL={}'.format(stub.url))
+    stub.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
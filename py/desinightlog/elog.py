@@ -0,0 +1,244 @@
+"""
+Client for posting to the DESI eLog (ECL) through ECLAPI.
+
+One connection is kept for the process and reopened when a call fails. Calls have a timeout and a
+bounded number of retries. Before posting, the eLog is searched for an entry with the same subject
+(as ECLAPI-8.0.12/samples/ecl_list.py does) and a hash of the text, so that the same entry is
+never posted twice while a corrected entry for the same night still is. Entries that cannot be
+posted are written to an outbox directory, which is sent with the next post and in the background
+every FLUSH_INTERVAL seconds (flush_in_background, called by the scheduler).
+
+Both sites can share the outbox directory: an entry is claimed by renaming it before it is sent,
+and a claim older than CLAIM_TIMEOUT (a process that died while sending) is released again.
+
+The URL and credentials can be set with ECL_URL, ECL_USER and ECL_PASSWORD. With
+ECL_URL=stub+http://... the client talks to the stand-in of the ECL server in eclstub.py.
+
+"""
+
+import os
+import json
+import time
+import glob
+import socket
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import artifacts
+
+
+ECL_URL = 'http://desi-www.kpno.noirlab.edu:8090/ECL/desi'
+ECL_USER = 'dos'
+ECL_PASSWORD = 'dosuser'
+FLUSH_INTERVAL = 600 #seconds between background sends of the outbox
+CLAIM_TIMEOUT = 3600 #seconds after which an entry claimed for sending is put back in the outbox
+
+
+class ElogError(Exception):
+    pass
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+def mark(text, digest, textile=True):
+    """Text of an entry with its hash, in a comment that the eLog does not display
+    """
+    if textile:
+        return '{}\n\n###. nightlog:{}\n'.format(text, digest)
+    return '{}<!-- nightlog:{} -->'.format(text, digest)
+
+
+class ElogClient(object):
+    def __init__(self, url=None, user=None, password=None, outbox_dir=None, timeout=30, retries=3, backoff=5, logger=None):
+        self.url = url or os.environ.get('ECL_URL', ECL_URL)
+        self.user = user or os.environ.get('ECL_USER', ECL_USER)
+        self.password = password or os.environ.get('ECL_PASSWORD', ECL_PASSWORD)
+        if outbox_dir is None:
+            outbox_dir = os.path.join(os.environ['NL_DIR'], 'ops', 'elog_outbox')
+        self.outbox_dir = outbox_dir
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.conn = None
+        self.lock = threading.RLock()
+        self.outbox_lock = threading.Lock()
+        self.last_flush = 0
+        self.flusher = None
+        self.flusher_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def _connect(self):
+        if self.conn is None:
+            if self._stub():
+                from eclstub import StubConnection
+                self.conn = StubConnection(self.url, self.user, self.password)
+            else:
+                from ECLAPI import ECLConnection
+                self.conn = ECLConnection(self.url, self.user, self.password)
+        return self.conn
+
+    def _stub(self):
+        return self.url.startswith('stub+')
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                try:
+                    self.conn.close()
+                except Exception:
+                    pass
+                self.conn = None
+
+    def _call(self, method, *args, **kwargs):
+        """Calls a method of the ECLConnection with a timeout, reconnecting and retrying when it fails
+        """
+        with self.lock:
+            for attempt in range(self.retries + 1):
+                try:
+                    conn = self._connect()
+                    future = self.executor.submit(getattr(conn, method), *args, **kwargs)
+                    return future.result(timeout=self.timeout)
+                except Exception as e:
+                    if isinstance(e, TimeoutError):
+                        self.executor = ThreadPoolExecutor(max_workers=1) #the old worker is still waiting on the eLog
+                        e = ElogError('eLog did not answer within {}s'.format(self.timeout))
+                    self.logger.info('eLog {} failed ({}/{}): {}'.format(method, attempt + 1, self.retries + 1, e))
+                    self.close()
+                    if attempt == self.retries:
+                        raise ElogError(str(e))
+                    time.sleep(self.backoff * 2**attempt)
+
+    def find_entry(self, subject, category, digest=None, days=7, limit=50):
+        """Returns the id of a recent entry in category with this subject (and text hash), or None
+        """
+        ids = self._call('list', category=category, limit=limit, after='{}days'.format(days))
+        for entry_id in ids or []:
+            xml = self._call('get', int(entry_id))
+            if xml is not None and subject in str(xml) and (digest is None or 'nightlog:{}'.format(digest) in str(xml)):
+                return entry_id
+        return None
+
+    def _post(self, entry):
+        digest = text_hash(entry['text'])
+        if self.find_entry(entry['subject'], entry['category'], digest) is not None:
+            self.logger.info('eLog already has the entry "{}"'.format(entry['subject']))
+            return False
+        text = mark(entry['text'], digest, entry['textile'])
+        if self._stub():
+            e = dict(entry, text=text)
+        else:
+            from ECLAPI import ECLEntry
+            e = ECLEntry(entry['category'], text=text, textile=entry['textile'])
+            e.addSubject(entry['subject'])
+        response = self._call('post', e)
+        if response[0] != 200:
+            raise ElogError("eLog refused the entry: {}".format(response))
+        return True
+
+    def post(self, category, text, subject, textile=True):
+        """Posts an entry unless one with the same subject exists. Returns True if it was posted.
+        If the eLog cannot be reached the entry is put in the outbox and ElogError is raised
+        """
+        entry = {'category': category, 'text': text, 'subject': subject, 'textile': textile}
+        #A queued entry with the same subject is replaced by this one
+        try:
+            os.remove(self._outbox_file(entry))
+        except OSError:
+            pass
+        try:
+            if not self.flush_outbox():
+                raise ElogError('eLog outbox could not be sent')
+            return self._post(entry)
+        except ElogError as e:
+            self.queue(entry)
+            raise ElogError('{}. Entry kept in the eLog outbox'.format(e))
+
+    def _outbox_file(self, entry):
+        name = ''.join(c if c.isalnum() else '_' for c in entry['subject'])
+        return os.path.join(self.outbox_dir, '{}.json'.format(name))
+
+    def queue(self, entry):
+        os.makedirs(self.outbox_dir, exist_ok=True)
+        artifacts.write_text(self._outbox_file(entry), json.dumps(entry))
+
+    def outbox(self):
+        """Entries waiting to be sent, oldest first. Stale claims are put back first
+        """
+        for claim in glob.glob(os.path.join(self.outbox_dir, '*.json.*.sending')):
+            try:
+                if time.time() - os.path.getmtime(claim) > CLAIM_TIMEOUT:
+                    os.rename(claim, claim.split('.json.')[0] + '.json')
+            except OSError:
+                pass
+        files = []
+        for filen in glob.glob(os.path.join(self.outbox_dir, '*.json')):
+            try:
+                files.append((os.path.getmtime(filen), filen))
+            except OSError:
+                pass
+        return [filen for _, filen in sorted(files)]
+
+    def _claim(self, filen):
+        """Renames an entry of the outbox so that no other process sends it. Returns the new name, or None
+        """
+        claim = '{}.{}-{}.sending'.format(filen, socket.gethostname(), os.getpid())
+        try:
+            os.rename(filen, claim)
+        except OSError:
+            return None #sent by another process or replaced by a new post
+        os.utime(claim)
+        return claim
+
+    def flush_outbox(self):
+        """Posts the entries waiting in the outbox. Stops at the first one that fails and returns False
+        """
+        with self.outbox_lock:
+            self.last_flush = time.time()
+            for filen in self.outbox():
+                claim = self._claim(filen)
+                if claim is None:
+                    continue
+                try:
+                    entry = json.load(open(claim, 'r'))
+                    self._post(entry)
+                except ElogError as e:
+                    self.logger.info('eLog outbox not sent: {}'.format(e))
+                    if not os.path.exists(filen):
+                        os.rename(claim, filen)
+                    else:
+                        os.remove(claim) #a newer entry with this subject was queued meanwhile
+                    return False
+                os.remove(claim)
+            return True
+
+    def flush_in_background(self, interval=FLUSH_INTERVAL):
+        """Sends the outbox in a background thread at most every interval seconds, if it has entries.
+        There is one such thread per client
+        """
+        with self.flusher_lock:
+            if time.time() - self.last_flush < interval or (self.flusher is not None and self.flusher.is_alive()):
+                return False
+            self.last_flush = time.time()
+        if len(self.outbox()) == 0:
+            return False
+        self.flusher = threading.Thread(target=self.flush_outbox, name='elog-outbox', daemon=True)
+        self.flusher.start()
+        return True
+
+
+_client = None
+_lock = threading.Lock()
+
+def get_client(logger=None):
+    """ElogClient shared by all sessions of the process
+    """
+    global _client
+    with _lock:
+        if _client is None:
+            _client = ElogClient(logger=logger)
+        return _client
@@ -0,0 +1,98 @@
+"""
+Exposures of a night from the exposure database, for the exposure table on the Current NightLog page.
+
+The exposures are fetched incrementally and kept once per night for all sessions. Each session
+only asks for the page of exposures it is displaying.
+
+"""
+
+import time
+import threading
+
+import pandas as pd
+
+COLUMNS = ['date_obs','id','tileid','program','sequence','flavor','exptime','airmass','seeing']
+
+RECHECK = 20        #latest exposures that are fetched again, as they are filled in after readout
+MIN_INTERVAL = 10   #seconds between DB queries for the same night
+
+
+class ExposureList(object):
+    """All exposures of one night, sorted by id
+    """
+    def __init__(self, night):
+        self.night = night
+        self.df = None
+        self.last_update = 0
+        self.version = 0 #Increases each time the exposures change
+        self.lock = threading.Lock()
+
+    def update(self, conn):
+        """Gets exposures that are new or might have changed since the last query.
+        Returns True if anything changed
+        """
+        with self.lock:
+            if time.time() - self.last_update < MIN_INTERVAL:
+                return False
+            self.last_update = time.time()
+
+            if self.df is None or len(self.df) == 0:
+                query = f"SELECT * FROM exposure WHERE night = '{self.night}'"
+            else:
+                query = f"SELECT * FROM exposure WHERE night = '{self.night}' AND id > {int(self.df.id.max()) - RECHECK}"
+            new_df = pd.read_sql_query(query, conn)
+            if len(new_df) == 0:
+                return False
+            new_df['date_obs'] = new_df.date_obs.dt.tz_convert('US/Arizona')
+
+            if self.df is None:
+                df = new_df
+            else:
+                old = self.df[self.df.id.isin(new_df.id)]
+                if len(old) == len(new_df) and old[COLUMNS].reset_index(drop=True).equals(new_df.sort_values(by='id')[COLUMNS].reset_index(drop=True)):
+                    return False
+                df = pd.concat([self.df[~self.df.id.isin(new_df.id)], new_df])
+            self.df = df.sort_values(by='id').reset_index(drop=True)
+            self.version += 1
+            return True
+
+    def flavors(self):
+        if self.df is None:
+            return []
+        return sorted([str(f) for f in self.df.flavor.dropna().unique()])
+
+    def select(self, flavor=None, program=None, id_min=None, id_max=None):
+        """Exposures matching the filters, latest first
+        """
+        if self.df is None:
+            return pd.DataFrame(columns=COLUMNS)
+        df = self.df
+        if flavor not in [None, '', 'All']:
+            df = df[df.flavor == flavor]
+        if program not in [None, '', ' ']:
+            df = df[df.program.astype(str).str.contains(program, case=False, regex=False)]
+        if id_min is not None:
+            df = df[df.id >= id_min]
+        if id_max is not None:
+            df = df[df.id <= id_max]
+        return df[COLUMNS].sort_values(by='id', ascending=False)
+
+    def page(self, page, page_size, **filters):
+        """Returns the exposures on a page and the number of pages
+        """
+        df = self.select(**filters)
+        n_pages = max(1, -(-len(df) // page_size))
+        page = min(max(page, 0), n_pages - 1)
+        return df.iloc[page*page_size:(page+1)*page_size].reset_index(drop=True), page, n_pages
+
+
+_lists = {}
+_lock = threading.Lock()
+
+def get_exposure_list(night):
+    """Returns the ExposureList shared by all sessions for this night
+    """
+    with _lock:
+        if night not in _lists:
+            _lists[night] = ExposureList(night)
+        return _lists[night]
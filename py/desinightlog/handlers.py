@@ -0,0 +1,305 @@
+"""
+HTTP handlers served next to the Bokeh application by server.py.
+
+These let viewers and other tools read the NightLog without opening a Bokeh session.
+
+"""
+
+import os
+import json
+import hashlib
+import logging
+import datetime
+import threading
+
+import pandas as pd
+from collections import OrderedDict, deque
+
+from tornado.web import RequestHandler, HTTPError
+from tornado.ioloop import IOLoop
+from tornado.locks import Condition
+from tornado.iostream import StreamClosedError
+
+import nightlog as nl
+import nightdirs
+
+
+def nl_dir():
+    return os.environ['NL_DIR']
+
+def latest_night():
+    """Most recent night directory in NL_DIR that is not in the future
+    """
+    today = datetime.datetime.now().strftime("%Y%m%d")
+    nights = [d for d in nightdirs.get_night_dirs(nl_dir()).latest(10, before=today) if len(d) == 8]
+    if len(nights) == 0:
+        return None
+    return nights[0]
+
+def latest_file(root_dir, name):
+    """The most recently written of the kpno and nersc versions of a file, e.g. name='nightlog_{}.html'
+    """
+    files = [os.path.join(root_dir, name.format(loc)) for loc in ['kpno', 'nersc']]
+    files = [f for f in files if os.path.exists(f)]
+    if len(files) == 0:
+        return None
+    return max(files, key=os.path.getmtime)
+
+def mtime(path):
+    if path is None:
+        return None
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+SNAPSHOT_REFRESH = 60 #seconds between reloads by the browser
+
+SNAPSHOT_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta http-equiv="refresh" content="{refresh}">
+<title>DESI Night Log {night}</title>
+</head>
+<body>
+<p><em>Read-only view of the DESI Night Log, last rendered {rendered}. This page reloads every {refresh} seconds.</em></p>
+{nightlog}
+<h3>All Exposures</h3>
+{exposures}
+</body>
+</html>
+"""
+
+class SnapshotHandler(RequestHandler):
+    """Serves the latest rendered NightLog and exposure table as a static page.
+    The page is only rebuilt when the files behind it change, and tornado answers
+    If-None-Match with 304 using the etag of the page
+    """
+    _cache = {}
+    _lock = threading.Lock()
+
+    def get(self, night=None):
+        if night is None:
+            night = latest_night()
+        if night is None or not os.path.isdir(os.path.join(nl_dir(), night)):
+            raise HTTPError(404)
+        self.set_header('Content-Type', 'text/html; charset=UTF-8')
+        self.set_header('Cache-Control', 'public, max-age={}'.format(SNAPSHOT_REFRESH // 2))
+        self.write(self.get_page(night))
+
+    @classmethod
+    def get_page(cls, night):
+        root_dir = os.path.join(nl_dir(), night)
+        nightlog_html = latest_file(root_dir, 'nightlog_{}.html')
+        explist_file = latest_file(root_dir, 'explist_{}.csv')
+        key = (mtime(nightlog_html), mtime(explist_file))
+        with cls._lock:
+            cached = cls._cache.get(night)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+
+        if nightlog_html is None:
+            nightlog = 'The Night Log for {} has not been started.'.format(night)
+            rendered = '-'
+        else:
+            nightlog = open(nightlog_html).read()
+            rendered = datetime.datetime.fromtimestamp(key[0]).strftime('%Y-%m-%d %H:%M:%S')
+        exposures = ''
+        if explist_file is not None:
+            try:
+                exp_df = pd.read_csv(explist_file)
+                exp_df = exp_df[['date_obs','id','tileid','program','sequence','flavor','exptime','airmass','seeing']].sort_values(by='id',ascending=False)
+                exp_df = exp_df.rename(columns={"date_obs": "Time", "id":"Exp","tileid":'Tile','program':'Program','sequence':'Sequence',
+                    'flavor':'Flavor','exptime':'Exptime','airmass':'Airmass','seeing':'Seeing'})
+                exposures = exp_df.to_html(index=False, na_rep='-', float_format='%.2f')
+            except Exception as e:
+                exposures = 'Exposure list not available: {}'.format(e)
+
+        page = SNAPSHOT_PAGE.format(refresh=SNAPSHOT_REFRESH, night=night, rendered=rendered, nightlog=nightlog, exposures=exposures)
+        with cls._lock:
+            cls._cache[night] = (key, page)
+        return page
+
+
+class NightHandler(RequestHandler):
+    """Serves the contents of a night as JSON: plan, milestones, problems, exposure comments,
+    bad exposures and time use. The etag is computed from the size and modification time
+    of the input files, so a request with a matching If-None-Match is answered with 304
+    without reading any of them
+    """
+    _cache = {}
+    _lock = threading.Lock()
+    logger = logging.getLogger(__name__)
+
+    tables = OrderedDict([('plan', 'objectives'), ('milestones', 'milestone'), ('problems', 'obs_pb'),
+        ('exposures', 'obs_exp'), ('bad_exposures', 'bad_exp_list')])
+
+    def initialize(self):
+        self.nightlog = None
+
+    def get_nightlog(self, night):
+        if self.nightlog is None:
+            self.nightlog = nl.NightLog(night, 'kpno', self.logger)
+        return self.nightlog
+
+    def input_files(self):
+        log = self.nightlog
+        files = [getattr(log, attr) for attr in self.tables.values()] + [log.time_use, log.meta_json]
+        return [os.path.join(os.path.dirname(f), os.path.basename(f).replace('kpno', loc)) for f in files for loc in ['kpno', 'nersc']]
+
+    def compute_etag(self):
+        stats = []
+        for f in self.input_files():
+            try:
+                st = os.stat(f)
+                stats.append('{}:{}:{}'.format(f, st.st_mtime_ns, st.st_size))
+            except OSError:
+                pass
+        return '"{}"'.format(hashlib.md5('\n'.join(stats).encode('utf-8')).hexdigest())
+
+    def get(self, night=None):
+        if night is None:
+            night = latest_night()
+        if night is None or not os.path.isdir(os.path.join(nl_dir(), night)):
+            raise HTTPError(404)
+        self.get_nightlog(night)
+
+        self.set_etag_header()
+        self.set_header('Cache-Control', 'no-cache')
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        etag = self._headers['Etag']
+        with self._lock:
+            cached = self._cache.get(night)
+        if cached is None or cached[0] != etag:
+            cached = (etag, json.dumps(self.get_night(night)))
+            with self._lock:
+                self._cache[night] = cached
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(cached[1])
+
+    def get_night(self, night):
+        log = self.nightlog
+        data = OrderedDict()
+        data['night'] = night
+        for name, attr in self.tables.items():
+            df = log._combine_compare_csv_files(getattr(log, attr), bad=(name == 'bad_exposures'))
+            if df is None:
+                data[name] = []
+            else:
+                data[name] = json.loads(df.to_json(orient='records'))
+        time_use = log._open_kpno_file_first(log.time_use)
+        if os.path.exists(time_use):
+            data['time_use'] = json.loads(log.safe_read_csv(time_use).to_json(orient='records'))[0]
+        else:
+            data['time_use'] = None
+        meta_json = log._open_kpno_file_first(log.meta_json)
+        if os.path.exists(meta_json):
+            data['meta'] = json.load(open(meta_json, 'r'))
+        else:
+            data['meta'] = None
+        return data
+
+
+class EventBroker(object):
+    """Keeps the latest NightLog changes, numbered in order, and wakes up the event streams waiting for them.
+    Registered as a NightLog listener, so it sees every add_input, add_summary, add_bad_exp and delete_item
+    """
+    def __init__(self, size=1000):
+        self.events = deque(maxlen=size)
+        self.last_id = 0
+        self.lock = threading.Lock()
+        self.condition = Condition()
+        self.io_loop = None
+
+    def start(self):
+        self.io_loop = IOLoop.current()
+        nl.add_listener(self.publish)
+
+    def publish(self, event):
+        with self.lock:
+            self.last_id += 1
+            self.events.append((self.last_id, event))
+        if self.io_loop is not None:
+            self.io_loop.add_callback(self.condition.notify_all)
+
+    def since(self, last_id):
+        """Events after last_id. The second value is False if some of them are no longer kept
+        """
+        with self.lock:
+            if last_id > self.last_id:
+                return list(self.events), False
+            events = [(i, e) for i, e in self.events if i > last_id]
+            complete = len(self.events) == 0 or last_id >= self.events[0][0] - 1
+            return events, complete
+
+    def poll(self, last_id):
+        """Events after last_id, whether the client has to reload the night, and the id to continue from.
+        A client that missed events, or that comes from before a restart of the server, continues from
+        the latest event after the reset
+        """
+        events, complete = self.since(last_id)
+        if len(events) > 0:
+            return events, not complete, events[-1][0]
+        if not complete:
+            return events, True, self.last_id
+        return events, False, last_id
+
+    async def wait(self, timeout):
+        await self.condition.wait(timeout=datetime.timedelta(seconds=timeout))
+
+BROKER = EventBroker()
+
+
+class EventStreamHandler(RequestHandler):
+    """Server-sent event stream of changes to the NightLog. Clients can resume after a reconnect with
+    the Last-Event-ID header (or ?last_id=). If the events they missed are no longer kept, a 'reset'
+    event is sent and the client should reload the night from /api/night
+    """
+    keepalive = 15 #seconds
+
+    def initialize(self):
+        self.closed = False
+
+    def on_connection_close(self):
+        self.closed = True
+
+    async def get(self):
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_header('X-Accel-Buffering', 'no')
+        night = self.get_query_argument('night', None)
+        last_id = self.request.headers.get('Last-Event-ID', self.get_query_argument('last_id', None))
+        try:
+            last_id = int(last_id)
+        except (TypeError, ValueError):
+            last_id = BROKER.last_id
+
+        while not self.closed:
+            events, reset, last_id = BROKER.poll(last_id)
+            try:
+                if reset:
+                    self.write('event: reset\ndata: {}\n\n')
+                for i, event in events:
+                    if night is None or event['night'] == night:
+                        self.write('id: {}\nevent: {}\ndata: {}\n\n'.format(i, event['tab'], json.dumps(event)))
+                if len(events) == 0 and not reset:
+                    self.write(': keepalive\n\n')
+                await self.flush()
+            except StreamClosedError:
+                break
+            if BROKER.since(last_id)[0] == []:
+                await BROKER.wait(self.keepalive)
+
+
+def patterns():
+    """URL patterns for bokeh.server.server.Server(extra_patterns=...)
+    """
+    return [(r'/snapshot/?', SnapshotHandler),
+            (r'/snapshot/([0-9]{8})/?', SnapshotHandler),
+            (r'/api/night/?', NightHandler),
+            (r'/api/night/([0-9]{8})/?', NightHandler),
+            (r'/api/events/?', EventStreamHandler)]
@@ -0,0 +1,162 @@
+"""
+Stores the images uploaded with comments and problems, in a worker thread.
+
+The browser sends the image as a base64 string. Decoding, checking and writing it is done by
+a worker, so a large screenshot does not block the Bokeh sessions of the server. The entry that
+refers to the image is saved right away; until the image is stored the NightLog shows a
+placeholder in its place, and a NightLog event ('image') is sent when it is stored.
+
+Images are stored once per night under the sha1 of their content (<sha1>.png), so the same
+screenshot uploaded under several names is kept once; the uploaded name is a link to it. A
+thumbnail (<sha1>_thumb.png) is made at upload time when Pillow is available, and the NightLog
+shows the thumbnail with a link to the full image. images/index.json maps the uploaded names to
+the stored files.
+
+"""
+
+import os
+import io
+import json
+import base64
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import artifacts
+
+MAX_BYTES = int(os.environ.get('NIGHTLOG_MAX_IMAGE_BYTES', 20*1024*1024))
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+THUMB_SIZE = (400, 400)
+INDEX = 'index.json'
+
+PENDING = 'pending'
+STORED = 'stored'
+FAILED = 'failed'
+
+_status = {} #image file -> PENDING, STORED or 'failed: reason'
+_indexes = {} #image dir -> (mtime, index)
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='images')
+
+
+class ImageError(Exception):
+    pass
+
+
+def decode(img_data):
+    """Decodes and checks an uploaded png
+    """
+    if len(img_data) > MAX_BYTES*4//3 + 4:
+        raise ImageError('image is larger than {} MB'.format(MAX_BYTES//(1024*1024)))
+    try:
+        data = base64.b64decode(img_data)
+    except Exception as e:
+        raise ImageError('image is not valid base64: {}'.format(e))
+    if not data.startswith(PNG_SIGNATURE):
+        raise ImageError('image is not a png file')
+    return data
+
+def make_thumbnail(data, filen, size=THUMB_SIZE):
+    """Writes a png thumbnail that fits in size. Returns False if it cannot be made (e.g. Pillow is not installed)
+    """
+    try:
+        from PIL import Image
+        img = Image.open(io.BytesIO(data))
+        img.thumbnail(size)
+        out = io.BytesIO()
+        img.save(out, format='PNG', optimize=True)
+    except Exception as e:
+        logging.getLogger(__name__).info('No thumbnail for {}: {}'.format(filen, e))
+        return False
+    artifacts.write_bytes(filen, out.getvalue())
+    return True
+
+def _link(target, filen):
+    """Points the uploaded name to the stored file
+    """
+    if os.path.islink(filen) and os.readlink(filen) == target:
+        return
+    tmp = artifacts.tmp_path(filen)
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.symlink(target, tmp)
+    except OSError:
+        os.link(os.path.join(os.path.dirname(filen), target), tmp)
+    os.replace(tmp, filen)
+
+def read_index(image_dir):
+    """Uploaded name -> {'sha1', 'file', 'thumb'} of a night, reread only when the index changes
+    """
+    filen = os.path.join(image_dir, INDEX)
+    try:
+        mtime = os.path.getmtime(filen)
+    except OSError:
+        return {}
+    with _lock:
+        cached = _indexes.get(image_dir)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    try:
+        index = json.load(open(filen, 'r'))
+    except ValueError:
+        return {}
+    with _lock:
+        _indexes[image_dir] = (mtime, index)
+    return index
+
+def lookup(image_dir, img_name):
+    return read_index(image_dir).get(str(img_name))
+
+def _store(img_data, img_file):
+    data = decode(img_data)
+    image_dir = os.path.dirname(img_file)
+    os.makedirs(image_dir, exist_ok=True)
+    digest = hashlib.sha1(data).hexdigest()
+    entry = {'sha1': digest, 'file': digest + '.png', 'thumb': None}
+    if not os.path.exists(os.path.join(image_dir, entry['file'])):
+        artifacts.write_bytes(os.path.join(image_dir, entry['file']), data)
+    thumb = digest + '_thumb.png'
+    if os.path.exists(os.path.join(image_dir, thumb)) or make_thumbnail(data, os.path.join(image_dir, thumb)):
+        entry['thumb'] = thumb
+    _link(entry['file'], img_file)
+
+    with _lock:
+        filen = os.path.join(image_dir, INDEX)
+        index = json.load(open(filen, 'r')) if os.path.exists(filen) else {}
+        index[os.path.basename(img_file)] = entry
+        artifacts.write_text(filen, json.dumps(index))
+        _indexes[image_dir] = (os.path.getmtime(filen), index)
+
+def status(img_file):
+    """PENDING while the image is being stored, a string starting with FAILED if it could not be, else STORED
+    """
+    with _lock:
+        return _status.get(img_file, STORED)
+
+def submit(img_data, img_file, on_done=None, logger=None):
+    """Stores the image in the worker. on_done(img_file, status) is called from the worker thread
+    """
+    logger = logger or logging.getLogger(__name__)
+    with _lock:
+        _status[img_file] = PENDING
+
+    def run():
+        try:
+            _store(img_data, img_file)
+            result = STORED
+            logger.info('Image stored: {}'.format(img_file))
+        except Exception as e:
+            result = '{}: {}'.format(FAILED, e)
+            logger.info('Image {} not stored: {}'.format(img_file, e))
+        with _lock:
+            if result == STORED:
+                _status.pop(img_file, None)
+            else:
+                _status[img_file] = result
+        if on_done is not None:
+            on_done(img_file, result)
+        return result
+
+    return _executor.submit(run)
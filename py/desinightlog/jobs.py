@@ -0,0 +1,159 @@
+"""
+Runs long tasks, like the NightLog submission, in the background.
+
+A Job is a set of Steps with dependencies between them. A step runs once the steps it requires
+succeeded and the steps it comes after finished, successfully or not. Steps that are ready run
+in parallel, failed steps are retried with a growing delay, and each change of status is passed
+to on_update so it can be shown in the application. Steps marked with once=True are recorded in
+record_file with the job fingerprint and are skipped if the same content is submitted again.
+
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import artifacts
+
+_record_lock = threading.Lock() #record files are read and written by one job at a time
+
+
+class Step(object):
+    def __init__(self, name, func, requires=None, after=None, retries=0, backoff=5, once=False):
+        self.name = name
+        self.func = func
+        self.requires = requires or [] #steps that must succeed, the step is cancelled if one of them fails
+        self.after = after or [] #steps that must have finished, whatever their result
+        self.retries = retries
+        self.backoff = backoff #seconds before the first retry, doubled for each following one
+        self.once = once
+
+
+class Job(object):
+    def __init__(self, name, steps, fingerprint=None, record_file=None, on_update=None, logger=None, max_workers=4):
+        self.name = name
+        self.steps = OrderedDict((step.name, step) for step in steps)
+        self.fingerprint = fingerprint
+        self.record_file = record_file
+        self.on_update = on_update
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_workers = max_workers
+
+        self.status = OrderedDict((name, 'waiting') for name in self.steps)
+        self.errors = {}
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='job-{}'.format(self.name), daemon=True)
+        self.thread.start()
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def done(self):
+        return all(s in ['done', 'skipped'] for s in self.status.values())
+
+    def finished(self, name):
+        status = self.status[name]
+        return status not in ['waiting', 'running'] and not status.startswith('retrying')
+
+    def _set_status(self, name, status):
+        self.status[name] = status
+        self.logger.info('{} {}: {}'.format(self.name, name, status))
+        if self.on_update is not None:
+            try:
+                self.on_update(self)
+            except Exception as e:
+                self.logger.info('Problem updating job status: {}'.format(e))
+
+    def _read_record(self):
+        if self.record_file is None or not os.path.exists(self.record_file):
+            return {}
+        try:
+            return json.load(open(self.record_file, 'r'))
+        except Exception:
+            return {}
+
+    def _write_record(self, name):
+        if self.record_file is None:
+            return
+        #Steps finishing together, in this job or another, must not drop each other's entry
+        with _record_lock:
+            record = self._read_record()
+            record[name] = self.fingerprint
+            artifacts.write_text(self.record_file, json.dumps(record))
+
+    def _run_step(self, step):
+        attempt = 0
+        while True:
+            try:
+                step.func()
+                return
+            except Exception as e:
+                self.errors[step.name] = str(e)
+                if attempt >= step.retries:
+                    raise
+                delay = step.backoff * 2**attempt
+                attempt += 1
+                self._set_status(step.name, 'retrying in {}s ({}/{}): {}'.format(delay, attempt, step.retries, e))
+                time.sleep(delay)
+                self._set_status(step.name, 'running')
+
+    def run(self):
+        record = self._read_record()
+        pending = OrderedDict(self.steps)
+        futures = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while len(pending) > 0 or len(futures) > 0:
+                progressed = False
+                for name, step in list(pending.items()):
+                    required = [self.status[r] for r in step.requires]
+                    if any(r not in ['waiting', 'running', 'done', 'skipped'] and not r.startswith('retrying') for r in required):
+                        self._set_status(name, 'cancelled')
+                        pending.pop(name)
+                        progressed = True
+                    elif all(r in ['done', 'skipped'] for r in required) and all(self.finished(a) for a in step.after):
+                        pending.pop(name)
+                        progressed = True
+                        if step.once and self.fingerprint is not None and record.get(name) == self.fingerprint:
+                            self._set_status(name, 'skipped')
+                        else:
+                            self._set_status(name, 'running')
+                            futures[pool.submit(self._run_step, step)] = step
+                if len(futures) == 0:
+                    if not progressed:
+                        for name in pending:
+                            self._set_status(name, 'cancelled')
+                        pending.clear()
+                    continue
+                finished, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = futures.pop(future)
+                    try:
+                        future.result()
+                        if step.once:
+                            self._write_record(step.name)
+                        self._set_status(step.name, 'done')
+                    except Exception as e:
+                        self._set_status(step.name, 'failed: {}'.format(e))
+
+
+_jobs = {}
+_lock = threading.Lock()
+
+def start_job(key, steps, **kwargs):
+    """Starts a Job unless one with the same key is still running.
+    Returns the job and whether it was started
+    """
+    with _lock:
+        job = _jobs.get(key)
+        if job is not None and job.running():
+            return job, False
+        job = Job(key, steps, **kwargs)
+        _jobs[key] = job
+        job.start()
+        return job, True
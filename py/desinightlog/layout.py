@@ -521,12 +521,25 @@ class Layout():
 
         self.exp_table = DataTable(source=self.explist_source, columns=exp_columns, width=1000)
 
+        #Exposure Table paging and filters. Only the page shown is sent to the browser
+        self.exp_flavor_select = Select(title='Flavor', value='All', options=['All'], width=150)
+        self.exp_program_input = TextInput(title='Program', placeholder='dark', width=200)
+        self.exp_id_min = TextInput(title='First Exposure', placeholder='12345', width=150)
+        self.exp_id_max = TextInput(title='Last Exposure', placeholder='12399', width=150)
+        self.exp_filter_btn = Button(label='Filter', css_classes=['load_button'], width=75)
+        self.exp_page_prev_btn = Button(label='Newer', css_classes=['load_button'], width=75)
+        self.exp_page_next_btn = Button(label='Older', css_classes=['load_button'], width=75)
+        self.exp_page_text = Div(text=' ', width=200)
+        self.exp_table_filters = layout([[self.exp_flavor_select, self.exp_program_input, self.exp_id_min, self.exp_id_max, self.exp_filter_btn],
+                                        [self.exp_page_prev_btn, self.exp_page_text, self.exp_page_next_btn]])
+
         #For Lead Observer
         nl_layout_0 = layout([self.buffer,self.title,
                             self.nl_subtitle,
                             self.nl_alert,
                             self.nl_text,
                             self.exptable_alert,
+                            self.exp_table_filters,
                             self.exp_table,
                             self.submit_text,
                             self.nl_submit_btn], width=1000)
@@ -539,6 +552,7 @@ class Layout():
                             self.nl_alert,
                             self.nl_text,
                             self.exptable_alert,
+                            self.exp_table_filters,
                             self.exp_table], width=1000)
 
         self.nl_tab_1 = Panel(child=nl_layout_1, title="Current DESI Night Log")
@@ -554,6 +568,9 @@ class Layout():
         self.ns_next_date_btn = Button(label='Next Night', css_classes=['add_button'])
         self.ns_last_date_btn = Button(label='Previous Night', css_classes=['load_button'])
         self.ns_html = Div(text='',width=800)
+        self.search_input = TextInput(title='Search all NightLogs (problems, exposure comments, milestones, summaries)', width=500)
+        self.search_btn = Button(label='Search', css_classes=['init_button'])
+        self.search_results = Div(text='',width=800)
 
         #Layout
         ns_layout = layout([self.buffer,
@@ -561,6 +578,42 @@ class Layout():
                             self.ns_inst,
                             [self.ns_date_input, self.ns_date_btn],
                             [self.ns_last_date_btn, self.ns_next_date_btn],
+                            [self.search_input, self.search_btn],
+                            self.search_results,
                             self.ns_html], width=1000)
         self.ns_tab = Panel(child=ns_layout, title='Night Summary Index')
 
+    def get_trends_layout(self):
+        """Page with the problems and alarms of many nights (rollups.py)
+        """
+        self.trends_subtitle = Div(text='Problem Trends', css_classes=['subt-style'])
+        self.trends_inst = Div(text='Problems of all nights by alarm_id. Leave the dates empty for all nights, and enter an alarm_id to plot only that alarm.', css_classes=['inst-style'], width=1000)
+        self.trends_first = TextInput(title='First night (YYYYMMDD)', value='', width=150)
+        self.trends_last = TextInput(title='Last night (YYYYMMDD)', value='', width=150)
+        self.trends_alarm = TextInput(title='alarm_id', value='', width=150)
+        self.trends_period = Select(title='Period', value='week', options=['night', 'week', 'month'], width=150)
+        self.trends_btn = Button(label='Update', css_classes=['init_button'], width=150)
+        self.trends_alert = Div(text=' ', css_classes=['alert-style'])
+
+        self.trends_source = ColumnDataSource(pd.DataFrame(columns=['alarm_id', 'count', 'nights', 'first', 'last', 'mean_hour']))
+        trends_columns = [TableColumn(field='alarm_id', title='alarm_id', width=100),
+                   TableColumn(field='count', title='Problems', width=80),
+                   TableColumn(field='nights', title='Nights', width=80),
+                   TableColumn(field='first', title='First', width=150),
+                   TableColumn(field='last', title='Last', width=150),
+                   TableColumn(field='mean_hour', title='Mean hours after noon', width=150)]
+        self.trends_table = DataTable(source=self.trends_source, columns=trends_columns, fit_columns=False, width=1000, height=300)
+
+        self.trends_counts_source = ColumnDataSource({'period': [], 'count': []})
+        self.trends_plot = figure(plot_width=1000, plot_height=300, x_axis_type='datetime', x_axis_label='Period', y_axis_label='Problems',
+                                  tools='pan,wheel_zoom,reset,save')
+        self.trends_bars = self.trends_plot.vbar(x='period', top='count', width=0.8*86400000, source=self.trends_counts_source)
+
+        trends_layout = layout([self.buffer,
+                            self.trends_subtitle,
+                            self.trends_inst,
+                            [self.trends_first, self.trends_last, self.trends_alarm, self.trends_period, self.trends_btn],
+                            self.trends_alert,
+                            self.trends_table,
+                            self.trends_plot], width=1000)
+        self.trends_tab = Panel(child=trends_layout, title='Problem Trends')
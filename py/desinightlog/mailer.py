@@ -0,0 +1,210 @@
+"""
+Spools emails to an outbox directory and delivers them from a background thread.
+
+Messages are written to the outbox as soon as they are built, so the application does not wait
+on the SMTP server, and they survive a restart until they are delivered. The SMTP server is
+localhost by default and can be changed with SMTP_HOST and SMTP_PORT, e.g. to a local stand-in
+for testing.
+
+Messages refused by the SMTP server for good (5xx replies, refused addresses) are tried
+MAX_ATTEMPTS times and then moved to the failed/ directory of the outbox; other errors are
+retried until the message is delivered. smtpstub.py is a stand-in of the SMTP server.
+
+Images are base64 encoded in lines short enough for SMTP. Images larger than the size budget
+are downscaled, or left out so they can be linked instead.
+
+"""
+
+import os
+import io
+import json
+import time
+import glob
+import base64
+import logging
+import smtplib
+import threading
+import uuid
+
+from email import encoders
+from email.mime.image import MIMEImage
+
+import artifacts
+
+IMAGE_BUDGET = int(os.environ.get('NIGHTLOG_EMAIL_IMAGE_BUDGET', 2*1024*1024)) #bytes per image
+EMAIL_BUDGET = int(os.environ.get('NIGHTLOG_EMAIL_BUDGET', 8*1024*1024)) #bytes of images per email
+MAX_ATTEMPTS = 3 #attempts of a message refused by the SMTP server before it is moved to failed/
+
+QUEUED = 'queued'
+SENT = 'sent'
+FAILED = 'failed'
+
+
+def fit_image(data, budget=IMAGE_BUDGET):
+    """Returns the png data if it fits in budget, a downscaled version if it can be made to fit, else None
+    """
+    if len(data) <= budget:
+        return data
+    if budget <= 0:
+        return None
+    try:
+        from PIL import Image
+        img = Image.open(io.BytesIO(data))
+        scale = (budget / len(data))**0.5
+        for _ in range(4):
+            size = (max(1, int(img.width*scale)), max(1, int(img.height*scale)))
+            out = io.BytesIO()
+            img.resize(size, Image.LANCZOS).save(out, format='PNG', optimize=True)
+            if out.tell() <= budget:
+                return out.getvalue()
+            scale *= 0.7
+    except Exception as e:
+        logging.getLogger(__name__).info('Could not downscale image: {}'.format(e))
+    return None
+
+def permanent(e):
+    """True for SMTP errors that trying again will not fix: 5xx replies and recipients refused with one
+    """
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in e.recipients.values())
+    if isinstance(e, smtplib.SMTPResponseException):
+        return e.smtp_code >= 500
+    return False
+
+def encode_image(data):
+    """base64 in lines of 76 characters, as needed in the email
+    """
+    return base64.encodebytes(data).decode('ascii')
+
+def image_part(b64, filename):
+    """Image attachment from already base64 encoded data
+    """
+    part = MIMEImage(b64, 'png', _encoder=encoders.encode_noop)
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', 'attachment; filename={}'.format(filename))
+    return part
+
+
+class Outbox(object):
+    def __init__(self, spool_dir, host=None, port=None, interval=60, max_attempts=MAX_ATTEMPTS, logger=None):
+        self.spool_dir = spool_dir
+        self.failed_dir = os.path.join(spool_dir, 'failed')
+        self.host = host or os.environ.get('SMTP_HOST', 'localhost')
+        self.port = int(port or os.environ.get('SMTP_PORT', 0))
+        self.interval = interval #seconds between delivery attempts while messages are waiting
+        self.max_attempts = max_attempts
+        self.callbacks = {} #path of a message -> function called with its path and status once it is sent or failed
+        self.logger = logger or logging.getLogger(__name__)
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def spool(self, msg, sender, recipients, on_done=None):
+        """Writes the message to the outbox and wakes up the sender. Returns the path of the message
+        """
+        os.makedirs(self.spool_dir, exist_ok=True)
+        name = '{}_{}'.format(time.strftime('%Y%m%dT%H%M%S'), uuid.uuid4().hex[:8])
+        path = os.path.join(self.spool_dir, name)
+        artifacts.write_text(path + '.json', json.dumps({'sender': sender, 'recipients': list(recipients), 'message': msg.as_string()}))
+        if on_done is not None:
+            self.callbacks[path + '.json'] = on_done
+        self.logger.info('Email spooled to {}'.format(path + '.json'))
+        self.start()
+        self.wakeup.set()
+        return path + '.json'
+
+    def pending(self):
+        return sorted(glob.glob(os.path.join(self.spool_dir, '*.json')))
+
+    def status(self, path):
+        """QUEUED while the message waits in the outbox, FAILED if it was moved to failed/, else SENT
+        """
+        if os.path.exists(path):
+            return QUEUED
+        if os.path.exists(os.path.join(self.failed_dir, os.path.basename(path))):
+            return FAILED
+        return SENT
+
+    def _done(self, path, status):
+        func = self.callbacks.pop(path, None)
+        if func is not None:
+            try:
+                func(path, status)
+            except Exception as e:
+                self.logger.info('Email callback failed: {}'.format(e))
+
+    def _fail(self, path, reason):
+        os.makedirs(self.failed_dir, exist_ok=True)
+        os.replace(path, os.path.join(self.failed_dir, os.path.basename(path)))
+        self.logger.info('Email {} moved to {}: {}'.format(path, self.failed_dir, reason))
+        self._done(path, FAILED)
+
+    def deliver(self):
+        """Sends the waiting messages. Returns the number that could not be sent
+        """
+        with self.lock:
+            pending = self.pending()
+            if len(pending) == 0:
+                return 0
+            try:
+                s = smtplib.SMTP(self.host, self.port, timeout=60)
+            except Exception as e:
+                self.logger.info('Cannot connect to SMTP server {}: {}'.format(self.host, e))
+                return len(pending)
+            failed = 0
+            try:
+                for path in pending:
+                    try:
+                        item = json.load(open(path, 'r'))
+                    except ValueError as e:
+                        failed += 1
+                        self._fail(path, e)
+                        continue
+                    try:
+                        s.sendmail(item['sender'], item['recipients'], item['message'])
+                    except Exception as e:
+                        failed += 1
+                        if not permanent(e):
+                            self.logger.info('Email {} not sent: {}'.format(path, e))
+                            continue
+                        item['attempts'] = item.get('attempts', 0) + 1
+                        if item['attempts'] >= self.max_attempts:
+                            self._fail(path, e)
+                        else:
+                            artifacts.write_text(path, json.dumps(item))
+                            self.logger.info('Email {} refused ({} of {} attempts): {}'.format(path, item['attempts'], self.max_attempts, e))
+                        continue
+                    os.remove(path)
+                    self.logger.info("Email sent")
+                    self._done(path, SENT)
+            finally:
+                try:
+                    s.quit()
+                except Exception:
+                    pass
+            return failed
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.deliver()
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name='mail-outbox', daemon=True)
+            self.thread.start()
+
+
+_outbox = None
+_lock = threading.Lock()
+
+def get_outbox(logger=None):
+    """Outbox shared by all sessions of the process, in NL_DIR/ops/mail_outbox
+    """
+    global _outbox
+    with _lock:
+        if _outbox is None:
+            _outbox = Outbox(os.path.join(os.environ['NL_DIR'], 'ops', 'mail_outbox'), logger=logger)
+            _outbox.start()
+        return _outbox
@@ -0,0 +1,65 @@
+"""
+Sorted listing of the night directories (YYYYMMDD) in NL_DIR.
+
+The listing is kept in memory and only updated when the mtime of NL_DIR changes, i.e. when a
+directory was added or removed. Only the new entries are checked, so opening a session does not
+list and stat the whole archive.
+
+"""
+
+import os
+import bisect
+import threading
+
+
+class NightDirs(object):
+    def __init__(self, nl_dir):
+        self.nl_dir = nl_dir
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.names = set() #every entry of NL_DIR, to only check new ones
+        self.nights = [] #sorted night directories
+
+    def _is_night(self, name):
+        try:
+            int(name)
+        except ValueError:
+            return False
+        return os.path.isdir(os.path.join(self.nl_dir, name))
+
+    def update(self):
+        mtime = os.path.getmtime(self.nl_dir)
+        with self.lock:
+            if mtime == self.mtime:
+                return
+            names = set(os.listdir(self.nl_dir))
+            for name in self.names - names:
+                i = bisect.bisect_left(self.nights, name)
+                if i < len(self.nights) and self.nights[i] == name:
+                    del self.nights[i]
+            for name in names - self.names:
+                if self._is_night(name):
+                    bisect.insort(self.nights, name)
+            self.names = names
+            self.mtime = mtime
+
+    def latest(self, n=10, before=None):
+        """The n most recent nights, newest first, optionally only those up to night before
+        """
+        self.update()
+        with self.lock:
+            end = len(self.nights) if before is None else bisect.bisect_right(self.nights, str(before))
+            return self.nights[max(0, end - n):end][::-1]
+
+
+_dirs = {}
+_lock = threading.Lock()
+
+def get_night_dirs(nl_dir=None):
+    """NightDirs of NL_DIR shared by all sessions of the process
+    """
+    nl_dir = nl_dir or os.environ['NL_DIR']
+    with _lock:
+        if nl_dir not in _dirs:
+            _dirs[nl_dir] = NightDirs(nl_dir)
+        return _dirs[nl_dir]
@@ -11,6 +11,30 @@ import numpy as np
 from datetime import datetime,timezone
 from collections import OrderedDict
 
+import cameras
+import artifacts
+import images
+
+#Functions called with an event dict each time a NightLog commits a change to its input files
+_listeners = []
+
+def add_listener(func):
+    """Register func(event) to be called whenever any NightLog in this process changes its inputs
+    """
+    if func not in _listeners:
+        _listeners.append(func)
+
+def remove_listener(func):
+    if func in _listeners:
+        _listeners.remove(func)
+
+def web_root(obsday):
+    """URL of the night directory on the NightLog web server
+    """
+    if os.environ['USER'].lower() == 'desiobserver':
+        return f'http://desi-4.kpno.noirlab.edu:8090/{obsday}'
+    return f'http://desi-www.kpno.noirlab.edu:8090/nightlogs/{obsday}'
+
 
 class NightLog(object):
     """
@@ -37,10 +61,7 @@ class NightLog(object):
         self.location = location
         self.logger = logger
 
-        if os.environ['USER'].lower() == 'desiobserver':
-            self.server =  f'http://desi-4.kpno.noirlab.edu:8090/{self.obsday}/images'
-        else:
-            self.server =  f'http://desi-www.kpno.noirlab.edu:8090/nightlogs/{self.obsday}/images'
+        self.server = web_root(self.obsday) + '/images'
 
         #Directory structure 
         self.root_dir = os.path.join(os.environ['NL_DIR'], self.obsday)
@@ -213,6 +234,7 @@ class NightLog(object):
         df = df.drop([idx])
         df.reset_index(inplace=True, drop=True)
         df.to_csv(file, index=False)
+        self._notify('delete', tab, {'Time': time, 'user': user})
 
     ##Add items to csv files that are then written to NightLog
     def add_input(self, data, tab, img_name=None, img_data=None):
@@ -241,12 +263,13 @@ class NightLog(object):
             data.append(img_name)
 
         if str(img_name) not in ['None','nan','',' ',np.nan] and str(img_data) not in ['None','nan','',' ',np.nan]:
-            # if img_filen is a bytearray we have received an image in base64 string (from local upload)
+            # img_data is the base64 string of an image uploaded from a local file
             # images are stored in the images directory
-            if isinstance(img_data, bytes):
-                self._upload_and_save_image(img_data, img_name)
+            if isinstance(img_data, (bytes, str)):
+                self._upload_and_save_image(img_data, img_name, tab)
         
         df = self.write_csv(data, cols, file)
+        self._notify('add', tab, OrderedDict(zip(cols, [str(d) for d in data])))
 
     def add_summary(self, data):
         """Adds summary inputs to csv file
@@ -260,10 +283,11 @@ class NightLog(object):
             df.at[0,row] = str(value)
 
         df.to_csv(self.summary_file, index=False)
+        self._notify('add', 'summary', OrderedDict((k, str(v)) for k, v in data.items()))
 
     def add_bad_exp(self, data):
         if not os.path.exists(self.bad_exp_list):
-            df = pd.DataFrame(columns=['NIGHT','EXPID','BAD','BADCAMS','COMMENT'])
+            df = pd.DataFrame(columns=['NIGHT','EXPID','BAD','BADCAMS','COMMENT','CAMMASK'])
             df.to_csv(self.bad_exp_list, index=False)
         else:
             df = self.safe_read_csv(self.bad_exp_list)
@@ -272,7 +296,22 @@ class NightLog(object):
         df = pd.concat([df, this_df])
         df = df.drop_duplicates(subset=['EXPID'], keep='last')
         df = df.astype({"NIGHT":int, "EXPID": int,"BAD":bool,"BADCAMS":str,"COMMENT":str})
+        #30 bit mask of the bad cameras, see cameras.py
+        df['CAMMASK'] = cameras.masks_from_badcams(df.BADCAMS, df.BAD)
         df.to_csv(self.bad_exp_list, index=False)
+        for row in this_df.to_dict('records'):
+            self._notify('add', 'bad_exp', OrderedDict((k, str(v)) for k, v in row.items()))
+
+    def _notify(self, action, tab, data=None):
+        """Passes a change made to the input files to every registered listener
+        """
+        event = {'night': self.obsday, 'location': self.location, 'action': action, 'tab': tab,
+                 'time': datetime.now().strftime("%Y%m%dT%H:%M:%S"), 'data': data}
+        for func in list(_listeners):
+            try:
+                func(event)
+            except Exception as e:
+                self.logger.info('NightLog listener failed: {}'.format(e))
 
     def check_exp_times(self, file):
         """Check if meta data about an exposure exists in database and add that info to comment. If there is a match, then
@@ -292,7 +331,7 @@ class NightLog(object):
                             df.at[index, 'Time'] = time
                     except:
                         pass
-                df.to_csv(file,index=False)
+                artifacts.write_csv(df, file, index=False)
         
 
     ##Loads items to Report() based on timestamp/exposure number. These values are pulled from the csv files
@@ -345,19 +384,28 @@ class NightLog(object):
         except Exception as e:
             return False, e
 
-    def _upload_and_save_image(self, img_data, img_name):
-        import base64
-        # create images directory if necessary
-        if not os.path.exists(self.image_dir):
-            os.makedirs(self.image_dir)
+    def _upload_and_save_image(self, img_data, img_name, tab=None):
+        """Decodes and writes the image in the background (images.py). The NightLog shows a placeholder until it is stored
+        """
         img_file = os.path.join(self.image_dir, img_name)
-        with open(img_file, "wb") as fh:
-            fh.write(base64.decodebytes(img_data))
+        def done(img_file, status):
+            self._notify('image', tab, {'img_name': img_name, 'status': status})
+        images.submit(img_data, img_file, on_done=done, logger=self.logger)
 
     def _write_image_tag(self, img_file, img_name, comments = None, width=400, height=400):        
         img_file.write("<br/>")
         #img_file.write("h5. %s<br/>" % img_name)
-        img_file.write('<img src="%s/%s" width=%s height=%s alt="Uploaded image %s"><br/>' % (self.server,img_name,str(width),str(height),img_name))
+        status = images.status(os.path.join(self.image_dir, str(img_name)))
+        if status == images.PENDING:
+            img_file.write('<em>Image %s is being uploaded</em><br/>' % img_name)
+        elif status.startswith(images.FAILED):
+            img_file.write('<em>Image %s could not be uploaded (%s)</em><br/>' % (img_name, status))
+        else:
+            entry = images.lookup(self.image_dir, img_name)
+            if entry is not None and entry['thumb'] is not None:
+                img_file.write('<a href="%s/%s"><img src="%s/%s" alt="Uploaded image %s"></a><br/>' % (self.server,entry['file'],self.server,entry['thumb'],img_name))
+            else:
+                img_file.write('<img src="%s/%s" width=%s height=%s alt="Uploaded image %s"><br/>' % (self.server,img_name,str(width),str(height),img_name))
         if isinstance(comments, str):
             img_file.write("<br>{}<br/>".format(comments))
 
@@ -579,7 +627,7 @@ class NightLog(object):
                 Deg12Time = ( datetime.strptime(meta_dict['dawn_12_deg'], '%Y%m%dT%H:%M')-datetime.strptime(meta_dict['dusk_12_deg'], '%Y%m%dT%H:%M') ).seconds/3600
                 obs_items['12deg'] = Deg12Time
                 df['12deg'] = Deg12Time
-                df.to_csv(f)
+                artifacts.write_csv(df, f)
             file_nl.write("<br/><br/>")
             file_nl.write("Time Use (hrs):<br/>")
             file_nl.write("<ul>")
@@ -628,6 +676,7 @@ class NightLog(object):
         if df is not None:
             try:
                 file_nl.write("<h3> Bad Exposures</h3>")
+                df = df.drop(columns=['CAMMASK'], errors='ignore')
                 df_html = df.to_html(index=False, justify='center',float_format='%.2f',na_rep='-',classes='badtable',max_cols=5)
                 for line in df_html:
                     file_nl.write(line)
@@ -635,7 +684,7 @@ class NightLog(object):
                 self.logger.info('writing to bad exposure list: {}'.format(e))
 
     def write_intro(self):
-        file_intro=open(self.header_html,'w')
+        file_intro=artifacts.TextArtifact(self.header_html) #written at close if it changed
         try:
             f = self._open_kpno_file_first(self.meta_json)
             meta_dict = json.load(open(f,'r'))
@@ -694,7 +743,7 @@ class NightLog(object):
         """
             Merge together all the different files into one '.txt' file to copy past on the eLog.
         """
-        file_nl=open(self.nightlog_html, 'w')
+        file_nl=artifacts.TextArtifact(self.nightlog_html) #written at close if it changed
         file_nl.write("<h1>DESI Night Summary %s</h1>" % str(self.obsday))
 
         #Write the meta_html here
@@ -0,0 +1,317 @@
+"""
+Archived Night Summaries (NightSummary<night>.html in the night directory).
+
+The images of a Night Summary are kept as png files next to it and referenced by their file name,
+so the html stays small and can be browsed from the night directory. In the application the
+images are loaded from the night directory on the NightLog web server (nightlog.web_root), and the
+Night Summary tab only sends the html. Summaries written with inline base64 images are shown as
+they are; their images are moved to files by
+
+    cd py/desinightlog
+    python nightsum.py --externalize [--first 20210101] [--last 20221231]
+
+SummaryIndex keeps night -> summary file in NL_DIR/ops/nightsum_index.json. email_nightsum adds
+the summaries it writes. A night that is not in the index is looked up in its own directory, and
+the summaries written elsewhere are found by a rescan that only lists the night directories whose
+mtime changed since the last scan.
+
+SummaryCache keeps the html of recently viewed summaries, up to a number of bytes, and reads the
+nights before and after the one shown in the background, so paging through nights is instant.
+
+"""
+
+import os
+import re
+import json
+import base64
+import logging
+import argparse
+import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import nightlog as nl
+import artifacts
+import sources
+
+CACHE_BYTES = int(os.environ.get('NIGHTLOG_SUMMARY_CACHE_BYTES', 64*1024*1024))
+PREFETCH = 1 #nights before and after the one shown
+
+_exp_html = {} #explist file -> (mtime, html)
+_exp_lock = threading.Lock()
+
+_data_uri = re.compile(r'<img src="data:image/png;base64,([A-Za-z0-9+/=\s]+)" \\?>')
+_local_src = re.compile(r'(<img src=")([\w.-]+\.png")')
+
+
+def summary_file(root_dir, night):
+    return os.path.join(root_dir, 'NightSummary{}.html'.format(night))
+
+def exposures_html(explist_file):
+    """Table of exposures as html. The html is reused until the exposure list changes
+    """
+    mtime = os.path.getmtime(explist_file)
+    with _exp_lock:
+        cached = _exp_html.get(explist_file)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    exp_df = pd.read_csv(explist_file)
+    exp_df = exp_df[['date_obs','id','tileid','program','sequence','flavor','exptime','airmass','seeing']].sort_values(by='id',ascending=False)
+    exp_df = exp_df.rename(columns={"date_obs": "Time", "id":
+    "Exp","tileid":'Tile','program':'Program','sequence':'Sequence','flavor':'Flavor','exptime':'Exptime','airmass':'Airmass','seeing':'Seeing'})
+    exp_html = exp_df.to_html()
+    with _exp_lock:
+        _exp_html[explist_file] = (mtime, exp_html)
+    return exp_html
+
+def compose(log):
+    """Body of the NightSummary of a NightLog: the rendered NightLog (KPNO first) and the table of exposures
+    """
+    f = log._open_kpno_file_first(log.nightlog_html)
+    nl_html = open(f,'r').read()
+    if os.path.exists(log.explist_file):
+        nl_html += ("<h3 id='exposures'>Exposures</h3>")
+        nl_html += exposures_html(log.explist_file)
+    return nl_html
+
+def image_tag(filename):
+    return '<img src="{}" \\>'.format(filename)
+
+def split_images(html, night):
+    """Replaces the inline images of a summary by file names. Returns the new html and {file name: png data}
+    """
+    images = {}
+    def save(match):
+        name = 'NightSummary{}_{}.png'.format(night, len(images) + 1)
+        images[name] = base64.b64decode(''.join(match.group(1).split()))
+        return image_tag(name)
+    return _data_uri.sub(save, html), images
+
+def image_names(html):
+    """File names of the images next to the summary that its html refers to
+    """
+    return [m.group(2)[:-1] for m in _local_src.finditer(html)]
+
+def externalize(filen, night, logger=None):
+    """Moves the inline images of an archived summary to png files next to it. Returns the new html
+    """
+    logger = logger or logging.getLogger(__name__)
+    root_dir = os.path.dirname(filen)
+    new_html, images = split_images(open(filen, 'r').read(), night)
+    for name, data in images.items():
+        artifacts.write_bytes(os.path.join(root_dir, name), data)
+    if len(images) > 0:
+        artifacts.write_text(filen, new_html)
+        logger.info('Moved {} images of {} to separate files'.format(len(images), filen))
+    return new_html
+
+def read(filen, night):
+    """html of a summary for the Night Summary tab, with the images pointing to the night directory on the web server
+    """
+    html = open(filen, 'r').read()
+    return _local_src.sub(lambda m: '{}{}/{}'.format(m.group(1), nl.web_root(night), m.group(2)), html)
+
+
+class SummaryIndex(object):
+    def __init__(self, nl_dir, index_file=None, logger=None):
+        self.nl_dir = nl_dir
+        self.index_file = index_file or os.path.join(nl_dir, 'ops', 'nightsum_index.json')
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.index = None
+        self.index_mtime = None
+
+    def _load(self):
+        """Reads the index file if it was changed, e.g. by the server at the other site
+        """
+        try:
+            mtime = os.path.getmtime(self.index_file)
+        except OSError:
+            mtime = None
+        if self.index is None or mtime != self.index_mtime:
+            if mtime is not None:
+                try:
+                    self.index = json.load(open(self.index_file, 'r'))
+                    self.index_mtime = mtime
+                except ValueError:
+                    self.index = None
+            if self.index is None:
+                self.index = {'nights': {}, 'night_dirs': {}}
+            if 'night_dirs' not in self.index:
+                #Index written when all the directories of NL_DIR were scanned
+                self.index = {'nights': {n: rel for n, rel in self.index['nights'].items() if len(n) == 8 and n.isdigit()},
+                              'night_dirs': {}}
+        return self.index
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+        artifacts.write_text(self.index_file, json.dumps(self.index))
+        self.index_mtime = os.path.getmtime(self.index_file)
+
+    def add(self, night, filen):
+        with self.lock:
+            self._load()['nights'][str(night)] = os.path.relpath(filen, self.nl_dir)
+            self._save()
+
+    def rescan(self):
+        """Updates the index from the night directories (YYYYMMDD) of NL_DIR that changed. A night
+        directory whose mtime did not change has the same summary, so it is not listed again
+        """
+        nights = sources.nights(self.nl_dir)
+        with self.lock:
+            index = self._load()
+            mtimes = index['night_dirs']
+            changed = False
+            for night in nights:
+                path = os.path.join(self.nl_dir, night)
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue
+                if mtimes.get(night) == mtime:
+                    continue
+                names = [de.name for de in os.scandir(path) if 'NightSummary' in de.name and de.name.endswith('.html')]
+                if len(names) > 0:
+                    name = os.path.basename(summary_file(path, night))
+                    index['nights'][night] = os.path.join(night, name if name in names else max(names))
+                else:
+                    index['nights'].pop(night, None)
+                mtimes[night] = mtime
+                changed = True
+            for night in set(mtimes) - set(nights):
+                del mtimes[night]
+                index['nights'].pop(night, None)
+                changed = True
+            if changed:
+                self._save()
+
+    def nights(self):
+        """night -> path of the summary, for all the summaries in NL_DIR
+        """
+        self.rescan()
+        with self.lock:
+            rels = dict(self._load()['nights'])
+        return {night: os.path.join(self.nl_dir, rel) for night, rel in rels.items()}
+
+    def get(self, night):
+        """Path of the summary of a night, or None. A night that is not in the index is looked up in
+        its own directory only, as get is called by the sessions and the prefetch of nights that may not exist
+        """
+        night = str(night)
+        with self.lock:
+            rel = self._load()['nights'].get(night)
+        if rel is not None and os.path.exists(os.path.join(self.nl_dir, rel)):
+            return os.path.join(self.nl_dir, rel)
+        filen = summary_file(os.path.join(self.nl_dir, night), night)
+        if not os.path.exists(filen):
+            return None
+        self.add(night, filen)
+        return filen
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index(logger=None):
+    """SummaryIndex of NL_DIR shared by all sessions of the process
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SummaryIndex(os.environ['NL_DIR'], logger=logger)
+        return _index
+
+
+class SummaryCache(object):
+    """Least recently used summaries, limited by the total size of their html
+    """
+    def __init__(self, index, max_bytes=CACHE_BYTES, logger=None):
+        self.index = index
+        self.max_bytes = max_bytes
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.items = OrderedDict() #night -> (path, mtime, html)
+        self.size = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='nightsum')
+
+    def get(self, night):
+        """html of the summary of a night for the Night Summary tab, or None if there is none
+        """
+        night = str(night)
+        filen = self.index.get(night)
+        if filen is None:
+            return None
+        mtime = os.path.getmtime(filen)
+        with self.lock:
+            item = self.items.get(night)
+            if item is not None and item[:2] == (filen, mtime):
+                self.items.move_to_end(night)
+                return item[2]
+        html = read(filen, night)
+        self._put(night, (filen, mtime, html))
+        return html
+
+    def _put(self, night, item):
+        with self.lock:
+            old = self.items.pop(night, None)
+            if old is not None:
+                self.size -= len(old[2])
+            if len(item[2]) > self.max_bytes:
+                return
+            self.items[night] = item
+            self.size += len(item[2])
+            while self.size > self.max_bytes:
+                _, old = self.items.popitem(last=False)
+                self.size -= len(old[2])
+
+    def prefetch(self, night, n=PREFETCH):
+        """Reads the summaries of the n nights before and after night in the background
+        """
+        day = datetime.datetime.strptime(str(night), '%Y%m%d')
+        for i in range(1, n + 1):
+            for d in [day + datetime.timedelta(days=i), day - datetime.timedelta(days=i)]:
+                self.executor.submit(self._prefetch, d.strftime('%Y%m%d'))
+
+    def _prefetch(self, night):
+        try:
+            self.get(night)
+        except Exception as e:
+            self.logger.info('Could not prefetch NightSummary {}: {}'.format(night, e))
+
+
+_cache = None
+
+def get_cache(logger=None):
+    """SummaryCache shared by all sessions of the process
+    """
+    global _cache
+    index = get_index(logger)
+    with _index_lock:
+        if _cache is None:
+            _cache = SummaryCache(index, logger=logger)
+        return _cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archived Night Summaries')
+    parser.add_argument('--externalize', action='store_true', help='Move the inline images of the summaries to png files next to them')
+    parser.add_argument('--first', default=None, help='First night (YYYYMMDD)')
+    parser.add_argument('--last', default=None, help='Last night (YYYYMMDD)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.externalize:
+        n = 0
+        for night, filen in sorted(get_index().nights().items()):
+            if (args.first is not None and night < args.first) or (args.last is not None and night > args.last):
+                continue
+            if os.path.exists(filen) and 'data:image/png;base64,' in open(filen, 'r').read():
+                externalize(filen, night)
+                n += 1
+        print('Converted {} summaries'.format(n))
+
+
+if __name__ == '__main__':
+    main()
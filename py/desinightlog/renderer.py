@@ -0,0 +1,138 @@
+"""
+Keeps the Current NightLog of a location rendered without any Bokeh session.
+
+The renderer checks the input files of the latest night (rerender.fingerprint) every INTERVAL
+seconds, and changes made by a NightLog in the same process wake it up at once. header_<loc>.html
+and nightlog_<loc>.html are written again once per change of the inputs. renderer_<loc>.json in
+the night directory records the last render and is touched at every check; while it is fresh the
+Bokeh sessions only display the NightLog instead of rendering it themselves (scheduler.py).
+
+    cd py/desinightlog
+    python renderer.py [--location kpno] [--night 20230101] [--interval 5]
+
+or in the process of the Bokeh server with `python server.py --render kpno`.
+
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import argparse
+import datetime
+import threading
+
+import nightlog as nl
+import nightdirs
+import artifacts
+import rerender
+
+INTERVAL = 5 #seconds between checks of the input files
+STALE = 3    #intervals without a check after which the renderer is considered gone
+
+
+def record_file(root_dir, location):
+    return os.path.join(root_dir, 'renderer_{}.json'.format(location))
+
+def active(log):
+    """True if a renderer is keeping the NightLog of log up to date
+    """
+    filen = record_file(log.root_dir, log.location)
+    try:
+        mtime = os.path.getmtime(filen)
+        interval = json.load(open(filen, 'r')).get('interval', INTERVAL)
+    except (OSError, ValueError):
+        return False
+    return time.time() - mtime < STALE*interval
+
+
+class Renderer(object):
+    def __init__(self, location='kpno', night=None, interval=INTERVAL, logger=None):
+        self.location = location
+        self.night = night #None follows the latest night
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.version = rerender.code_version()
+        self.fingerprints = {} #night -> fingerprint of the inputs last rendered
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def current_night(self):
+        if self.night is not None:
+            return str(self.night)
+        today = datetime.datetime.now().strftime('%Y%m%d')
+        nights = [n for n in nightdirs.get_night_dirs().latest(10, before=today) if len(n) == 8]
+        if len(nights) == 0:
+            return None
+        return nights[0]
+
+    def render(self, night):
+        """Renders the NightLog of a night if its inputs changed since the last render. Returns True if it was rendered
+        """
+        log = nl.NightLog(night, self.location, self.logger)
+        filen = record_file(log.root_dir, self.location)
+        if rerender.fingerprint(log, self.version) == self.fingerprints.get(night) and os.path.exists(filen):
+            os.utime(filen)
+            return False
+
+        start = time.time()
+        if rerender.has_meta(log):
+            log.write_intro()
+        log.finish_the_night()
+        #Fingerprint again, as rendering can update inputs (e.g. the exposure times)
+        self.fingerprints[night] = rerender.fingerprint(log, self.version)
+        artifacts.write_text(filen, json.dumps({'time': datetime.datetime.now().strftime('%Y%m%dT%H:%M:%S'),
+                                                'seconds': round(time.time() - start, 3), 'interval': self.interval,
+                                                'host': socket.gethostname(), 'pid': os.getpid()}))
+        self.logger.info('Rendered NightLog {} {} in {:.2f}s'.format(night, self.location, time.time() - start))
+        return True
+
+    def changed(self, event):
+        """NightLog listener: check the inputs now instead of at the next interval
+        """
+        self.wake.set()
+
+    def run(self):
+        nl.add_listener(self.changed)
+        try:
+            while not self.stopped.is_set():
+                night = self.current_night()
+                if night is not None:
+                    try:
+                        self.render(night)
+                    except Exception as e:
+                        self.logger.info('Could not render NightLog {} {}: {}'.format(night, self.location, e))
+                #Changes made while rendering are picked up at once, all of them by one render
+                self.wake.wait(self.interval)
+                self.wake.clear()
+        finally:
+            nl.remove_listener(self.changed)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='renderer', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the Current NightLog whenever its input files change')
+    parser.add_argument('--location', default='kpno', choices=['kpno', 'nersc'])
+    parser.add_argument('--night', default=None, help='Night to render (YYYYMMDD, default: the latest night)')
+    parser.add_argument('--interval', type=float, default=INTERVAL, help='Seconds between checks of the input files')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    renderer = Renderer(args.location, args.night, args.interval)
+    try:
+        renderer.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -11,13 +11,12 @@ Bokeh layouts initialized in layout.py
 #Imports
 import os
 import sys
-import base64
 import datetime 
+import shutil
 import socket
-import pytz
 import json
+import hashlib
 import logging
-import smtplib
 import psycopg2
 import ephem
 
@@ -25,15 +24,12 @@ import numpy as np
 import pandas as pd
 import astropy.units.si as u
 
-import matplotlib as mpl
-mpl.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-
 from datetime import timezone
 from datetime import timedelta
 from collections import OrderedDict
+from functools import partial
 
+from bokeh.io import curdoc
 from bokeh.models import DateFormatter
 from bokeh.models.widgets.markups import Div
 from bokeh.models.widgets import FileInput
@@ -42,12 +38,23 @@ from astropy.time import TimezoneInfo
 
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
 
 sys.path.append(os.getcwd())
 sys.path.append('./ECLAPI-8.0.12/lib')
 
 import nightlog as nl
+import explist as el
+import jobs
+import elog
+import badexp
+import mailer
+import telemplot
+import nightsum
+import artifacts
+import nightdirs
+import archive
+import search
+import rollups
 from layout import Layout
 
 class Report(Layout):
@@ -59,10 +66,16 @@ class Report(Layout):
     def __init__(self):
         Layout.__init__(self)
 
+        self.doc = curdoc() #Document of this session, used to update it from other threads
         self.test = os.environ['USER'].lower() == 'desiobserver' #Submission emails to tester only
 
         self.report_type = None #Updates when connect to report: LO, SO, NObs
         self.save_telem_plots = False #Saves telemetry plots each time they are produced. They are saved during submission. This is time consuming (not recommended)
+        self.telem_data = None #(time, table) of the last telemetry query, reused by the submission
+        self.telem_max_age = 300 #seconds
+        self.trends_loaded = False #the Problem Trends are shown the first time their tab is opened
+        self.submit_job = None #last submission of this session
+        self.email_file = None #NightSummary email of the last submission, in the mail outbox
         
         self.datefmt = DateFormatter(format="%m/%d/%Y %H:%M:%S")
         self.timefmt = DateFormatter(format="%m/%d %H:%M")
@@ -105,6 +118,11 @@ class Report(Layout):
         self.full_time = None
 
         self.DESI_Log = None #nighlog.py object
+
+        #Exposure table paging
+        self.exp_page = 0
+        self.exp_page_size = 50
+        self.exp_page_df = None #Page of exposures currently shown
         
         self.my_name = 'None' #Either report type or name of Nonobs
 
@@ -230,7 +248,7 @@ class Report(Layout):
         data['total'] = total
         self.total_time.text = 'Time Documented (hrs): {}'.format(str(self._dec_to_hm(total)))
         df = pd.DataFrame(data, index=[0])
-        df.to_csv(self.DESI_Log.time_use, index=False)
+        artifacts.write_csv(df, self.DESI_Log.time_use, index=False)
 
     def get_ephemeris(self, date):
         kpno = ephem.Observer()
@@ -290,20 +308,34 @@ class Report(Layout):
         """Gets a Night Summary for display on the Night Summary tab. This does not require being connected to a NightLog
         """
         ns_date = self.ns_date_input.value
-        ns = {}          
-        ns_html = ''                                                                                                                
-        for dir_, sdir, f in os.walk(self.nl_dir): 
-            for x in f: 
-                if 'NightSummary' in x: 
-                    date = dir_.split('/')[-1]
-                    ns[date] = os.path.join(dir_,x)
+        ns_html = ''
         try:
-            filen = ns[ns_date]
-            ns_html += open(filen).read()
+            cache = nightsum.get_cache(self.logger)
+            ns_html += cache.get(ns_date)
             self.ns_html.text = ns_html
+            cache.prefetch(ns_date)
         except:
             self.ns_html.text = 'Cannot find NightSummary for this date'
 
+    def search_nightlogs(self):
+        """Searches the entries of all nights (search.py) and lists the best matches on the Night Summary tab
+        """
+        try:
+            index = search.get_index(self.logger)
+            hits, ms = index.search(self.search_input.value, limit=50)
+            note = '' if index.built() else ' The older nights are still being indexed.'
+        except Exception as e:
+            self.search_results.text = 'Search is not available: {}'.format(e)
+            return
+        if len(hits) == 0:
+            self.search_results.text = 'No matches ({:.0f} ms).{}'.format(ms, note)
+            return
+        html = '<p>{} matches ({:.0f} ms).{} Enter the night above to see its Night Summary.</p><table>'.format(len(hits), ms, note)
+        html += '<tr><th>Night</th><th>Time</th><th>Site</th><th>Entry</th><th>Text</th></tr>'
+        for hit in hits:
+            html += '<tr><td>{night}</td><td>{time}</td><td>{location}</td><td>{kind}</td><td>{snippet}</td></tr>'.format(**hit)
+        self.search_results.text = html + '</table>'
+
     def ns_next_date(self):
         current_date = datetime.datetime.strptime(self.ns_date_input.value,'%Y%m%d') 
         next_night = current_date + timedelta(days=1)
@@ -316,26 +348,53 @@ class Report(Layout):
         self.ns_date_input.value = last_night.strftime('%Y%m%d')
         self.get_nightsum()
 
+    ##Problem Trends Page
+    def trends_shown(self, attr, old, new):
+        """Shows the problem trends the first time their tab is opened
+        """
+        try:
+            shown = self.layout.tabs[new] is self.trends_tab
+        except (IndexError, TypeError):
+            return
+        if shown and not self.trends_loaded:
+            self.trends_loaded = True
+            self.update_trends()
+
+    def update_trends(self):
+        """Shows the problems of the selected nights by alarm_id and their number per period (rollups.py)
+        """
+        first = self.trends_first.value.strip() or None
+        last = self.trends_last.value.strip() or None
+        alarm = self.trends_alarm.value.strip() or None
+        period = self.trends_period.value
+        try:
+            problems = rollups.get_rollup(rollups.ProblemRollup, self.logger)
+            if not problems.built():
+                self.trends_alert.text = 'Collecting the problems of all nights. The trends are shown when they are ready'
+                rollups.queue(rollups.ProblemRollup, on_done=lambda: self.doc.add_next_tick_callback(self.update_trends), logger=self.logger)
+                return
+            self.trends_source.data = problems.alarms(first, last)
+            counts = problems.counts(period, first, last, alarm_ids=None if alarm is None else [alarm])
+        except Exception as e:
+            self.trends_alert.text = 'Cannot get the problem trends: {}'.format(e)
+            return
+        if len(counts) == 0:
+            self.trends_counts_source.data = {'period': [], 'count': []}
+        else:
+            self.trends_counts_source.data = {'period': pd.to_datetime(counts.index, format='%Y%m%d'), 'count': counts.sum(axis=1).values}
+        self.trends_bars.glyph.width = 0.8*86400000*{'night': 1, 'week': 7, 'month': 30}[period]
+        self.trends_alert.text = 'Problems {} per {}'.format('with alarm_id {}'.format(alarm) if alarm else 'of all alarms', period)
+
     ##Connecting to NightLog
     def update_nl_list(self):
         """Update list of available NightLogs to connect to. Takes these from the NightLog directory.
         Only lists most recent 10 Night Summaries.
         """
-        days = [f for f in os.listdir(self.nl_dir) if os.path.isdir(os.path.join(self.nl_dir, f))]
-        days_ = []
-        for day in days:
-            try:
-                int(day)
-                days_.append(day)
-            except:
-                pass
-                
+        init_nl_list = nightdirs.get_night_dirs(self.nl_dir).latest(10)
         night = datetime.datetime.now().date().strftime("%Y%m%d")
 
-        if not (night in days_):
-            days_.append(night)
-
-        init_nl_list = np.sort([day for day in days_])[::-1][0:10]
+        if not (night in init_nl_list):
+            init_nl_list = sorted(init_nl_list + [night])[::-1][0:10]
 
         self.date_init.options = list(init_nl_list)
         self.date_init.value = init_nl_list[0]
@@ -365,7 +424,7 @@ class Report(Layout):
         self.observer = self.obs_type.active #0=LO; 1=SO
         if self.observer == 0:
             self.title.text = 'DESI Nightly Intake - Lead Observer'
-            self.layout.tabs = [self.intro_tab, self.plan_tab, self.milestone_tab_0, self.exp_tab_0, self.prob_tab, self.weather_tab_0,  self.nl_tab_0, self.ns_tab]
+            self.layout.tabs = [self.intro_tab, self.plan_tab, self.milestone_tab_0, self.exp_tab_0, self.prob_tab, self.weather_tab_0,  self.nl_tab_0, self.ns_tab, self.trends_tab]
             #CLP removing this line to remove the checklist tab
             #self.layout.tabs = [self.intro_tab, self.plan_tab, self.milestone_tab_0, self.exp_tab_0, self.prob_tab, self.weather_tab_0, self.check_tab,  self.nl_tab_0, self.ns_tab]
             self.time_tabs = [None, None, None, self.exp_time, self.prob_time, None, None, None]
@@ -373,13 +432,13 @@ class Report(Layout):
             self.report_type = 'LO'
         elif self.observer == 1:
             self.title.text = 'DESI Nightly Intake - Support Observer'
-            self.layout.tabs = [self.intro_tab, self.milestone_tab_0, self.exp_tab_1, self.prob_tab, self.weather_tab_1, self.nl_tab_1, self.ns_tab]
+            self.layout.tabs = [self.intro_tab, self.milestone_tab_0, self.exp_tab_1, self.prob_tab, self.weather_tab_1, self.nl_tab_1, self.ns_tab, self.trends_tab]
             self.time_tabs = [None, None, self.exp_time, self.prob_time, None, None, None]
             self.connect_txt.text = 'Connected to Night Log for {}'.format(self.night)
             self.report_type = 'SO'
         elif self.observer == 2:
             self.title.text = 'DESI Nightly Intake - Non-Observer'
-            self.layout.tabs = [self.intro_tab, self.exp_tab_2, self.prob_tab_1, self.weather_tab_1, self.nl_tab_1, self.ns_tab]
+            self.layout.tabs = [self.intro_tab, self.exp_tab_2, self.prob_tab_1, self.weather_tab_1, self.nl_tab_1, self.ns_tab, self.trends_tab]
             self.time_tabs = [None, self.exp_time, self.prob_time, None, None, None]
             self.connect_txt.text = 'Connected to Night Log for {}'.format(self.night)
             self.report_type = 'NObs'
@@ -502,12 +561,14 @@ class Report(Layout):
 
 
     ##Current NightLog Page
-    def current_nl(self):
-        """Updates NightLog on Current NightLog Page. Updated every 30 seconds
+    def current_nl(self, render=True):
+        """Updates NightLog on Current NightLog Page. Called by the Scheduler (scheduler.py).
+        If render is False the NightLog rendered by another session for this night is displayed
         """
         now = datetime.datetime.now()
         try:
-            self.DESI_Log.finish_the_night()
+            if render:
+                self.DESI_Log.finish_the_night()
             if not (self.lastPeriodicCallbackErrorStr is None):
                 self.logger.info('resetting last periodic callback error \
                     after successful callback')
@@ -605,32 +666,68 @@ class Report(Layout):
 
     def get_exp_list(self):
         """Gets exposure list from SQL query. This includes all exposures, not just science exposures. 
-        Table at end of Current NightLog Page is updated
+        Only the page of the table at end of Current NightLog Page is updated
         """
         try:
-            exp_df = pd.read_sql_query(f"SELECT * FROM exposure WHERE night = '{self.night}'", self.conn)
-            if len(exp_df.date_obs) >  0:
-                time = exp_df.date_obs.dt.tz_convert('US/Arizona')
-                exp_df['date_obs'] = time
-
-                self.explist_source.data = exp_df[['date_obs','id','tileid','program','sequence','flavor','exptime','airmass','seeing']].sort_values(by='id',ascending=False) 
-
-                exp_df = exp_df.sort_values(by='id')
-                exp_df.to_csv(self.DESI_Log.explist_file, index=False)
+            exp_list = el.get_exposure_list(self.night)
+            if exp_list.update(self.conn) or not os.path.exists(self.DESI_Log.explist_file):
+                if exp_list.df is not None:
+                    artifacts.write_csv(exp_list.df, self.DESI_Log.explist_file, index=False)
+            if exp_list.df is not None and len(exp_list.df) > 0:
+                self.show_exp_page()
             else:
                 self.exptable_alert.text = f'No exposures available for night {self.night}'
         except Exception as e:
             self.exptable_alert.text = 'Cannot connect to Exposure Data Base. {}'.format(e)
 
+    def _int_or_none(self, value):
+        try:
+            return int(value)
+        except:
+            return None
+
+    def show_exp_page(self):
+        """Sends the current page of the exposure table to the browser. If the same exposures are
+        already shown only the values that changed are sent
+        """
+        exp_list = el.get_exposure_list(self.night)
+        flavors = ['All'] + exp_list.flavors()
+        if self.exp_flavor_select.options != flavors:
+            self.exp_flavor_select.options = flavors
+        filters = {'flavor': self.exp_flavor_select.value, 'program': self.exp_program_input.value.strip(),
+                   'id_min': self._int_or_none(self.exp_id_min.value), 'id_max': self._int_or_none(self.exp_id_max.value)}
+        page_df, self.exp_page, n_pages = exp_list.page(self.exp_page, self.exp_page_size, **filters)
+        self.exp_page_text.text = 'Page {} of {}'.format(self.exp_page + 1, n_pages)
+
+        shown = self.exp_page_df
+        if shown is not None and list(shown.id) == list(page_df.id):
+            patches = {}
+            for col in el.COLUMNS:
+                changed = ~((shown[col] == page_df[col]) | (shown[col].isna() & page_df[col].isna()))
+                if changed.any():
+                    patches[col] = [(int(i), page_df.at[i, col]) for i in page_df.index[changed]]
+            if len(patches) > 0:
+                self.explist_source.patch(patches)
+        else:
+            self.explist_source.data = page_df
+        self.exp_page_df = page_df
+
+    def exp_filter(self):
+        self.exp_page = 0
+        self.show_exp_page()
+
+    def exp_page_prev(self):
+        self.exp_page -= 1
+        self.show_exp_page()
+
+    def exp_page_next(self):
+        self.exp_page += 1
+        self.show_exp_page()
+
     def exp_to_html(self):
-        """Converts table of exposures to html
+        """Converts table of exposures to html (nightsum.py)
         """
-        exp_df = pd.read_csv(self.DESI_Log.explist_file)
-        exp_df = exp_df[['date_obs','id','tileid','program','sequence','flavor','exptime','airmass','seeing']].sort_values(by='id',ascending=False) 
-        exp_df = exp_df.rename(columns={"date_obs": "Time", "id":
-        "Exp","tileid":'Tile','program':'Program','sequence':'Sequence','flavor':'Flavor','exptime':'Exptime','airmass':'Airmass','seeing':'Seeing'})
-        exp_html = exp_df.to_html()
-        return exp_html
+        return nightsum.exposures_html(self.DESI_Log.explist_file)
 
     def exp_add(self):
         quality = None
@@ -812,6 +909,18 @@ class Report(Layout):
     def make_telem_plots(self):
         """Makes SQL query to exposure database to update observing telemetry plots
         """
+        exp_df, telem_data = self.get_telem_data()
+        self.telem_source.data = telem_data
+        self.telem_data = (datetime.datetime.now(), telem_data)
+
+        #Matplotlib plots (not shown on Bokeh App). Saved once at end of night and sent with NightLog
+        if self.save_telem_plots:
+            self.save_telem_figure(telem_data)
+            self.save_telem_plots = False
+
+    def get_telem_data(self):
+        """Telemetry of the exposures between the 10 deg. twilights
+        """
         start = datetime.datetime.strptime(self.plots_start, "%Y%m%dT%H:%M")
         start_utc = start.astimezone(tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
 
@@ -846,84 +955,13 @@ class Report(Layout):
 
             telem_data.skylevel = exp_df.skylevel
 
-        self.telem_source.data = telem_data
+        return exp_df, telem_data
+
+    def save_telem_figure(self, telem_data):
+        """Saves matplotlib version of the telemetry plots that is sent with the NightLog. It is drawn in a worker process (telemplot.py)
+        """
+        telemplot.save_figure(telem_data, self.night, self.DESI_Log.telem_plots_file, logger=self.logger)
 
-        #Matplotlib plots (not shown on Bokeh App). Saved once at end of night and sent with NightLog
-        if self.save_telem_plots:
-            plt.style.use('ggplot')
-            plt.rcParams.update({'axes.labelsize': 'small'})
-            from matplotlib.pyplot import cm
-            color=iter(cm.tab10(np.linspace(0,1,8)))
-
-
-            fig = plt.figure(figsize=(10,15))
-            ax1 = fig.add_subplot(8,1,1)
-            ax1.plot(exp_df.date_obs.dt.tz_convert('US/Arizona'), self.get_telem_list(exp_df,'telescope','mirror_temp'), 'o-', label='mirror temp')    
-            ax1.plot(exp_df.date_obs.dt.tz_convert('US/Arizona'), self.get_telem_list(exp_df,'telescope','truss_temp'),'o-',  label='truss temp')  
-            ax1.plot(exp_df.date_obs.dt.tz_convert('US/Arizona'), self.get_telem_list(exp_df,'telescope','air_temp'),'o-',  label='air temp') 
-            ax1.set_ylabel("Telescope Temperature (C)")
-            ax1.legend()
-            ax1.grid(True)
-            ax1.tick_params(labelbottom=False)
-
-            ax2 = fig.add_subplot(8,1,2, sharex = ax1)
-            c=next(color)
-            ax2.plot(exp_df.date_obs.dt.tz_convert('US/Arizona'), self.get_telem_list(exp_df,'tower','humidity'),'o-',  color=c, label='humidity') 
-            ax2.set_ylabel("Humidity %")
-            ax2.grid(True)
-            ax2.tick_params(labelbottom=False)
-
-            ax3 = fig.add_subplot(8,1,3, sharex=ax1) 
-            c=next(color)
-            ax3.plot(exp_df.date_obs.dt.tz_convert('US/Arizona'), self.get_telem_list(exp_df,'tower','wind_speed'), 'o-', color=c, label='wind speed')
-            ax3.set_ylabel("Wind Speed (mph)")
-            ax3.grid(True)
-            ax3.tick_params(labelbottom=False)
-
-            ax4 = fig.add_subplot(8,1,4, sharex=ax1)
-            c=next(color)
-            ax4.plot(exp_df.date_obs.dt.tz_convert('US/Arizona'), exp_df.airmass, 'o-', color=c, label='airmass')
-            ax4.set_ylabel("Airmass")
-            ax4.grid(True)
-            ax4.tick_params(labelbottom=False)
-
-            ax5 = fig.add_subplot(8,1,5, sharex=ax1)
-            c=next(color)
-            ax5.plot(exp_df.date_obs.dt.tz_convert('US/Arizona'), exp_df.exptime, 'o-', color=c, label='exptime')
-            ax5.set_ylabel("Exposure time (s)")
-            ax5.grid(True)
-            ax5.tick_params(labelbottom=False)
-
-            ax6 = fig.add_subplot(8,1,6,sharex=ax1)
-            c=next(color)
-            ax6.plot(exp_df.date_obs.dt.tz_convert('US/Arizona'), exp_df.seeing,'o-',  color=c, label='seeing')   
-            ax6.set_ylabel("Seeing")
-            ax6.grid(True)
-            ax6.tick_params(labelbottom=False)
-
-            ax7 = fig.add_subplot(8,1,7,sharex=ax1)
-            c=next(color)
-            ax7.plot(exp_df.date_obs.dt.tz_convert('US/Arizona'), tput, 'o-', color=c, label='transparency')
-            ax7.set_ylabel("Transparency (%)")
-            ax7.grid(True)
-            ax7.tick_params(labelbottom=False)
-
-            ax8 = fig.add_subplot(8,1,8,sharex=ax1)
-            c=next(color)
-            ax8.plot(exp_df.date_obs.dt.tz_convert('US/Arizona'), exp_df.skylevel, 'o-', color=c, label='Sky Level')      
-            ax8.set_ylabel("Sky level (AB/arcsec^2)")
-            ax8.grid(True)
-
-            ax8.set_xlabel("Local Time (MST)")
-            ax8.xaxis.set_major_formatter(mdates.DateFormatter('%m/%d %H:%M', tz=pytz.timezone("US/Arizona")))
-            ax8.tick_params(labelrotation=45)
-            fig.suptitle("Telemetry for obsday {}".format(self.night),fontsize=14)
-            plt.subplots_adjust(top=0.85)
-            fig.tight_layout()
-
-            plt.savefig(self.DESI_Log.telem_plots_file)
-            self.save_telem_plots = False
-                
     ##Plans, Milestones and Checklists
     def plan_add_new(self):
         """Identifies if a new submission or updating a submission.
@@ -1020,14 +1058,14 @@ class Report(Layout):
 
         if mode == 'comment':         
             if self.exp_comment.value not in [None, ''] and hasattr(self, 'img_upload_comments_os') and self.img_upload_comments_os.filename not in [self.current_img_name, None,'','nan',np.nan]:
-                img_data = self.img_upload_comments_os.value.encode('utf-8')
+                img_data = self.img_upload_comments_os.value #base64 string, decoded by the NightLog in the background
                 input_name = os.path.splitext(str(self.img_upload_comments_os.filename))
                 img_name = input_name[0] + '_{}'.format(self.location) + input_name[1]
                 self.current_img_name = self.img_upload_comments_os.filename
 
         elif mode == 'problem':
             if hasattr(self, 'img_upload_problems') and self.img_upload_problems.filename not in [self.current_img_name, None, '',np.nan, 'nan']:
-                img_data = self.img_upload_problems.value.encode('utf-8')
+                img_data = self.img_upload_problems.value #base64 string, decoded by the NightLog in the background
                 input_name = os.path.splitext(str(self.img_upload_problems.filename))
                 self.current_img_name = self.img_upload_problems.filename
                 img_name = input_name[0] + '_{}'.format(self.location) + input_name[1]
@@ -1184,7 +1222,7 @@ class Report(Layout):
         data['total'] = total
         self.total_time.text = 'Time Documented (hrs): {}'.format(str(self._dec_to_hm(total)))
         df = pd.DataFrame(data, index=[0])
-        df.to_csv(self.DESI_Log.time_use, index=False)
+        artifacts.write_csv(df, self.DESI_Log.time_use, index=False)
 
     def summary_add(self):
         if self.summary_input.value in ['',' ','nan','None']:
@@ -1213,6 +1251,9 @@ class Report(Layout):
 
     ##NightLog Submission
     def nl_submit(self):
+        """Starts the submission in the background (jobs.py). The steps run in parallel where they can
+        and their status is shown in submit_text
+        """
         if not self.current_nl():
             self.nl_text.text = 'You cannot submit a Night Log to the eLog until you have connected to an existing Night Log or initialized tonights Night Log'
         else:
@@ -1225,132 +1266,162 @@ class Report(Layout):
             for line in lines:
                 nl_html += line
 
-            #make Paul's plot
-            try:
-                os.system("{}/bin/plotnightobs -n {}".format(os.environ['SURVEYOPSDIR'],self.night))
-            except Exception as e:
-                self.logger.info('Issues with Pauls plot: {}'.format(e))
-
             if self.test:
-                pass
+                user_email = ["james.lasker3@gmail.com","jlasker@smu.edu"]
             else:
-                try:
-                    from ECLAPI import ECLConnection, ECLEntry
-                    e = ECLEntry('Synopsis_Night', text=nl_html, textile=True)
-
-                    subject = 'Night Summary {}'.format(self.night)
-                    e.addSubject(subject)
-                    url = 'http://desi-www.kpno.noirlab.edu:8090/ECL/desi'
-                    user = 'dos'
-                    pw = 'dosuser'
-
-                    elconn = ECLConnection(url, user, pw)
-                    response = elconn.post(e)
-                    elconn.close()
-                    if response[0] != 200:
-                        raise Exception(response)
-                        self.submit_text.text = "You cannot post to the eLog on this machine"
-                except:
-                    ECLConnection = None
-                    self.nl_text.text = "Can't connect to eLog"
+                user_email = ["desi-nightlog@desi.lbl.gov"]
+
+            steps = [jobs.Step('plot', self.submit_plot, retries=1),
+                     jobs.Step('bad_exp', self.submit_bad_exp, retries=2),
+                     jobs.Step('telem', self.submit_telem, retries=1),
+                     jobs.Step('email', partial(self.email_nightsum, user_email=user_email), after=['plot', 'telem'], retries=3, once=True)]
+            steps.append(jobs.Step('rollups', partial(rollups.update_night, self.night, self.logger), retries=1))
+            if archive.available():
+                steps.append(jobs.Step('archive', partial(archive.get_archive(self.logger).update_night, self.night), requires=['bad_exp'], retries=1))
+            else:
+                self.logger.warning('pyarrow is not installed: the Parquet archive of the nights (archive.py) is not updated')
+            if not self.test:
+                steps.append(jobs.Step('elog', partial(self.submit_elog, nl_html), once=True)) #ElogClient retries itself
+
+            record_file = os.path.join(self.DESI_Log.root_dir, 'submission_{}.json'.format(self.location))
+            fingerprint = hashlib.md5(nl_html.encode('utf-8')).hexdigest()
+            job, started = jobs.start_job('submit_{}'.format(self.night), steps, fingerprint=fingerprint,
+                record_file=record_file, on_update=self.submit_update, logger=self.logger)
+            self.submit_job = job
+            if not started:
+                self.submit_text.text = 'The Night Log for {} is already being submitted'.format(self.night) + self._submit_status(job)
+            else:
+                self.submit_text.text = 'Submitting Night Log' + self._submit_status(job)
 
-            #Add bad exposures
-            try:
-                survey_dir = os.path.join(os.environ['NL_DIR'],'ops')
-                bad_filen = 'bad_exp_list.csv'
-                bad_path = os.path.join(survey_dir, bad_filen)
-                bad_df = pd.read_csv(bad_path)
-                new_bad = self.DESI_Log._combine_compare_csv_files(self.DESI_Log.bad_exp_list, bad=True)
-                bad_df = pd.concat([bad_df, new_bad])
-                bad_df = bad_df.drop_duplicates(subset=['EXPID'], keep='last')
-                bad_df = bad_df.astype({"NIGHT":int, "EXPID": int,"BAD":bool,"BADCAMS":str,"COMMENT":str})
-                bad_df.to_csv(bad_path,index=False)
-                err1 = os.system('svn update --non-interactive {}'.format(bad_path))
-                self.logger.info('SVN added bad exp list {}'.format(err1))
-                err2 = os.system('svn commit --non-interactive -m "autocommit from night summary submission" {}'.format(bad_path))
-                self.logger.info('SVN commited bad exp list {}'.format(err2))
+    def _submit_status(self, job):
+        status = '<ul>'
+        for name, s in job.status.items():
+            status += '<li>{}: {}</li>'.format(name, s)
+        return status + '</ul>'
 
-            except Exception as e:
-                self.logger.info('Cant post to the bad exp list: {}'.format(e))
+    def submit_update(self, job):
+        """Called from the job thread. Bokeh models are only changed on the next tick of the document
+        """
+        if job.running() and not all(s in ['done', 'skipped'] or s.startswith('failed') or s == 'cancelled' for s in job.status.values()):
+            text = 'Submitting Night Log' + self._submit_status(job)
+        elif job.done():
+            email = mailer.SENT if self.email_file is None else mailer.get_outbox(self.logger).status(self.email_file)
+            now = datetime.datetime.now().strftime("%Y%m%d%H:%M")
+            if email == mailer.SENT:
+                text = "Night Log posted to eLog and emailed to collaboration at {}".format(now) + '</br>'
+            elif email == mailer.QUEUED:
+                text = "Night Log posted to eLog at {}. The email to the collaboration is queued and will be sent when the mail server accepts it".format(now) + '</br>'
+            else:
+                text = "Night Log posted to eLog at {}, but the mail server refused the email to the collaboration".format(now) + '</br>'
+        else:
+            text = 'Night Log submission finished with problems. You can press Submit again to retry the failed steps.' + self._submit_status(job)
+        self.doc.add_next_tick_callback(partial(self._set_submit_text, text))
 
+    def email_update(self, path, status):
+        """Called from the mail outbox thread once the NightSummary email was sent or failed
+        """
+        if path == self.email_file and self.submit_job is not None:
+            self.submit_update(self.submit_job)
 
-            self.save_telem_plots = True
-            self.current_nl()
+    def _set_submit_text(self, text):
+        self.submit_text.text = text
 
-            if self.test:
-                self.email_nightsum(user_email = ["james.lasker3@gmail.com","jlasker@smu.edu"])
-            else:
-                self.email_nightsum(user_email = ["desi-nightlog@desi.lbl.gov"])
+    def submit_plot(self):
+        #make Paul's plot
+        err = os.system("{}/bin/plotnightobs -n {}".format(os.environ['SURVEYOPSDIR'],self.night))
+        if err != 0:
+            raise Exception('plotnightobs returned {}'.format(err))
 
-            self.submit_text.text = "Night Log posted to eLog and emailed to collaboration at {}".format(datetime.datetime.now().strftime("%Y%m%d%H:%M")) + '</br>'
+    def submit_elog(self, nl_html):
+        subject = 'Night Summary {}'.format(self.night)
+        if elog.get_client(self.logger).post('Synopsis_Night', nl_html, subject, textile=True):
+            self.logger.info('Posted {} to the eLog'.format(subject))
 
-    def email_nightsum(self,user_email = None):
+    def submit_bad_exp(self):
+        """Merges tonights bad exposures into the survey bad exposure list (badexp.py) and commits it to svn
+        """
+        new_bad = self.DESI_Log._combine_compare_csv_files(self.DESI_Log.bad_exp_list, bad=True)
+        if new_bad is None:
+            return
+        survey_dir = os.path.join(os.environ['NL_DIR'],'ops')
+        bad_filen = 'bad_exp_list.csv'
+        bad_path = os.path.join(survey_dir, bad_filen)
+        err1 = os.system('svn update --non-interactive {}'.format(bad_path))
+        self.logger.info('SVN updated bad exp list {}'.format(err1))
+
+        store = badexp.BadExpStore(survey_dir, self.logger)
+        store.sync_from_flat(bad_path)
+        added, updated = store.merge_night(self.night, new_bad)
+        if store.update_flat(bad_path, added):
+            err2 = os.system('svn commit --non-interactive -m "autocommit from night summary submission" {}'.format(bad_path))
+            self.logger.info('SVN commited bad exp list {}'.format(err2))
+            if err2 != 0:
+                store.mark_dirty()
+                raise Exception('svn commit returned {}'.format(err2))
+        else:
+            self.logger.info('Bad exp list already up to date')
 
-        try:
-            self.make_telem_plots()
-        except:
-            self.logger.info("Something wrong with telem plots")
+    def submit_telem(self):
+        """Uses the telemetry table of the plots if it was updated recently
+        """
+        if self.telem_data is not None and (datetime.datetime.now() - self.telem_data[0]).total_seconds() < self.telem_max_age:
+            telem_data = self.telem_data[1]
+        else:
+            exp_df, telem_data = self.get_telem_data()
+        self.save_telem_figure(telem_data)
 
+    def email_nightsum(self,user_email = None):
+        """Writes the NightSummary and puts the email in the outbox (mailer.py), which sends it in the background.
+        The telemetry plot is made beforehand by submit_telem
+        """
         sender = "noreply-ecl@noirlab.edu"
 
         # Create message container - the correct MIME type is multipart/alternative.
         msg = MIMEMultipart('html')
-        msg['Subject'] = "Night Summary %s" % self.date_init.value #mjd2iso(mjd)
+        msg['Subject'] = "Night Summary %s" % self.night #mjd2iso(mjd)
         msg['From'] = sender
         if len(user_email) == 1:
             msg['To'] = user_email[0]
         else:
             msg['To'] = ', '.join(user_email)
 
-        # Create the body of the message (a plain-text and an HTML version).
-        f = self.DESI_Log._open_kpno_file_first(self.DESI_Log.nightlog_html)
-        nl_file=open(f,'r')
-        lines = nl_file.readlines()
-        nl_html = "" 
-        img_names = []
-        for line in lines:
-            nl_html += line
-
-        # Add exposures
-        if os.path.exists(self.DESI_Log.explist_file):
-            exp_list = self.exp_to_html()
-            nl_html += ("<h3 id='exposures'>Exposures</h3>")
-            for line in exp_list:
-                nl_html += line
-
-        nl_text = MIMEText(nl_html, 'html')
-        msg.attach(nl_text)
-        Html_file = open(os.path.join(self.DESI_Log.root_dir,'NightSummary{}.html'.format(self.night)),"w")
-        Html_file.write(nl_html)
-
-        # Add Paul's plot
-        try:
-            nightops = open(os.path.join(os.environ['DESINIGHTSTATS'],'nightstats{}.png'.format(self.night)),'rb').read()
-            msgImage = MIMEImage(nightops)
-            data_uri = base64.b64encode(nightops).decode('utf-8')
-            img_tag = '<img src="data:image/png;base64,%s" \>' % data_uri
-            msgImage.add_header('Content-Disposition', 'attachment; filename=nightstats{}.png'.format(self.night))
-            msg.attach(msgImage)
-            Html_file.write(img_tag)
-        except Exception as e:
-            self.logger.info('Problem attaching Paul\'s plot: {}'.format(e))
-        # Add images
-        if os.path.exists(self.DESI_Log.telem_plots_file):
-            telemplot = open(self.DESI_Log.telem_plots_file, 'rb').read()
-            msgImage = MIMEImage(telemplot)
-            data_uri = base64.b64encode(telemplot).decode('utf-8')
-            img_tag = '<img src="data:image/png;base64,%s" \>' % data_uri
-            msgImage.add_header('Content-Disposition', 'attachment; filename=telem_plots_{}.png'.format(self.night))
-            msg.attach(msgImage)
-            Html_file.write(img_tag)
-        Html_file.close()
-        
-        text = msg.as_string()
-
-        # Send the message via local SMTP server.
-        #yag = yagmail.SMTP(sender)
-        #yag.send("parfa30@gmail.com",nl_html,self.DESI_Log.telem_plots_file)
-        s = smtplib.SMTP('localhost')
-        s.sendmail(sender, user_email, text)
-        s.quit()
-        self.logger.info("Email sent")
+        # Create the body of the message from the rendered NightLog and exposure table
+        nl_html = nightsum.compose(self.DESI_Log)
+
+        # Paul's plot and the telemetry plots. They are copied next to the NightSummary, which refers to them by name.
+        # Each image is encoded once for the email. Images that do not fit in the size budget are linked instead
+        images = [(os.path.join(os.environ.get('DESINIGHTSTATS', ''),'nightstats{}.png'.format(self.night)), 'nightstats{}.png'.format(self.night)),
+                  (self.DESI_Log.telem_plots_file, 'telem_plots_{}.png'.format(self.night))]
+        root_url = self.DESI_Log.server.rsplit('/images', 1)[0]
+        img_tags = ''
+        links = ''
+        parts = []
+        budget = mailer.EMAIL_BUDGET
+        for path, filename in images:
+            try:
+                data = open(path, 'rb').read()
+                if os.path.abspath(path) != os.path.abspath(os.path.join(self.DESI_Log.root_dir, filename)):
+                    shutil.copy(path, os.path.join(self.DESI_Log.root_dir, filename))
+            except Exception as e:
+                self.logger.info('Problem attaching {}: {}'.format(filename, e))
+                continue
+            img_tags += nightsum.image_tag(filename)
+            small = mailer.fit_image(data, min(mailer.IMAGE_BUDGET, budget))
+            if small is None:
+                links += '<a href="{}/{}">{}</a><br/>'.format(root_url, filename, filename)
+                self.logger.info('{} is too large for the email and is linked'.format(filename))
+                continue
+            budget -= len(small)
+            parts.append(mailer.image_part(mailer.encode_image(small), filename))
+
+        msg.attach(MIMEText(nl_html + links, 'html'))
+        for part in parts:
+            msg.attach(part)
+
+        ns_file = nightsum.summary_file(self.DESI_Log.root_dir, self.night)
+        with open(ns_file,"w") as Html_file:
+            Html_file.write(nl_html)
+            Html_file.write(img_tags)
+        nightsum.get_index(self.logger).add(os.path.basename(os.path.normpath(self.DESI_Log.root_dir)), ns_file)
+
+        self.email_file = mailer.get_outbox(self.logger).spool(msg, sender, user_email, on_done=self.email_update)
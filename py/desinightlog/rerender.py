@@ -0,0 +1,139 @@
+"""
+Renders the NightLogs of a range of nights again, e.g. after a change of the NightLog format.
+
+For every night the header and nightlog_<loc>.html are written again from the input files, and
+NightSummary<night>.html if the night was submitted. Nights are rendered in parallel by a pool
+of processes. A night is skipped when its input files and the rendering code are the same as
+when it was last rendered (rerender_<loc>.json in the night directory). No Bokeh server or
+database connection is needed.
+
+    cd py/desinightlog
+    python rerender.py 20230101 20231231 [--location kpno] [--workers 8] [--force]
+
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import logging
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import nightlog as nl
+import nightsum
+import sources
+import artifacts
+
+CODE = ['nightlog.py', 'nightsum.py'] #files whose changes change the rendered NightLog
+OUTPUTS = ['nightlog_', 'header_', 'NightSummary', 'rerender_', 'renderer_', 'submission_'] #files of a night directory that are not inputs
+
+
+def code_version():
+    h = hashlib.sha1()
+    for name in CODE:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def input_files(log):
+    """Files of a night directory the NightLog is rendered from
+    """
+    files = glob.glob(os.path.join(log.root_dir, '*')) + glob.glob(os.path.join(log.obs_dir, '*'))
+    files = [f for f in files if os.path.isfile(f) and not any(os.path.basename(f).startswith(o) for o in OUTPUTS)]
+    files += [f for f in [log.image_file, log.upload_image_file, os.path.join(log.image_dir, 'index.json')] if os.path.exists(f)]
+    return sorted(files)
+
+def fingerprint(log, version):
+    h = hashlib.sha1(version.encode())
+    for f in input_files(log):
+        st = os.stat(f)
+        h.update('{} {} {}\n'.format(os.path.relpath(f, log.root_dir), st.st_mtime_ns, st.st_size).encode())
+    return h.hexdigest()
+
+def has_meta(log):
+    """True if the night has the metadata of its header, written at KPNO or at the location of the log
+    """
+    return os.path.exists(log._open_kpno_file_first(log.meta_json))
+
+def summary_images(ns_file, night):
+    """Images of a NightSummary that is rendered again. Images that are inline in the old summary are
+    written to files next to it first, so none are lost
+    """
+    root_dir = os.path.dirname(ns_file)
+    html, inline = nightsum.split_images(open(ns_file, 'r').read(), night)
+    for name, data in inline.items():
+        artifacts.write_bytes(os.path.join(root_dir, name), data)
+    names = nightsum.image_names(html)
+    for name in ['nightstats{}.png'.format(night), 'telem_plots_{}.png'.format(night)]:
+        if name not in names:
+            names.append(name)
+    return [name for name in names if os.path.exists(os.path.join(root_dir, name))]
+
+def render_night(night, location, version, force=False):
+    """Renders one night. Returns (night, status, seconds, message), status being 'rendered', 'skipped' or 'failed'
+    """
+    start = time.time()
+    logger = logging.getLogger('rerender')
+    try:
+        log = nl.NightLog(night, location, logger)
+        record_file = os.path.join(log.root_dir, 'rerender_{}.json'.format(location))
+        fp = fingerprint(log, version)
+        if not force and os.path.exists(record_file) and json.load(open(record_file, 'r')).get('fingerprint') == fp:
+            return night, 'skipped', time.time() - start, ''
+
+        if has_meta(log):
+            log.write_intro()
+        log.finish_the_night()
+
+        ns_file = nightsum.summary_file(log.root_dir, night)
+        if os.path.exists(ns_file):
+            artifacts.write_text(ns_file, nightsum.compose(log) + ''.join(nightsum.image_tag(name) for name in summary_images(ns_file, night)))
+
+        #Fingerprint again, as rendering can update inputs (e.g. the exposure times)
+        artifacts.write_text(record_file, json.dumps({'fingerprint': fingerprint(log, version),
+                                                      'time': datetime.datetime.now().strftime('%Y%m%dT%H:%M:%S')}))
+        return night, 'rendered', time.time() - start, ''
+    except Exception as e:
+        return night, 'failed', time.time() - start, '{}: {}'.format(e.__class__.__name__, e)
+
+def rerender(first_night, last_night, location='kpno', workers=None, force=False, report=print):
+    """Renders the nights between first_night and last_night in parallel. Returns the results of render_night
+    """
+    nights = sources.nights(first_night=first_night, last_night=last_night)
+    version = code_version()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(render_night, night, location, version, force) for night in nights]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            report('{} {:8} {:6.2f}s {}'.format(*result))
+    return sorted(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the NightLogs of a range of nights again')
+    parser.add_argument('first', help='First night (YYYYMMDD)')
+    parser.add_argument('last', help='Last night (YYYYMMDD)')
+    parser.add_argument('--location', default='kpno', choices=['kpno', 'nersc'])
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes (default: number of CPUs)')
+    parser.add_argument('--force', action='store_true', help='Render nights whose inputs did not change')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    start = time.time()
+    results = rerender(args.first, args.last, args.location, args.workers, args.force)
+    counts = {status: len([r for r in results if r[1] == status]) for status in ['rendered', 'skipped', 'failed']}
+    print('{rendered} rendered, {skipped} skipped, {failed} failed'.format(**counts) + ' in {:.1f}s'.format(time.time() - start))
+    for night, status, _, message in results:
+        if status == 'failed':
+            print('  {} {}'.format(night, message))
+    sys.exit(1 if counts['failed'] > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""
+Aggregates of the NightLog entries over many nights, kept up to date incrementally.
+
+Problems: for every night and alarm_id, the number of problems, the first and last time they were
+reported and the mean time of night (hours after noon of the obsday). The per night table is kept
+in NL_DIR/ops/rollups/problems.csv and a night is only read again when its problem files changed,
+so weekly and monthly counts or the history of an alarm are computed from one small table.
+
+Time use: the time_use file of every night (KPNO first, as in the NightLog) in one table,
+NL_DIR/ops/rollups/time_use.csv, summed by week, month or semester with the open shutter fraction
+(observing time over the time between 12 and 18 degree twilights).
+
+The rollups are built the first time they are used and kept up to date by a NightLog listener,
+both in a background thread (queue).
+
+    cd py/desinightlog
+    python rollups.py
+
+"""
+
+import os
+import abc
+import json
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import nightlog as nl
+import artifacts
+import sources as src
+
+NO_ALARM = 'none' #alarm_id of the problems reported without one
+
+PROBLEM_COLUMNS = ['night', 'alarm_id', 'count', 'first', 'last', 'hour_sum']
+TIME_USE = ['obs_time', 'test_time', 'inst_loss', 'weather_loss', 'tel_loss', 'total', '18deg', '12deg']
+TIME_USE_COLUMNS = ['night', 'location'] + TIME_USE
+PERIODS = {'night': None, 'week': 'W', 'month': 'M', 'semester': None}
+
+
+class Rollup(abc.ABC):
+    """Per night table built from an input file of the NightLogs, updated for the nights whose files changed
+    """
+    name = None
+    attr = None #NightLog attribute of the input file
+    columns = None
+    dtypes = {'night': str}
+
+    def __init__(self, nl_dir=None, rollup_dir=None, logger=None):
+        self.nl_dir = nl_dir or os.environ['NL_DIR']
+        self.rollup_dir = rollup_dir or os.path.join(self.nl_dir, 'ops', 'rollups')
+        self.table_file = os.path.join(self.rollup_dir, '{}.csv'.format(self.name))
+        self.state_file = os.path.join(self.rollup_dir, '{}_state.json'.format(self.name))
+        self.complete_file = os.path.join(self.rollup_dir, '{}_complete.json'.format(self.name))
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.update_lock = threading.Lock()
+        self._table = None
+        self._table_mtime = None
+
+    ##Implemented by each rollup
+    @abc.abstractmethod
+    def night_rows(self, night, dfs):
+        """Rows of the table for a night from its input files (location -> DataFrame)
+        """
+
+    ##Storage
+    def table(self):
+        """The per night table, read again only if the file changed
+        """
+        with self.lock:
+            try:
+                mtime = os.path.getmtime(self.table_file)
+            except OSError:
+                return pd.DataFrame(columns=self.columns)
+            if self._table is None or mtime != self._table_mtime:
+                self._table = pd.read_csv(self.table_file, dtype=self.dtypes)
+                self._table_mtime = mtime
+            return self._table
+
+    def _write(self, df, state):
+        os.makedirs(self.rollup_dir, exist_ok=True)
+        artifacts.write_csv(df.sort_values(by='night'), self.table_file, index=False)
+        artifacts.write_text(self.state_file, json.dumps(state))
+
+    def built(self):
+        """True once the rollup was computed for all nights. Updates of single nights do not count
+        """
+        return os.path.exists(self.complete_file)
+
+    def _state(self):
+        if os.path.exists(self.state_file):
+            return json.load(open(self.state_file, 'r'))
+        return {}
+
+    def update(self, nights=None):
+        """Recomputes the nights whose input files changed (all nights of NL_DIR by default). Returns their number
+        """
+        complete = nights is None
+        if complete:
+            nights = src.nights(self.nl_dir)
+        with self.update_lock:
+            n = self._update(nights)
+            if complete:
+                os.makedirs(self.rollup_dir, exist_ok=True)
+                artifacts.write_text(self.complete_file, json.dumps({'nights': len(nights)}))
+            return n
+
+    def _update(self, nights):
+        state = self._state()
+        changed = {}
+        for night in nights:
+            night = str(night)
+            sources = src.by_location(night, self.attr, self.logger)
+            stat = {loc: s for loc, (_, s) in sources.items()}
+            if state.get(night, {}) == stat:
+                continue
+            dfs = {}
+            for loc, (filen, _) in sources.items():
+                try:
+                    dfs[loc] = pd.read_csv(filen, dtype=str, keep_default_na=False)
+                except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
+                    self.logger.info('Cannot read {}: {}'.format(filen, e))
+            changed[night] = (stat, self.night_rows(night, dfs))
+        if len(changed) == 0:
+            return 0
+        df = self.table()
+        df = df[~df.night.isin(list(changed))]
+        df = pd.concat([df] + [rows for _, rows in changed.values() if len(rows) > 0], ignore_index=True)
+        for night, (stat, _) in changed.items():
+            state[night] = stat
+        with self.lock:
+            self._write(df[self.columns], state)
+        return len(changed)
+
+    def update_night(self, night):
+        return self.update([night])
+
+    @staticmethod
+    def _period(nights, period):
+        """Start of the week or month of each night, as YYYYMMDD
+        """
+        dates = pd.to_datetime(pd.Series(nights, dtype=str), format='%Y%m%d')
+        if period == 'semester':
+            #A: February to July, B: August to January
+            year = dates.dt.year - (dates.dt.month == 1)
+            return (year.astype(str) + np.where(dates.dt.month.between(2, 7), 'A', 'B')).values
+        if PERIODS[period] is None:
+            return dates.dt.strftime('%Y%m%d').values
+        return dates.dt.to_period(PERIODS[period]).dt.start_time.dt.strftime('%Y%m%d').values
+
+    def _select(self, first_night=None, last_night=None):
+        df = self.table()
+        if first_night is not None:
+            df = df[df.night >= str(first_night)]
+        if last_night is not None:
+            df = df[df.night <= str(last_night)]
+        return df
+
+
+class ProblemRollup(Rollup):
+    name = 'problems'
+    attr = 'obs_pb'
+    columns = PROBLEM_COLUMNS
+    dtypes = {'night': str, 'alarm_id': str, 'first': str, 'last': str}
+
+    def night_rows(self, night, dfs):
+        dfs = [df for df in dfs.values() if 'Time' in df.columns]
+        if len(dfs) == 0:
+            return pd.DataFrame(columns=self.columns)
+        df = pd.concat(dfs, ignore_index=True)
+        alarm = df['alarm_id'] if 'alarm_id' in df.columns else pd.Series('', index=df.index)
+        alarm = alarm.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+        alarm[alarm.isin(['', 'nan', 'None'])] = NO_ALARM
+        time = pd.to_datetime(df['Time'], format='%Y%m%dT%H:%M', errors='coerce')
+        noon = pd.to_datetime(str(night), format='%Y%m%d') + pd.Timedelta(hours=12)
+        rows = pd.DataFrame({'alarm_id': alarm, 'time': time, 'hour': (time - noon).dt.total_seconds()/3600})
+        out = rows.groupby('alarm_id').agg(count=('alarm_id', 'size'), first=('time', 'min'), last=('time', 'max'), hour_sum=('hour', 'sum')).reset_index()
+        out['night'] = str(night)
+        for col in ['first', 'last']:
+            out[col] = out[col].dt.strftime('%Y%m%dT%H:%M').fillna('')
+        return out[self.columns]
+
+    def counts(self, period='night', first_night=None, last_night=None, alarm_ids=None):
+        """Number of problems per period (night, week or month) and alarm_id, as a table with one column per alarm_id
+        """
+        df = self._select(first_night, last_night)
+        if alarm_ids is not None:
+            df = df[df.alarm_id.isin([str(a) for a in alarm_ids])]
+        if len(df) == 0:
+            return pd.DataFrame()
+        df = df.assign(period=self._period(df.night, period), count=df['count'].astype(int))
+        return df.pivot_table(index='period', columns='alarm_id', values='count', aggfunc='sum', fill_value=0)
+
+    def alarms(self, first_night=None, last_night=None):
+        """For each alarm_id: number of problems and nights, first and last occurrence and mean time of night, most frequent first
+        """
+        df = self._select(first_night, last_night)
+        if len(df) == 0:
+            return pd.DataFrame(columns=['alarm_id', 'count', 'nights', 'first', 'last', 'mean_hour'])
+        df = df.assign(count=df['count'].astype(int), hour_sum=pd.to_numeric(df.hour_sum, errors='coerce'),
+                       first=df['first'].replace('', np.nan), last=df['last'].replace('', np.nan))
+        out = df.groupby('alarm_id').agg(count=('count', 'sum'), nights=('night', 'nunique'), first=('first', 'min'),
+                                         last=('last', 'max'), hour_sum=('hour_sum', 'sum')).reset_index()
+        out['mean_hour'] = (out.hour_sum/out['count']).round(2)
+        return out.drop(columns='hour_sum').sort_values(by='count', ascending=False).reset_index(drop=True)
+
+
+class TimeUseRollup(Rollup):
+    name = 'time_use'
+    attr = 'time_use'
+    columns = TIME_USE_COLUMNS
+
+    def night_rows(self, night, dfs):
+        for loc in ['kpno', 'nersc']:
+            df = dfs.get(loc)
+            if df is not None and len(df) > 0:
+                row = df.iloc[[0]].reindex(columns=TIME_USE).apply(pd.to_numeric, errors='coerce')
+                row.insert(0, 'location', loc)
+                row.insert(0, 'night', str(night))
+                return row[self.columns]
+        return pd.DataFrame(columns=self.columns)
+
+    def efficiency(self, period='month', first_night=None, last_night=None):
+        """Time use (hours) summed per period (night, week, month or semester), with the open shutter fraction
+        within the 12 and 18 degree twilights
+        """
+        df = self._select(first_night, last_night)
+        if len(df) == 0:
+            return pd.DataFrame(columns=['period', 'nights'] + TIME_USE + ['open_12deg', 'open_18deg'])
+        df = df.assign(period=self._period(df.night, period))
+        out = df.groupby('period')[TIME_USE].sum(min_count=1)
+        out.insert(0, 'nights', df.groupby('period').size())
+        #Only the nights where the twilight time is known count in the fractions
+        for deg in ['12deg', '18deg']:
+            known = df[deg].notna() & (df[deg] > 0)
+            obs = df.obs_time.where(known).groupby(df.period).sum()
+            out['open_{}'.format(deg)] = (obs/out[deg].where(out[deg] > 0)).round(3)
+        return out.reset_index()
+
+
+_rollups = {}
+_lock = threading.Lock()
+
+def get_rollup(cls, logger=None):
+    """Rollup of NL_DIR shared by all sessions of the process
+    """
+    with _lock:
+        if cls not in _rollups:
+            _rollups[cls] = cls(logger=logger)
+        return _rollups[cls]
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rollups')
+_queued = {} #(rollup class, night or None for all nights) -> functions to call when it is updated
+_queue_lock = threading.Lock()
+
+def queue(cls, night=None, on_done=None, logger=None):
+    """Updates a rollup in the background, for one night or all nights. An update already waiting
+    is not queued twice; on_done is called once it is finished
+    """
+    key = (cls, None if night is None else str(night))
+    with _queue_lock:
+        waiting = key in _queued
+        callbacks = _queued.setdefault(key, [])
+        if on_done is not None:
+            callbacks.append(on_done)
+    if waiting:
+        return
+
+    def run():
+        with _queue_lock:
+            callbacks = _queued.pop(key, [])
+        rollup = get_rollup(cls, logger)
+        try:
+            rollup.update(None if key[1] is None else [key[1]])
+        except Exception as e:
+            rollup.logger.info('Could not update the {} rollup: {}'.format(rollup.name, e))
+            return
+        for func in callbacks:
+            func()
+    _executor.submit(run)
+
+def _refresh(event):
+    if event['tab'] == 'problem':
+        queue(ProblemRollup, event['night'])
+
+def update_night(night, logger=None):
+    """Updates all rollups for a night, e.g. at submission
+    """
+    for cls in [ProblemRollup, TimeUseRollup]:
+        get_rollup(cls, logger).update_night(night)
+
+nl.add_listener(_refresh)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Update the rollups of the NightLog entries of all nights')
+    parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    problems = get_rollup(ProblemRollup)
+    print('Problems: updated {} nights'.format(problems.update()))
+    print(problems.alarms().head(20).to_string())
+    time_use = get_rollup(TimeUseRollup)
+    print('Time use: updated {} nights'.format(time_use.update()))
+    print(time_use.efficiency('semester').to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Schedules the periodic callbacks of a Report session.
+
+Instead of refreshing every session at a fixed 30 seconds, a single short tick decides
+whether the Current Night Log and the exposure list are due. Nothing runs until the
+session is connected to a night. Sessions poll fast right after an input or while new
+exposures are arriving, and back off when the night is idle or the page is on another tab.
+Renders of the same night are shared by all sessions through NightActivity, and no session
+renders while a renderer (renderer.py) keeps the NightLog up to date.
+
+"""
+
+import time
+import threading
+
+import nightlog as nl
+import renderer
+import elog
+
+
+TICK = 5          #seconds between scheduler ticks
+FAST = 10         #right after inputs or while exposures are arriving
+NORMAL = 30
+IDLE = 120        #nothing has changed for IDLE_AFTER seconds
+HIDDEN = 300      #the page is not being displayed
+IDLE_AFTER = 900
+MAX_AGE = 120     #longest a shared render is reused before it is redone
+
+
+class NightActivity(object):
+    """Record of what has happened to a night, shared by every session connected to it
+    """
+    def __init__(self):
+        self.last_input = 0
+        self.last_render = 0
+        self.last_new_exp = 0
+        self.n_exposures = 0
+
+    def last_change(self):
+        return max(self.last_input, self.last_new_exp)
+
+
+_nights = {}
+_lock = threading.Lock()
+
+def get_activity(night):
+    with _lock:
+        if night not in _nights:
+            _nights[night] = NightActivity()
+        return _nights[night]
+
+def _record_input(event):
+    get_activity(event['night']).last_input = time.time()
+
+nl.add_listener(_record_input)
+
+
+class Scheduler(object):
+    """Drives current_nl and get_exposure_list for one Report session
+    """
+    def __init__(self, report, doc):
+        self.report = report
+        self.doc = doc
+        self.last_nl = 0
+        self.last_exp = 0
+        self.callback = None
+
+    def start(self):
+        self.callback = self.doc.add_periodic_callback(self.tick, TICK*1000)
+        self.report.layout.on_change('active', self.tab_changed)
+
+    def stop(self):
+        if self.callback is not None:
+            self.doc.remove_periodic_callback(self.callback)
+            self.callback = None
+
+    def tab_changed(self, attr, old, new):
+        """Refresh on the next tick when a page comes back into view
+        """
+        self.last_nl = 0
+        self.last_exp = 0
+
+    def _showing(self, tabs):
+        try:
+            return self.report.layout.tabs[self.report.layout.active] in tabs
+        except Exception:
+            return True
+
+    def interval(self, activity, now, visible):
+        if not visible:
+            return HIDDEN
+        if now - activity.last_change() < 2*NORMAL:
+            return FAST
+        if now - max(activity.last_change(), activity.last_render) > IDLE_AFTER:
+            return IDLE
+        return NORMAL
+
+    def tick(self):
+        if self.report.DESI_Log is None:
+            return
+        now = time.time()
+        activity = get_activity(self.report.night)
+        elog.get_client(self.report.logger).flush_in_background() #eLog entries that could not be posted at submission
+
+        exp_tabs = [getattr(self.report, t, None) for t in ['exp_tab_0', 'exp_tab_1', 'exp_tab_2']]
+        if now - self.last_exp >= self.interval(activity, now, self._showing(exp_tabs)):
+            self.last_exp = now
+            self.report.get_exposure_list()
+            n_exp = len(self.report.exp_select.options)
+            if n_exp > activity.n_exposures:
+                activity.n_exposures = n_exp
+                activity.last_new_exp = now
+
+        nl_tabs = [getattr(self.report, t, None) for t in ['nl_tab_0', 'nl_tab_1']]
+        interval = self.interval(activity, now, self._showing(nl_tabs))
+        if (now - self.last_nl >= interval) or (activity.last_input > self.last_nl):
+            self.last_nl = now
+            render = (activity.last_render <= activity.last_change()) or (now - activity.last_render >= MAX_AGE)
+            if render and renderer.active(self.report.DESI_Log):
+                render = False
+            self.report.current_nl(render=render)
+            if render:
+                activity.last_render = now
@@ -0,0 +1,228 @@
+"""
+Full-text search over the NightLog entries of all nights, with SQLite FTS5.
+
+The index (NL_DIR/ops/search.sqlite) holds the problems and their actions, the exposure comments,
+the milestones and the night summaries. A night is indexed again from its input files whenever
+a NightLog changes them (NightLog listener), in a background thread, and only if the files
+changed since it was last indexed. All nights are indexed in the background the first time the
+index is used, and can be indexed from the command line:
+
+    cd py/desinightlog
+    python search.py --update
+    python search.py "FVC timeout"
+
+"""
+
+import os
+import json
+import time
+import logging
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import nightlog as nl
+import sources as src
+
+#kind -> (NightLog attribute of the input file, column of the time, columns of the text)
+SOURCES = {'problem': ('obs_pb', 'Time', ['Problem', 'action', 'alarm_id', 'Name']),
+           'exposure': ('obs_exp', 'Time', ['Comment', 'Exp_Start', 'Name']),
+           'milestone': ('milestone', 'Time', ['Desc', 'Exp_Start', 'Exp_Stop']),
+           'summary': ('summary_file', None, ['SUMMARY_0', 'SUMMARY_1'])}
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS entries USING fts5(night UNINDEXED, location UNINDEXED, kind UNINDEXED, time UNINDEXED, text);
+CREATE TABLE IF NOT EXISTS sources (night TEXT PRIMARY KEY, state TEXT);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def to_query(text):
+    """FTS5 query from what was typed: every word must match, as a prefix
+    """
+    words = [w.replace('"', '') for w in str(text).split()]
+    return ' '.join('"{}"*'.format(w) for w in words if w != '')
+
+
+class SearchIndex(object):
+    def __init__(self, nl_dir=None, db_file=None, logger=None):
+        self.nl_dir = nl_dir or os.environ['NL_DIR']
+        self.db_file = db_file or os.path.join(self.nl_dir, 'ops', 'search.sqlite')
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='search')
+        self.queued = set()
+        self.updating = False
+        os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            #The DB is on the file system shared by both sites, where the WAL of SQLite does not work.
+            #Databases created in WAL mode are switched back to the rollback journal
+            conn.execute('PRAGMA journal_mode=DELETE')
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _connect(self):
+        """Connection in a transaction that is committed at the end of the block
+        """
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _files(self, night):
+        """Input files of a night: (kind, location, path, [mtime, size])
+        """
+        kinds = {attr: kind for kind, (attr, _, _) in SOURCES.items()}
+        return [(kinds[attr], loc, filen, stat) for attr, loc, filen, stat in src.night_files(night, list(kinds), self.logger)]
+
+    def _rows(self, night, files):
+        for kind, loc, filen, _ in files:
+            _, time_col, text_cols = SOURCES[kind]
+            try:
+                df = pd.read_csv(filen, dtype=str, keep_default_na=False)
+            except pd.errors.EmptyDataError:
+                continue
+            for row in df.to_dict('records'):
+                text = ' '.join(str(row[c]) for c in text_cols if c in row and str(row[c]) not in ['', 'nan', 'None'])
+                if text.strip() != '':
+                    yield (str(night), loc, kind, str(row.get(time_col, '')) if time_col else '', text)
+
+    def index_night(self, night, force=False):
+        """Indexes the entries of a night again if its files changed. Returns True if it was indexed
+        """
+        night = str(night)
+        files = self._files(night)
+        state = json.dumps([[kind, loc, stat] for kind, loc, _, stat in files])
+        with self.lock, self._connect() as conn:
+            old = conn.execute('SELECT state FROM sources WHERE night = ?', (night,)).fetchone()
+            if not force and old is not None and old[0] == state:
+                return False
+            rows = list(self._rows(night, files))
+            conn.execute('DELETE FROM entries WHERE night = ?', (night,))
+            conn.executemany('INSERT INTO entries (night, location, kind, time, text) VALUES (?, ?, ?, ?, ?)', rows)
+            conn.execute('INSERT OR REPLACE INTO sources (night, state) VALUES (?, ?)', (night, state))
+        return True
+
+    def update(self):
+        """Indexes the nights of NL_DIR that changed. Returns the number of nights indexed
+        """
+        n = 0
+        for night in src.nights(self.nl_dir):
+            try:
+                n += self.index_night(night)
+            except Exception as e:
+                self.logger.info('Could not index night {}: {}'.format(night, e))
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('complete', ?)", (time.strftime('%Y%m%dT%H:%M:%S'),))
+        return n
+
+    def built(self):
+        """True once all nights of NL_DIR were indexed by update
+        """
+        with self._connect() as conn:
+            return conn.execute("SELECT value FROM meta WHERE key = 'complete'").fetchone() is not None
+
+    def queue_update(self, on_done=None):
+        """Indexes all nights in the background, unless an update is already running. on_done is called once it is finished
+        """
+        with self.lock:
+            if self.updating:
+                return False
+            self.updating = True
+
+        def run():
+            try:
+                n = self.update()
+                self.logger.info('Indexed {} nights for the search'.format(n))
+            except Exception as e:
+                self.logger.info('Could not index the nights: {}'.format(e))
+            finally:
+                with self.lock:
+                    self.updating = False
+            if on_done is not None:
+                on_done()
+        self.executor.submit(run)
+        return True
+
+    def queue(self, night):
+        """Indexes a night in the background. A night already waiting is not queued twice
+        """
+        night = str(night)
+        with self.lock:
+            if night in self.queued:
+                return
+            self.queued.add(night)
+
+        def run():
+            with self.lock:
+                self.queued.discard(night)
+            try:
+                self.index_night(night)
+            except Exception as e:
+                self.logger.info('Could not index night {}: {}'.format(night, e))
+        self.executor.submit(run)
+
+    def search(self, text, limit=50):
+        """Best matches of text, as a list of dicts (night, location, kind, time, snippet), and the time taken in ms
+        """
+        start = time.time()
+        query = to_query(text)
+        if query == '':
+            return [], 0.
+        with self._connect() as conn:
+            cur = conn.execute("SELECT night, location, kind, time, snippet(entries, 4, '<b>', '</b>', '...', 16) "
+                               "FROM entries WHERE entries MATCH ? ORDER BY rank LIMIT ?", (query, int(limit)))
+            hits = [dict(zip(['night', 'location', 'kind', 'time', 'snippet'], row)) for row in cur.fetchall()]
+        return hits, (time.time() - start)*1000
+
+
+_index = None
+_lock = threading.Lock()
+
+def get_index(logger=None):
+    """SearchIndex of NL_DIR shared by all sessions of the process
+    """
+    global _index
+    with _lock:
+        if _index is None:
+            _index = SearchIndex(logger=logger)
+            if not _index.built():
+                _index.queue_update()
+        return _index
+
+def _reindex(event):
+    if event['tab'] in ['problem', 'exp', 'milestone', 'summary'] or event['action'] == 'delete':
+        get_index().queue(event['night'])
+
+nl.add_listener(_reindex)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search the NightLog entries of all nights')
+    parser.add_argument('query', nargs='?', default=None)
+    parser.add_argument('--update', action='store_true', help='Index the nights that changed first')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    index = SearchIndex()
+    if args.update:
+        print('Indexed {} nights'.format(index.update()))
+    if args.query is not None:
+        hits, ms = index.search(args.query, args.limit)
+        for hit in hits:
+            print('{night} {time:>14} {location:5} {kind:9} {snippet}'.format(**hit))
+        print('{} hits in {:.1f} ms'.format(len(hits), ms))
+
+
+if __name__ == '__main__':
+    main()
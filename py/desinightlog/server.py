@@ -0,0 +1,55 @@
+"""
+Runs the ObserverReport Bokeh application together with the HTTP handlers in handlers.py
+
+    cd py/desinightlog
+    python server.py --port 5006 --allow-websocket-origin desi-4.kpno.noao.edu:5006
+
+This replaces `bokeh serve ObserverReport` when the read-only endpoints are wanted.
+
+"""
+
+import os
+import sys
+import argparse
+
+from bokeh.application import Application
+from bokeh.application.handlers import DirectoryHandler
+from bokeh.server.server import Server
+
+sys.path.append(os.getcwd())
+import handlers
+import renderer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the DESI NightLog with its read-only endpoints')
+    parser.add_argument('--port', type=int, default=5006)
+    parser.add_argument('--address', default=None)
+    parser.add_argument('--allow-websocket-origin', action='append', default=None, dest='origins')
+    parser.add_argument('--app', default='ObserverReport', help='Directory of the Bokeh application')
+    parser.add_argument('--render', default=None, choices=['kpno', 'nersc'], help='Keep the Current NightLog of this location rendered (renderer.py)')
+    args = parser.parse_args()
+
+    #Same defaults as ObserverReport/main.py, needed before any session has been opened
+    if os.environ['USER'].lower() == 'desiobserver':
+        os.environ['NL_DIR'] = '/n/home/desiobserver/nightlogs'
+        os.environ['NW_DIR'] = '/exposures/desi'
+
+    app = Application(DirectoryHandler(filename=args.app))
+    kwargs = {'port': args.port, 'extra_patterns': handlers.patterns()}
+    if args.address is not None:
+        kwargs['address'] = args.address
+    if args.origins is not None:
+        kwargs['allow_websocket_origin'] = args.origins
+
+    server = Server({'/{}'.format(os.path.basename(os.path.normpath(args.app))): app}, **kwargs)
+    server.start()
+    handlers.BROKER.start()
+    if args.render is not None:
+        renderer.Renderer(args.render).start()
+    print('DESI NightLog running on port {}'.format(args.port))
+    server.io_loop.start()
+
+
+if __name__ == '__main__':
+    main()
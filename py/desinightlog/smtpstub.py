@@ -0,0 +1,112 @@
+"""
+Stand-in of an SMTP server, for tests and development without a mail server.
+
+The server keeps the messages it receives in memory. It can refuse some recipients and answer the
+next messages with an error, permanent (5xx) or temporary (4xx), to exercise the retries of
+mailer.Outbox. The NightLog sends to it with SMTP_HOST and SMTP_PORT, e.g.
+
+    cd py/desinightlog
+    python smtpstub.py --port 8025
+    SMTP_HOST=localhost SMTP_PORT=8025 bokeh serve ObserverReport
+
+"""
+
+import argparse
+import threading
+import socketserver
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0)):
+        super().__init__(address, StubHandler)
+        self.messages = [] #(sender, recipients, message)
+        self.lock = threading.Lock()
+        self.refused = set() #recipients answered with 550
+        self.fail = 0 #number of the next messages answered with fail_code
+        self.fail_code = 554
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='smtpstub', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode('ascii'))
+
+    def handle(self):
+        self.reply('220 smtpstub ready')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline().decode('utf-8', 'replace').rstrip('\r\n')
+            if line == '':
+                return
+            command = line.split(' ', 1)[0].upper()
+            arg = line[len(command):].strip()
+            if command in ['EHLO', 'HELO']:
+                self.reply('250 smtpstub')
+            elif command == 'MAIL':
+                sender, recipients = arg.split(':', 1)[1].strip().strip('<>'), []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                address = arg.split(':', 1)[1].strip().strip('<>')
+                if address in self.server.refused:
+                    self.reply('550 No such user {}'.format(address))
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    data = self.rfile.readline().decode('utf-8', 'replace')
+                    if data.rstrip('\r\n') == '.' or data == '':
+                        break
+                    lines.append(data[1:] if data.startswith('..') else data)
+                with self.server.lock:
+                    fail = self.server.fail > 0
+                    if fail:
+                        self.server.fail -= 1
+                    else:
+                        self.server.messages.append((sender, recipients, ''.join(lines)))
+                if fail:
+                    self.reply('{} Message refused'.format(self.server.fail_code))
+                else:
+                    self.reply('250 OK')
+                sender, recipients = None, []
+            elif command == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif command == 'NOOP':
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stand-in of an SMTP server')
+    parser.add_argument('--port', type=int, default=8025)
+    args = parser.parse_args()
+    stub = SMTPStub(('127.0.0.1', args.port))
+    print('SMTP stand-in at SMTP_HOST=localhost SMTP_PORT={}'.format(stub.port))
+    stub.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Nights of NL_DIR and the input files of their NightLogs at both locations, for the modules that
+aggregate all nights (archive.py, rollups.py, search.py, rerender.py).
+
+The state of an input file is [mtime, size], so an aggregate can keep the state of the files it
+was computed from and only read a night again when one of them changed.
+
+"""
+
+import os
+import sys
+import logging
+
+import nightlog as nl
+import nightdirs
+
+LOCATIONS = ['kpno', 'nersc']
+
+
+def nights(nl_dir=None, first_night=None, last_night=None):
+    """Night directories (YYYYMMDD) of NL_DIR between first_night and last_night, oldest first
+    """
+    names = nightdirs.get_night_dirs(nl_dir).latest(sys.maxsize, before=last_night)
+    return sorted(n for n in names if len(n) == 8 and (first_night is None or n >= str(first_night)))
+
+def night_files(night, attrs, logger=None):
+    """Input files of a night that exist: (attr, location, path, [mtime, size]) for each NightLog attribute in attrs
+    """
+    logger = logger or logging.getLogger(__name__)
+    files = []
+    for loc in LOCATIONS:
+        log = nl.NightLog(str(night), loc, logger)
+        for attr in attrs:
+            filen = getattr(log, attr)
+            try:
+                st = os.stat(filen)
+            except OSError:
+                continue
+            files.append((attr, loc, filen, [st.st_mtime, st.st_size]))
+    return files
+
+def by_location(night, attr, logger=None):
+    """Input file of a night at each location: location -> (path, [mtime, size])
+    """
+    return {loc: (filen, stat) for _, loc, filen, stat in night_files(night, [attr], logger)}
@@ -0,0 +1,242 @@
+"""
+Static website of the archived Night Summaries, to browse them from a plain web server.
+
+    <out>/index.html           months, newest first, and a search box
+    <out>/<YYYYMM>.html        nights of a month
+    <out>/<night>/index.html   summary of a night, with links to the previous and next nights
+    <out>/<night>/*.png        its images
+    <out>/search.json          text of every summary, for the search box
+
+The nights are those of SummaryIndex (nightsum.py). A night is only rendered again when its
+summary, its images, its neighbours or this file changed (manifest.json keeps their state), and
+the nights to render are spread over a pool of processes. The month pages, the index and
+search.json are then written from the manifest, only if their content changed.
+
+    cd py/desinightlog
+    python staticsite.py [--out /var/www/nightsummaries] [--workers 8] [--force]
+
+"""
+
+import os
+import re
+import sys
+import html
+import json
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+import calendar
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import nightsum
+import artifacts
+
+MAX_TEXT = 20000 #characters of a summary kept in search.json
+
+_tags = re.compile(r'<(script|style)\b.*?</\1>|<[^>]*>', re.S | re.I)
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>{title}</title>
+<style>body {{font-family: sans-serif; margin: 1em 2em}} nav {{margin: 1em 0}} nav a {{margin-right: 1em}} img {{max-width: 100%}}</style>
+</head>
+<body>
+<nav>{nav}</nav>
+{body}
+<nav>{nav}</nav>
+</body>
+</html>
+"""
+
+SEARCH = """<input id="q" size="40" placeholder="Search the Night Summaries"> <span id="n"></span>
+<ul id="hits"></ul>
+<script>
+var entries = null;
+document.getElementById('q').addEventListener('input', function() {
+    var words = this.value.toLowerCase().split(/\\s+/).filter(function(w) {return w != '';});
+    var show = function() {
+        var hits = words.length == 0 ? [] : entries.filter(function(e) {
+            var text = e.text.toLowerCase();
+            return words.every(function(w) {return text.indexOf(w) >= 0;});
+        });
+        document.getElementById('n').textContent = words.length == 0 ? '' : hits.length + ' nights';
+        document.getElementById('hits').innerHTML = hits.slice(0, 100).map(function(e) {
+            return '<li><a href="' + e.night + '/index.html">' + e.night + '</a></li>';
+        }).join('');
+    };
+    if (entries === null) {
+        fetch('search.json').then(function(r) {return r.json();}).then(function(d) {entries = d; show();});
+    } else {
+        show();
+    }
+});
+</script>
+"""
+
+
+def code_version():
+    with open(os.path.abspath(__file__), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def month(night):
+    return str(night)[:6]
+
+def month_title(m):
+    return '{} {}'.format(calendar.month_name[int(m[4:])], m[:4])
+
+def plain_text(summary_html):
+    """Text of a summary for searching, without the table of exposures
+    """
+    summary_html = summary_html.split("<h3 id='exposures'>")[0]
+    text = html.unescape(_tags.sub(' ', summary_html))
+    return ' '.join(text.split())[:MAX_TEXT]
+
+def source_state(filen):
+    """mtime and size of a summary and of the images next to it
+    """
+    state = {}
+    root_dir = os.path.dirname(filen)
+    for de in os.scandir(root_dir):
+        if de.name == os.path.basename(filen) or (de.name.endswith('.png') and de.is_file()):
+            st = de.stat()
+            state[de.name] = [st.st_mtime_ns, st.st_size]
+    return state
+
+def _copy(src, dst):
+    """Copies a file unless dst already has the same size and mtime
+    """
+    try:
+        s, d = os.stat(src), os.stat(dst)
+        if (s.st_size, s.st_mtime_ns) == (d.st_size, d.st_mtime_ns):
+            return
+    except OSError:
+        pass
+    tmp = artifacts.tmp_path(dst)
+    shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+def render_night(night, filen, prev_night, next_night, out_dir):
+    """Writes the page of a night and its images. Returns (night, status, seconds, text or error message)
+    """
+    start = time.time()
+    try:
+        night_dir = os.path.join(out_dir, night)
+        os.makedirs(night_dir, exist_ok=True)
+        body, images = nightsum.split_images(open(filen, 'r').read(), night)
+        for name, data in images.items():
+            artifacts.write_bytes(os.path.join(night_dir, name), data)
+        for name in nightsum.image_names(body):
+            src = os.path.join(os.path.dirname(filen), name)
+            if name not in images and os.path.exists(src):
+                _copy(src, os.path.join(night_dir, name))
+        nav = ['<a href="../{}/index.html">&laquo; {}</a>'.format(prev_night, prev_night) if prev_night else '',
+               '<a href="../{}.html">{}</a>'.format(month(night), month_title(month(night))),
+               '<a href="../index.html">All nights</a>',
+               '<a href="../{}/index.html">{} &raquo;</a>'.format(next_night, next_night) if next_night else '']
+        artifacts.write_text(os.path.join(night_dir, 'index.html'),
+                             PAGE.format(title='DESI Night Summary {}'.format(night), nav=' '.join(nav), body=body))
+        return night, 'rendered', time.time() - start, plain_text(body)
+    except Exception as e:
+        return night, 'failed', time.time() - start, '{}: {}'.format(e.__class__.__name__, e)
+
+
+class StaticSite(object):
+    def __init__(self, out_dir, index=None, logger=None):
+        self.out_dir = out_dir
+        self.index = index or nightsum.get_index()
+        self.logger = logger or logging.getLogger(__name__)
+        self.manifest_file = os.path.join(out_dir, 'manifest.json')
+        self.search_file = os.path.join(out_dir, 'search.json')
+
+    def _load(self, filen, default):
+        if os.path.exists(filen):
+            try:
+                return json.load(open(filen, 'r'))
+            except ValueError:
+                self.logger.info('Cannot read {}, rebuilding it'.format(filen))
+        return default
+
+    def build(self, workers=None, force=False, report=print):
+        """Brings the site up to date. Returns the results of render_night for the nights that were rendered
+        """
+        os.makedirs(self.out_dir, exist_ok=True)
+        summaries = {n: f for n, f in self.index.nights().items() if len(n) == 8 and n.isdigit() and os.path.exists(f)}
+        nights = sorted(summaries)
+        manifest = self._load(self.manifest_file, {})
+        if manifest.get('version') != code_version():
+            manifest = {'version': code_version(), 'nights': {}}
+        texts = {e['night']: e['text'] for e in self._load(self.search_file, [])}
+
+        todo = []
+        for i, night in enumerate(nights):
+            state = {'source': source_state(summaries[night]),
+                     'prev': nights[i - 1] if i > 0 else None,
+                     'next': nights[i + 1] if i + 1 < len(nights) else None}
+            if force or manifest['nights'].get(night) != state or night not in texts:
+                todo.append((night, state))
+
+        results = []
+        if len(todo) > 0:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(render_night, night, summaries[night], state['prev'], state['next'], self.out_dir): state
+                           for night, state in todo}
+                for future in as_completed(futures):
+                    night, status, seconds, text = result = future.result()
+                    if status == 'rendered':
+                        manifest['nights'][night] = futures[future]
+                        texts[night] = text
+                        text = ''
+                    results.append(result)
+                    report('{} {:8} {:6.2f}s {}'.format(night, status, seconds, text))
+
+        for night in set(manifest['nights']) - set(summaries):
+            shutil.rmtree(os.path.join(self.out_dir, night), ignore_errors=True)
+            del manifest['nights'][night]
+            texts.pop(night, None)
+
+        self._write_indexes(sorted(manifest['nights']))
+        artifacts.write_text(self.search_file, json.dumps([{'night': n, 'text': texts[n]} for n in sorted(texts, reverse=True)
+                                                           if n in manifest['nights']]))
+        artifacts.write_text(self.manifest_file, json.dumps(manifest))
+        return sorted(results)
+
+    def _write_indexes(self, nights):
+        months = {}
+        for night in nights:
+            months.setdefault(month(night), []).append(night)
+        for m, month_nights in months.items():
+            items = ''.join('<li><a href="{0}/index.html">{0}</a></li>'.format(n) for n in month_nights)
+            artifacts.write_text(os.path.join(self.out_dir, '{}.html'.format(m)),
+                                 PAGE.format(title='DESI Night Summaries {}'.format(month_title(m)), nav='<a href="index.html">All nights</a>',
+                                             body='<h1>{}</h1><ul>{}</ul>'.format(month_title(m), items)))
+        #Month pages of months without summaries any more
+        for filen in os.listdir(self.out_dir):
+            if re.fullmatch(r'\d{6}\.html', filen) and filen[:6] not in months:
+                os.remove(os.path.join(self.out_dir, filen))
+        items = ''.join('<li><a href="{}.html">{}</a> ({} nights)</li>'.format(m, month_title(m), len(months[m]))
+                        for m in sorted(months, reverse=True))
+        artifacts.write_text(os.path.join(self.out_dir, 'index.html'),
+                             PAGE.format(title='DESI Night Summaries', nav='',
+                                         body='<h1>DESI Night Summaries</h1>{}<ul>{}</ul>'.format(SEARCH, items)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a static website of the archived Night Summaries')
+    parser.add_argument('--out', default=None, help='Directory of the website (default: NL_DIR/ops/site)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes (default: number of CPUs)')
+    parser.add_argument('--force', action='store_true', help='Render nights that did not change')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    start = time.time()
+    site = StaticSite(args.out or os.path.join(os.environ['NL_DIR'], 'ops', 'site'))
+    results = site.build(args.workers, args.force)
+    failed = [r for r in results if r[1] == 'failed']
+    print('{} rendered, {} failed in {:.1f}s'.format(len(results) - len(failed), len(failed), time.time() - start))
+    sys.exit(1 if len(failed) > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Static telemetry plots that are sent with the NightLog, rendered in a worker process.
+
+The figure is made from the telemetry table of Report.get_telem_data. The worker builds the
+8-panel figure once and, for each night, only replaces the data of the lines, so the figure is
+not created again. The figure is not registered with pyplot, so it is released with the worker.
+Rendering in a separate process keeps the server's GIL free while the figure is drawn.
+
+"""
+
+import atexit
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+TIMEOUT = 120 #seconds
+
+#(y label, [(column, label), ...]) of each panel
+PANELS = [("Telescope Temperature (C)", [('mirror_temp', 'mirror temp'), ('truss_temp', 'truss temp'), ('air_temp', 'air temp')]),
+          ("Humidity %", [('humidity', 'humidity')]),
+          ("Wind Speed (mph)", [('wind_speed', 'wind speed')]),
+          ("Airmass", [('airmass', 'airmass')]),
+          ("Exposure time (s)", [('exptime', 'exptime')]),
+          ("Seeing", [('seeing', 'seeing')]),
+          ("Transparency (%)", [('tput', 'transparency')]),
+          ("Sky level (AB/arcsec^2)", [('skylevel', 'Sky Level')])]
+
+
+##Worker side
+_template = None
+
+def _build_template():
+    """Figure with the axes, labels and an empty line for each column
+    """
+    import matplotlib as mpl
+    mpl.use('Agg')
+    import matplotlib.dates as mdates
+    import pytz
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib import cm
+
+    with mpl.style.context('ggplot'), mpl.rc_context({'axes.labelsize': 'small'}):
+        fig = Figure(figsize=(10,15))
+        FigureCanvasAgg(fig)
+        color = iter(cm.tab10(np.linspace(0,1,8)))
+        lines = {}
+        axes = []
+        for i, (ylabel, columns) in enumerate(PANELS):
+            ax = fig.add_subplot(len(PANELS), 1, i + 1, sharex=axes[0] if len(axes) > 0 else None)
+            for col, label in columns:
+                kw = {} if len(columns) > 1 else {'color': next(color)}
+                lines[col], = ax.plot([], [], 'o-', label=label, **kw)
+            if len(columns) > 1:
+                ax.legend()
+            ax.set_ylabel(ylabel)
+            ax.grid(True)
+            ax.tick_params(labelbottom=False)
+            axes.append(ax)
+        ax = axes[-1]
+        ax.tick_params(labelbottom=True, labelrotation=45)
+        ax.set_xlabel("Local Time (MST)")
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%m/%d %H:%M', tz=pytz.timezone("US/Arizona")))
+        title = fig.suptitle('', fontsize=14)
+    return fig, axes, lines, title
+
+def render(telem_data, night, filen):
+    """Draws the telemetry of a night into the template figure and saves it to filen
+    """
+    global _template
+    if _template is None:
+        _template = _build_template()
+    fig, axes, lines, title = _template
+
+    import matplotlib.dates as mdates
+    time = mdates.date2num(list(telem_data['time'])) if len(telem_data['time']) > 0 else []
+    for col, line in lines.items():
+        line.set_data(time, np.array(telem_data[col], dtype=float))
+    for ax in axes:
+        ax.relim()
+        ax.autoscale_view()
+    title.set_text("Telemetry for obsday {}".format(night))
+    fig.tight_layout()
+    fig.savefig(filen)
+    return filen
+
+
+##Server side
+_executor = None
+_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            #spawn, as forking the threaded server process is not safe
+            _executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+def _shutdown():
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+
+atexit.register(_shutdown)
+
+def save_figure(telem_data, night, filen, timeout=TIMEOUT, logger=None):
+    """Renders the telemetry plots in the worker process and waits for the file.
+    If the worker died it is restarted once
+    """
+    global _executor
+    logger = logger or logging.getLogger(__name__)
+    data = {col: list(telem_data[col]) for col in ['time'] + [c for _, cols in PANELS for c, _ in cols]}
+    for attempt in range(2):
+        try:
+            return _get_executor().submit(render, data, night, filen).result(timeout=timeout)
+        except Exception as e:
+            from concurrent.futures.process import BrokenProcessPool
+            if not isinstance(e, BrokenProcessPool) or attempt == 1:
+                raise
+            logger.info('Telemetry plot worker died, restarting it')
+            with _lock:
+                _executor = None
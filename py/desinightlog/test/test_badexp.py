@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import badexp
+
+
+def bad_exps(night, rows):
+    return pd.DataFrame([{'NIGHT': night, 'EXPID': e, 'BAD': bad, 'BADCAMS': cams, 'COMMENT': ''} for e, bad, cams in rows])
+
+
+class TestBadExpStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = badexp.BadExpStore(self.tmp)
+        self.store.merge_night(20230101, bad_exps(20230101, [(100, False, 'b0r1'), (101, True, '')]))
+        self.store.merge_night(20240101, bad_exps(20240101, [(200, False, 'z1'), (201, False, 'a5')]))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_find(self):
+        self.assertEqual(list(self.store.find(1).EXPID), [100, 101, 200])
+        self.assertEqual(list(self.store.find(1, 'z').EXPID), [101, 200])
+        self.assertEqual(list(self.store.find(5, first_night=20231231).EXPID), [201])
+        self.assertEqual(list(self.store.find(0, start=101).EXPID), [101])
+        found = self.store.find(0, 'b', details=True)
+        self.assertEqual(list(found.BADCAMS.fillna('')), ['b0r1', ''])
+
+    def test_table_follows_index(self):
+        self.assertEqual(len(self.store.table()), 4)
+        other = badexp.BadExpStore(self.tmp)
+        other.merge_night(20240102, bad_exps(20240102, [(300, False, 'r9')]))
+        self.assertEqual(list(self.store.find(9, 'r').EXPID), [101, 300])
+
+    def test_moved_exposure(self):
+        self.store.merge_night(20230102, bad_exps(20230102, [(100, False, 'z4')]))
+        table = self.store.table().set_index('EXPID')
+        self.assertEqual(table.loc[100, 'NIGHT'], 20230102)
+        self.assertEqual(list(self.store.find(0).EXPID), [101])
+
+    def test_old_index(self):
+        index = json.load(open(self.store.index_file, 'r'))
+        del index['cammask']
+        json.dump(index, open(self.store.index_file, 'w'))
+        store = badexp.BadExpStore(self.tmp)
+        self.assertEqual(list(store.find(1, 'z').EXPID), [101, 200])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import elog
+import eclstub
+
+
+class TestElogClient(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.stub = eclstub.ECLStub().start()
+        self.client = self.make_client()
+
+    def tearDown(self):
+        self.stub.delay = 0
+        self.stub.stop()
+        shutil.rmtree(self.tmp)
+
+    def make_client(self, **kwargs):
+        kwargs = dict(dict(outbox_dir=os.path.join(self.tmp, 'outbox'), retries=0, backoff=0, timeout=5), **kwargs)
+        return elog.ElogClient(url=self.stub.url, **kwargs)
+
+    def texts(self):
+        return sorted(e['text'].split('\n')[0] for e in self.stub.entries)
+
+    def test_post_once(self):
+        self.assertTrue(self.client.post('Synopsis_Night', 'h1. Night', 'Night Summary 20230101'))
+        self.assertFalse(self.client.post('Synopsis_Night', 'h1. Night', 'Night Summary 20230101'))
+        self.assertEqual(len(self.stub.entries), 1)
+
+    def test_corrected_entry(self):
+        self.assertTrue(self.client.post('Synopsis_Night', 'h1. Night', 'Night Summary 20230101'))
+        self.assertTrue(self.client.post('Synopsis_Night', 'h1. Night, corrected', 'Night Summary 20230101'))
+        self.assertEqual(len(self.stub.entries), 2)
+
+    def test_queued_entry_replaced(self):
+        #An entry that could not be posted is replaced by the next submission of the same night
+        self.client.queue({'category': 'Synopsis_Night', 'text': 'old', 'subject': 'Night Summary 20230101', 'textile': True})
+        self.client.queue({'category': 'Synopsis_Night', 'text': 'other night', 'subject': 'Night Summary 20221231', 'textile': True})
+        self.assertTrue(self.client.post('Synopsis_Night', 'new', 'Night Summary 20230101'))
+        self.assertEqual(self.texts(), ['new', 'other night'])
+        self.assertEqual(self.client.outbox(), [])
+
+    def test_reconnect(self):
+        client = self.make_client(retries=2)
+        self.stub.fail = 2
+        self.assertTrue(client.post('Synopsis_Night', 'h1. Night', 'Night Summary 20230101'))
+        self.assertEqual(len(self.stub.entries), 1)
+        self.assertEqual(self.stub.fail, 0)
+
+    def test_timeout(self):
+        client = self.make_client(timeout=0.5)
+        self.stub.delay = 2
+        start = time.time()
+        with self.assertRaises(elog.ElogError):
+            client.post('Synopsis_Night', 'h1. Night', 'Night Summary 20230101')
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual(len(client.outbox()), 1)
+
+        #Sent with the next post once the eLog answers again
+        self.stub.delay = 0
+        time.sleep(2)
+        self.assertTrue(client.post('Synopsis_Night', 'h1. Other night', 'Night Summary 20230102'))
+        self.assertEqual(self.texts(), ['h1. Night', 'h1. Other night'])
+        self.assertEqual(client.outbox(), [])
+
+    def test_flush_in_background(self):
+        self.client.queue({'category': 'Synopsis_Night', 'text': 'queued', 'subject': 'Night Summary 20230101', 'textile': True})
+        self.assertTrue(self.client.flush_in_background(interval=0))
+        for _ in range(50):
+            if len(self.stub.entries) == 1 and len(os.listdir(self.client.outbox_dir)) == 0:
+                break
+            time.sleep(0.1)
+        self.assertEqual(os.listdir(self.client.outbox_dir), [])
+        self.assertEqual(len(self.stub.entries), 1)
+        self.assertFalse(self.client.flush_in_background())
+
+    def test_flush_empty_outbox(self):
+        self.assertFalse(self.client.flush_in_background(interval=0))
+        #The empty outbox is not looked at again before the interval
+        self.client.queue({'category': 'Synopsis_Night', 'text': 'queued', 'subject': 'Night Summary 20230101', 'textile': True})
+        self.assertFalse(self.client.flush_in_background(interval=60))
+
+    def test_claimed_entry(self):
+        #An entry being sent by the other site is left alone, unless the claim is stale
+        other = self.make_client()
+        other.queue({'category': 'Synopsis_Night', 'text': 'queued', 'subject': 'Night Summary 20230101', 'textile': True})
+        claim = other._claim(other.outbox()[0])
+        self.assertTrue(self.client.flush_outbox())
+        self.assertEqual(len(self.stub.entries), 0)
+        os.utime(claim, (time.time() - elog.CLAIM_TIMEOUT - 1,)*2)
+        self.assertTrue(self.client.flush_outbox())
+        self.assertEqual(len(self.stub.entries), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import explist
+
+
+def exposures(ids, flavor='science', program='dark'):
+    return pd.DataFrame({'date_obs': pd.to_datetime(['2023-01-02T04:00:00']*len(ids), utc=True),
+                         'id': ids, 'tileid': 1000, 'program': program, 'sequence': 'DESI', 'flavor': flavor,
+                         'exptime': 900., 'airmass': 1.1, 'seeing': 1.0})
+
+
+class FakeDB(object):
+    """Answers the queries of ExposureList from a table of exposures, and keeps them
+    """
+    def __init__(self, df):
+        self.df = df
+        self.queries = []
+
+    def read_sql_query(self, query, conn):
+        self.queries.append(query)
+        df = self.df
+        if 'id >' in query:
+            df = df[df.id > int(query.rsplit('id >', 1)[1])]
+        return df.copy()
+
+
+class TestExposureList(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDB(pd.concat([exposures([1, 2, 3], 'arc', 'calib'), exposures(list(range(4, 64)))], ignore_index=True))
+        self.exps = explist.ExposureList('20230101')
+        with mock.patch.object(explist.pd, 'read_sql_query', self.db.read_sql_query):
+            self.assertTrue(self.exps.update(None))
+
+    def update(self):
+        self.exps.last_update = 0
+        with mock.patch.object(explist.pd, 'read_sql_query', self.db.read_sql_query):
+            return self.exps.update(None)
+
+    def test_incremental_update(self):
+        self.assertEqual(self.exps.version, 1)
+        #The latest exposures are checked again, and nothing changed
+        self.assertFalse(self.update())
+        self.assertTrue(self.db.queries[-1].endswith('id > {}'.format(63 - explist.RECHECK)))
+        self.assertEqual(self.exps.version, 1)
+
+        #An exposure filled in after readout, and a new one
+        self.db.df.loc[self.db.df.id == 63, 'seeing'] = 1.5
+        self.db.df = pd.concat([self.db.df, exposures([64])], ignore_index=True)
+        self.assertTrue(self.update())
+        self.assertEqual(self.exps.version, 2)
+        self.assertEqual(list(self.exps.df.id), list(range(1, 65)))
+        self.assertEqual(self.exps.df.set_index('id').loc[63, 'seeing'], 1.5)
+
+    def test_min_interval(self):
+        self.db.df = pd.concat([self.db.df, exposures([64])], ignore_index=True)
+        with mock.patch.object(explist.pd, 'read_sql_query', self.db.read_sql_query):
+            self.assertFalse(self.exps.update(None))
+        self.assertEqual(len(self.db.queries), 1)
+
+    def test_filter(self):
+        self.assertEqual(self.exps.flavors(), ['arc', 'science'])
+        self.assertEqual(list(self.exps.select(flavor='arc').id), [3, 2, 1])
+        self.assertEqual(list(self.exps.select(program='CAL').id), [3, 2, 1])
+        self.assertEqual(list(self.exps.select(flavor='science', id_min=10, id_max=12).id), [12, 11, 10])
+        self.assertEqual(len(self.exps.select(flavor='All')), 63)
+
+    def test_page(self):
+        df, page, n_pages = self.exps.page(0, 50)
+        self.assertEqual((page, n_pages, len(df)), (0, 2, 50))
+        self.assertEqual(df.id[0], 63)
+        df, page, n_pages = self.exps.page(5, 50)
+        self.assertEqual((page, len(df)), (1, 13))
+        df, page, n_pages = self.exps.page(3, 50, flavor='arc')
+        self.assertEqual((page, n_pages, list(df.id)), (0, 1, [3, 2, 1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('USER', 'test')
+try:
+    import handlers
+    from tornado import gen
+    from tornado.web import Application
+    from tornado.httpclient import HTTPClientError
+    from tornado.testing import AsyncHTTPTestCase
+except ImportError:
+    handlers = None
+    AsyncHTTPTestCase = unittest.TestCase
+
+
+def event(night='20230101', tab='problem'):
+    return {'night': night, 'location': 'kpno', 'action': 'add', 'tab': tab, 'time': '20230101T20:00', 'data': {}}
+
+
+@unittest.skipIf(handlers is None, 'tornado is not installed')
+class TestEventBroker(unittest.TestCase):
+
+    def test_resume(self):
+        broker = handlers.EventBroker()
+        for _ in range(3):
+            broker.publish(event())
+        events, reset, last_id = broker.poll(1)
+        self.assertEqual([i for i, _ in events], [2, 3])
+        self.assertFalse(reset)
+        self.assertEqual(last_id, 3)
+
+    def test_missed_events(self):
+        broker = handlers.EventBroker(size=2)
+        for _ in range(5):
+            broker.publish(event())
+        events, reset, last_id = broker.poll(1)
+        self.assertTrue(reset)
+        self.assertEqual(last_id, 5)
+
+    def test_restart(self):
+        #Last-Event-ID from before a restart of the server: one reset, then keepalives
+        broker = handlers.EventBroker()
+        events, reset, last_id = broker.poll(120)
+        self.assertEqual(events, [])
+        self.assertTrue(reset)
+        self.assertEqual(last_id, 0)
+        self.assertEqual(broker.poll(last_id), ([], False, 0))
+        broker.publish(event())
+        events, reset, last_id = broker.poll(last_id)
+        self.assertEqual([i for i, _ in events], [1])
+        self.assertFalse(reset)
+
+
+class HandlerTest(AsyncHTTPTestCase):
+    """Handlers of handlers.patterns() on a NL_DIR with one night
+    """
+    night = '20230101'
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.nl_dir = os.environ.get('NL_DIR')
+        os.environ['NL_DIR'] = self.tmp
+        self.root_dir = os.path.join(self.tmp, self.night)
+        os.makedirs(os.path.join(self.root_dir, 'Observers'))
+        handlers.SnapshotHandler._cache.clear()
+        handlers.NightHandler._cache.clear()
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        if self.nl_dir is None:
+            del os.environ['NL_DIR']
+        else:
+            os.environ['NL_DIR'] = self.nl_dir
+        shutil.rmtree(self.tmp)
+
+    def get_app(self):
+        return Application(handlers.patterns())
+
+    def write(self, name, text, age=0):
+        filen = os.path.join(self.root_dir, name)
+        with open(filen, 'w') as f:
+            f.write(text)
+        if age:
+            os.utime(filen, (time.time() - age,)*2)
+        return filen
+
+
+@unittest.skipIf(handlers is None, 'tornado is not installed')
+class TestSnapshot(HandlerTest):
+
+    def test_snapshot(self):
+        self.write('nightlog_kpno.html', '<h1>DESI Night Summary 20230101</h1>', age=60)
+        self.write('explist_kpno.csv', 'date_obs,id,tileid,program,sequence,flavor,exptime,airmass,seeing\n'
+                   '2023-01-02 04:00,123,1000,dark,DESI,science,900,1.1,1.0\n')
+        response = self.fetch('/snapshot/{}'.format(self.night))
+        self.assertEqual(response.code, 200)
+        page = response.body.decode('utf-8')
+        self.assertIn('<h1>DESI Night Summary 20230101</h1>', page)
+        self.assertIn('<td>123</td>', page)
+        self.assertEqual(self.fetch('/snapshot').body, response.body)
+
+        #Unchanged page
+        response = self.fetch('/snapshot/{}'.format(self.night), headers={'If-None-Match': response.headers['Etag']})
+        self.assertEqual(response.code, 304)
+
+        #The latest of the kpno and nersc NightLogs is shown
+        self.write('nightlog_nersc.html', '<h1>NERSC</h1>')
+        self.assertIn('<h1>NERSC</h1>', self.fetch('/snapshot/{}'.format(self.night)).body.decode('utf-8'))
+
+    def test_not_started(self):
+        page = self.fetch('/snapshot/{}'.format(self.night)).body.decode('utf-8')
+        self.assertIn('has not been started', page)
+        self.assertEqual(self.fetch('/snapshot/20230102').code, 404)
+
+
+@unittest.skipIf(handlers is None, 'tornado is not installed')
+class TestNightAPI(HandlerTest):
+
+    def setUp(self):
+        super().setUp()
+        self.write(os.path.join('Observers', 'problems_kpno.csv'), 'Time,Problem,alarm_id,action,Name\n20230101T20:00,FVC down,12,,x\n')
+
+    def test_night(self):
+        response = self.fetch('/api/night/{}'.format(self.night))
+        self.assertEqual(response.code, 200)
+        data = json.loads(response.body)
+        self.assertEqual(data['night'], self.night)
+        self.assertEqual([p['Problem'] for p in data['problems']], ['FVC down'])
+        self.assertEqual(data['plan'], [])
+        self.assertIsNone(data['meta'])
+        self.assertEqual(json.loads(self.fetch('/api/night').body), data)
+
+    def test_etag(self):
+        etag = self.fetch('/api/night/{}'.format(self.night)).headers['Etag']
+        response = self.fetch('/api/night/{}'.format(self.night), headers={'If-None-Match': etag})
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.body, b'')
+
+        #A change of an input file at either location changes the etag
+        self.write(os.path.join('Observers', 'problems_nersc.csv'), 'Time,Problem,alarm_id,action,Name\n20230101T21:00,dome,,,y\n')
+        response = self.fetch('/api/night/{}'.format(self.night), headers={'If-None-Match': etag})
+        self.assertEqual(response.code, 200)
+        self.assertNotEqual(response.headers['Etag'], etag)
+        self.assertEqual(len(json.loads(response.body)['problems']), 2)
+
+    def test_unknown_night(self):
+        self.assertEqual(self.fetch('/api/night/20230102').code, 404)
+
+
+
+@unittest.skipIf(handlers is None, 'tornado is not installed')
+class TestEventStream(HandlerTest):
+
+    def setUp(self):
+        super().setUp()
+        self.broker = handlers.EventBroker()
+        self.broker.io_loop = self.io_loop
+        self.saved = handlers.BROKER, handlers.EventStreamHandler.keepalive
+        handlers.BROKER = self.broker
+        handlers.EventStreamHandler.keepalive = 0.2
+
+    def tearDown(self):
+        handlers.BROKER, handlers.EventStreamHandler.keepalive = self.saved
+        super().tearDown()
+
+    def stream(self, path, headers=None, seconds=1):
+        """What the stream sent in a number of seconds
+        """
+        chunks = []
+        with self.assertRaises(HTTPClientError): #the stream does not end
+            self.fetch(path, headers=headers, streaming_callback=chunks.append, request_timeout=seconds)
+        #The handler sees the closed connection at its next keepalive
+        self.io_loop.run_sync(lambda: gen.sleep(2*handlers.EventStreamHandler.keepalive))
+        return b''.join(chunks).decode('utf-8')
+
+    def test_events_of_a_night(self):
+        self.broker.publish(event())
+        self.broker.publish(event(night='20221231'))
+        self.broker.publish(event(tab='exp'))
+        text = self.stream('/api/events?night={}&last_id=0'.format(self.night))
+        self.assertIn('id: 1\nevent: problem\n', text)
+        self.assertIn('id: 3\nevent: exp\n', text)
+        self.assertNotIn('id: 2\n', text)
+        self.assertNotIn('event: reset', text)
+
+    def test_live_events(self):
+        self.io_loop.call_later(0.3, self.broker.publish, event())
+        text = self.stream('/api/events')
+        self.assertIn(': keepalive', text)
+        self.assertIn('id: 1\nevent: problem\n', text)
+
+    def test_reset(self):
+        #Last-Event-ID from before a restart of the server
+        self.broker.publish(event())
+        text = self.stream('/api/events', headers={'Last-Event-ID': '120'})
+        self.assertTrue(text.startswith('event: reset\n'))
+        self.assertEqual(text.count('event: reset'), 1)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import io
+import os
+import sys
+import base64
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import images
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+PNG = images.PNG_SIGNATURE + b'not a real image'
+
+
+def b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+class TestSubmit(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.img_file = os.path.join(self.tmp, 'images', 'screenshot.png')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_decode(self):
+        self.assertEqual(images.decode(b64(PNG)), PNG)
+        with self.assertRaises(images.ImageError):
+            images.decode(b64(b'GIF89a'))
+        with self.assertRaises(images.ImageError):
+            images.decode('not base64!')
+        with self.assertRaises(images.ImageError):
+            images.decode('A'*(images.MAX_BYTES*2))
+
+    def test_stored_in_worker(self):
+        release = threading.Event()
+        done = []
+        #Keeps the workers busy, so the image is still pending after submit returns
+        blockers = [images._executor.submit(release.wait) for _ in range(2)]
+        future = images.submit(b64(PNG), self.img_file, on_done=lambda f, s: done.append((f, s)))
+        self.assertEqual(images.status(self.img_file), images.PENDING)
+        release.set()
+        self.assertEqual(future.result(10), images.STORED)
+        self.assertEqual(images.status(self.img_file), images.STORED)
+        self.assertEqual(done, [(self.img_file, images.STORED)])
+        self.assertEqual(open(self.img_file, 'rb').read(), PNG)
+        for blocker in blockers:
+            blocker.result(10)
+
+    def test_failed(self):
+        done = []
+        result = images.submit(b64(b'GIF89a'), self.img_file, on_done=lambda f, s: done.append(s)).result(10)
+        self.assertTrue(result.startswith(images.FAILED))
+        self.assertEqual(images.status(self.img_file), result)
+        self.assertEqual(done, [result])
+        self.assertFalse(os.path.exists(self.img_file))
+
+
+class TestImageStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.image_dir = os.path.join(self.tmp, 'images')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def store(self, data, name):
+        self.assertEqual(images.submit(b64(data), os.path.join(self.image_dir, name)).result(10), images.STORED)
+        return images.lookup(self.image_dir, name)
+
+    def test_same_content_stored_once(self):
+        first = self.store(PNG, 'a.png')
+        second = self.store(PNG, 'b.png')
+        other = self.store(PNG + b'2', 'c.png')
+        self.assertEqual(first['file'], second['file'])
+        self.assertNotEqual(first['file'], other['file'])
+        self.assertEqual(sorted(f for f in os.listdir(self.image_dir) if f.endswith('.png') and not f.endswith('_thumb.png')),
+                         sorted(['a.png', 'b.png', 'c.png', first['file'], other['file']]))
+        self.assertEqual(open(os.path.join(self.image_dir, 'b.png'), 'rb').read(), PNG)
+        self.assertEqual(sorted(images.read_index(self.image_dir)), ['a.png', 'b.png', 'c.png'])
+        self.assertIsNone(images.lookup(self.image_dir, 'd.png'))
+
+    def test_replaced_upload(self):
+        self.store(PNG, 'a.png')
+        entry = self.store(PNG + b'2', 'a.png')
+        self.assertEqual(open(os.path.join(self.image_dir, 'a.png'), 'rb').read(), PNG + b'2')
+        self.assertEqual(images.lookup(self.image_dir, 'a.png'), entry)
+
+    def test_no_thumbnail(self):
+        #Pillow cannot read it, or is not installed
+        self.assertIsNone(self.store(PNG, 'a.png')['thumb'])
+
+    @unittest.skipIf(Image is None, 'Pillow is not installed')
+    def test_thumbnail(self):
+        out = io.BytesIO()
+        Image.new('RGB', (1600, 800), (200, 30, 30)).save(out, format='PNG')
+        entry = self.store(out.getvalue(), 'a.png')
+        self.assertEqual(entry['thumb'], entry['sha1'] + '_thumb.png')
+        thumb = Image.open(os.path.join(self.image_dir, entry['thumb']))
+        self.assertEqual(thumb.size, (400, 200))
+        #A thumbnail that exists is not made again
+        mtime = os.path.getmtime(os.path.join(self.image_dir, entry['thumb']))
+        self.assertEqual(self.store(out.getvalue(), 'b.png')['thumb'], entry['thumb'])
+        self.assertEqual(os.path.getmtime(os.path.join(self.image_dir, entry['thumb'])), mtime)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jobs
+
+
+def fail():
+    raise RuntimeError('plotnightobs returned 256')
+
+
+class TestJob(unittest.TestCase):
+
+    def run_job(self, steps):
+        job = jobs.Job('test', steps)
+        job.run()
+        return dict(job.status)
+
+    def test_after_failed_step(self):
+        #The NightSummary email goes out without the night plot
+        sent = []
+        status = self.run_job([jobs.Step('plot', fail, backoff=0),
+                               jobs.Step('telem', lambda: None),
+                               jobs.Step('email', lambda: sent.append(True), after=['plot', 'telem'])])
+        self.assertEqual(status, {'plot': 'failed: plotnightobs returned 256', 'telem': 'done', 'email': 'done'})
+        self.assertEqual(sent, [True])
+
+    def test_after_waits(self):
+        order = []
+        self.run_job([jobs.Step('email', lambda: order.append('email'), after=['plot']),
+                      jobs.Step('plot', lambda: order.append('plot'))])
+        self.assertEqual(order, ['plot', 'email'])
+
+    def test_requires_failed_step(self):
+        status = self.run_job([jobs.Step('bad_exp', fail, backoff=0),
+                               jobs.Step('archive', lambda: None, requires=['bad_exp'])])
+        self.assertEqual(status['archive'], 'cancelled')
+
+    def test_retries(self):
+        calls = []
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise RuntimeError('busy')
+        status = self.run_job([jobs.Step('email', flaky, retries=3, backoff=0)])
+        self.assertEqual(status['email'], 'done')
+        self.assertEqual(len(calls), 3)
+
+    def test_once_steps_recorded(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            record_file = os.path.join(tmp, 'submission_kpno.json')
+            barrier = threading.Barrier(3)
+            steps = [jobs.Step(name, barrier.wait, once=True) for name in ['email', 'elog', 'archive']]
+            job = jobs.Job('test', steps, fingerprint='abc', record_file=record_file)
+            job.run()
+            self.assertEqual(json.load(open(record_file, 'r')), {'email': 'abc', 'elog': 'abc', 'archive': 'abc'})
+
+            sent = []
+            job = jobs.Job('test', [jobs.Step('email', lambda: sent.append(True), once=True)], fingerprint='abc', record_file=record_file)
+            job.run()
+            self.assertEqual(job.status['email'], 'skipped')
+            self.assertEqual(sent, [])
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    unittest.main()
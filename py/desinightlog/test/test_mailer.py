@@ -0,0 +1,85 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mailer
+import smtpstub
+
+
+def message(text='Night Summary'):
+    msg = MIMEText(text, 'html')
+    msg['Subject'] = 'Night Summary 20230101'
+    return msg
+
+
+class TestOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.stub = smtpstub.SMTPStub().start()
+        self.outbox = mailer.Outbox(os.path.join(self.tmp, 'outbox'), host='127.0.0.1', port=self.stub.port, max_attempts=2)
+        self.outbox.start = lambda: None #delivered by the test
+
+    def tearDown(self):
+        self.stub.stop()
+        shutil.rmtree(self.tmp)
+
+    def test_deliver(self):
+        done = []
+        path = self.outbox.spool(message(), 'noreply@noirlab.edu', ['desi-nightlog@desi.lbl.gov'], on_done=lambda p, s: done.append(s))
+        self.assertEqual(self.outbox.status(path), mailer.QUEUED)
+        self.assertEqual(self.outbox.deliver(), 0)
+        self.assertEqual(self.outbox.status(path), mailer.SENT)
+        self.assertEqual(done, [mailer.SENT])
+        sender, recipients, data = self.stub.messages[0]
+        self.assertEqual((sender, recipients), ('noreply@noirlab.edu', ['desi-nightlog@desi.lbl.gov']))
+        self.assertIn('Night Summary 20230101', data)
+
+    def test_temporary_failure(self):
+        #4xx replies are retried until the message is delivered
+        path = self.outbox.spool(message(), 'noreply@noirlab.edu', ['desi-nightlog@desi.lbl.gov'])
+        self.stub.fail, self.stub.fail_code = 3, 451
+        for _ in range(3):
+            self.assertEqual(self.outbox.deliver(), 1)
+        self.assertEqual(self.outbox.status(path), mailer.QUEUED)
+        self.assertEqual(self.outbox.deliver(), 0)
+        self.assertEqual(len(self.stub.messages), 1)
+
+    def test_permanent_failure(self):
+        done = []
+        bad = self.outbox.spool(message(), 'noreply@noirlab.edu', ['nobody@desi.lbl.gov'], on_done=lambda p, s: done.append(s))
+        good = self.outbox.spool(message(), 'noreply@noirlab.edu', ['desi-nightlog@desi.lbl.gov'])
+        self.stub.refused.add('nobody@desi.lbl.gov')
+        self.assertEqual(self.outbox.deliver(), 1)
+        self.assertEqual(self.outbox.status(bad), mailer.QUEUED)
+        self.assertEqual(self.outbox.status(good), mailer.SENT)
+        self.assertEqual(self.outbox.deliver(), 1)
+        self.assertEqual(self.outbox.status(bad), mailer.FAILED)
+        self.assertEqual(done, [mailer.FAILED])
+        self.assertEqual(self.outbox.pending(), [])
+        self.assertEqual(self.outbox.deliver(), 0)
+
+    def test_no_server(self):
+        self.stub.stop()
+        path = self.outbox.spool(message(), 'noreply@noirlab.edu', ['desi-nightlog@desi.lbl.gov'])
+        self.stub = smtpstub.SMTPStub().start()
+        self.assertEqual(self.outbox.deliver(), 1)
+        self.assertEqual(self.outbox.status(path), mailer.QUEUED)
+
+
+class TestFitImage(unittest.TestCase):
+
+    def test_budget(self):
+        self.assertEqual(mailer.fit_image(b'x'*10, 10), b'x'*10)
+        #The budget left for an email can be used up
+        self.assertIsNone(mailer.fit_image(b'x'*10, 0))
+        self.assertIsNone(mailer.fit_image(b'x'*10, -5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nightdirs
+
+
+class TestNightDirs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        for name in ['20230102', '20230101', '20230104', 'ops']:
+            os.makedirs(os.path.join(self.tmp, name))
+        open(os.path.join(self.tmp, '20230103'), 'w').close() #not a directory
+        self.dirs = nightdirs.NightDirs(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def touch_dir(self):
+        #mtime of NL_DIR as after a change, in case the file system does not resolve the change
+        st = os.stat(self.tmp)
+        os.utime(self.tmp, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    def test_latest(self):
+        self.assertEqual(self.dirs.latest(), ['20230104', '20230102', '20230101'])
+        self.assertEqual(self.dirs.latest(2), ['20230104', '20230102'])
+        self.assertEqual(self.dirs.latest(10, before='20230103'), ['20230102', '20230101'])
+        self.assertEqual(self.dirs.latest(10, before=20230102), ['20230102', '20230101'])
+        self.assertEqual(self.dirs.latest(10, before='20221231'), [])
+
+    def test_update(self):
+        self.dirs.latest()
+        os.makedirs(os.path.join(self.tmp, '20230105'))
+        shutil.rmtree(os.path.join(self.tmp, '20230102'))
+        self.touch_dir()
+        self.assertEqual(self.dirs.latest(), ['20230105', '20230104', '20230101'])
+
+    def test_unchanged(self):
+        self.dirs.latest()
+        #A listing of NL_DIR whose mtime did not change is not read again
+        self.dirs.names = set()
+        self.dirs.nights = ['20230101']
+        self.assertEqual(self.dirs.latest(), ['20230101'])
+
+    def test_shared(self):
+        self.assertIs(nightdirs.get_night_dirs(self.tmp), nightdirs.get_night_dirs(self.tmp))
+
+
+if __name__ == '__main__':
+    unittest.main()
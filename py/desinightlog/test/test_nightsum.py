@@ -0,0 +1,49 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('USER', 'test')
+import nightsum
+
+
+class TestSummaryIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.index = nightsum.SummaryIndex(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_summary(self, rel, night):
+        root_dir = os.path.join(self.tmp, rel)
+        os.makedirs(root_dir, exist_ok=True)
+        filen = nightsum.summary_file(root_dir, night)
+        with open(filen, 'w') as f:
+            f.write('<h1>DESI Night Summary {}</h1>'.format(night))
+        return filen
+
+    def test_rescan_night_dirs(self):
+        filen = self.write_summary('20230101', '20230101')
+        #Summaries outside of the night directories are not looked for
+        self.write_summary(os.path.join('ops', 'staticsite', '20230102'), '20230102')
+        self.assertEqual(self.index.nights(), {'20230101': filen})
+
+        os.remove(filen)
+        self.assertEqual(self.index.nights(), {})
+
+    def test_get_night_dir(self):
+        self.assertIsNone(self.index.get('20230105'))
+        filen = self.write_summary('20230105', '20230105')
+        self.index.rescan = None #a miss only looks in the directory of the night
+        self.assertEqual(self.index.get('20230105'), filen)
+        self.assertIn('20230105', nightsum.SummaryIndex(self.tmp)._load()['nights'])
+        self.assertIsNone(self.index.get('20230106'))
+
+
+if __name__ == '__main__':
+    unittest.main()
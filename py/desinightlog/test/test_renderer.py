@@ -0,0 +1,46 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('USER', 'test')
+import nightlog as nl
+import renderer
+
+
+class TestRenderer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.nl_dir = os.environ.get('NL_DIR')
+        os.environ['NL_DIR'] = self.tmp
+        self.night = '20230101'
+        os.makedirs(os.path.join(self.tmp, self.night, 'Observers'))
+        self.log = nl.NightLog(self.night, 'kpno', None)
+
+    def tearDown(self):
+        if self.nl_dir is None:
+            del os.environ['NL_DIR']
+        else:
+            os.environ['NL_DIR'] = self.nl_dir
+        shutil.rmtree(self.tmp)
+
+    def test_render_once(self):
+        r = renderer.Renderer('kpno', self.night)
+        self.assertTrue(r.render(self.night))
+        self.assertTrue(os.path.exists(self.log.nightlog_html))
+        self.assertTrue(renderer.active(self.log))
+        self.assertFalse(r.render(self.night))
+
+    def test_header_kept_without_meta(self):
+        with open(self.log.header_html, 'w') as f:
+            f.write('<b>Lead Observer (LO) </b>: A B<br/>')
+        self.assertTrue(renderer.Renderer('kpno', self.night).render(self.night))
+        self.assertEqual(open(self.log.header_html, 'r').read(), '<b>Lead Observer (LO) </b>: A B<br/>')
+
+
+if __name__ == '__main__':
+    unittest.main()
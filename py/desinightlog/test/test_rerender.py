@@ -0,0 +1,85 @@
+import os
+import sys
+import base64
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('USER', 'test')
+import nightsum
+import rerender
+
+PNG = b'\x89PNG\r\n\x1a\n'
+
+
+def inline_image(data):
+    return '<img src="data:image/png;base64,%s" \\>' % base64.b64encode(data).decode('utf-8')
+
+
+class TestRenderNight(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.nl_dir = os.environ.get('NL_DIR')
+        os.environ['NL_DIR'] = self.tmp
+        self.night = '20220101'
+        self.root_dir = os.path.join(self.tmp, self.night)
+        os.makedirs(self.root_dir)
+        self.ns_file = nightsum.summary_file(self.root_dir, self.night)
+
+    def tearDown(self):
+        if self.nl_dir is None:
+            del os.environ['NL_DIR']
+        else:
+            os.environ['NL_DIR'] = self.nl_dir
+        shutil.rmtree(self.tmp)
+
+    def test_legacy_summary(self):
+        #Summary written before the images were kept as files, with two inline images
+        with open(self.ns_file, 'w') as f:
+            f.write('<h1>DESI Night Summary {}</h1>'.format(self.night) + inline_image(PNG + b'1') + inline_image(PNG + b'2'))
+
+        night, status, _, message = rerender.render_night(self.night, 'kpno', rerender.code_version(), force=True)
+        self.assertEqual(status, 'rendered', message)
+
+        html = open(self.ns_file, 'r').read()
+        names = nightsum.image_names(html)
+        self.assertEqual(len(names), 2)
+        self.assertNotIn('data:image/png;base64,', html)
+        self.assertEqual(sorted(open(os.path.join(self.root_dir, name), 'rb').read() for name in names), [PNG + b'1', PNG + b'2'])
+
+    def test_summary_with_files(self):
+        for name in ['nightstats{}.png'.format(self.night), 'telem_plots_{}.png'.format(self.night)]:
+            with open(os.path.join(self.root_dir, name), 'wb') as f:
+                f.write(PNG)
+        with open(self.ns_file, 'w') as f:
+            f.write('<h1>old</h1>' + nightsum.image_tag('nightstats{}.png'.format(self.night)))
+
+        rerender.render_night(self.night, 'kpno', rerender.code_version(), force=True)
+        names = nightsum.image_names(open(self.ns_file, 'r').read())
+        self.assertEqual(names, ['nightstats{}.png'.format(self.night), 'telem_plots_{}.png'.format(self.night)])
+
+    def test_header_kept_without_meta(self):
+        #A night without its meta file keeps the header it has
+        header = os.path.join(self.root_dir, 'header_kpno.html')
+        with open(header, 'w') as f:
+            f.write('<b>Lead Observer (LO) </b>: A B<br/>')
+        night, status, _, message = rerender.render_night(self.night, 'kpno', rerender.code_version(), force=True)
+        self.assertEqual(status, 'rendered', message)
+        self.assertEqual(open(header, 'r').read(), '<b>Lead Observer (LO) </b>: A B<br/>')
+
+    def test_has_meta(self):
+        kpno = rerender.nl.NightLog(self.night, 'kpno', None)
+        nersc = rerender.nl.NightLog(self.night, 'nersc', None)
+        self.assertFalse(rerender.has_meta(kpno))
+        self.assertFalse(rerender.has_meta(nersc))
+        with open(kpno.meta_json, 'w') as f:
+            f.write('{}')
+        self.assertTrue(rerender.has_meta(kpno))
+        self.assertTrue(rerender.has_meta(nersc))
+
+
+if __name__ == '__main__':
+    unittest.main()
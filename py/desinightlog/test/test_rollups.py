@@ -0,0 +1,125 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('USER', 'test')
+import rollups
+
+
+class TestRollups(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.nl_dir = os.environ.get('NL_DIR')
+        os.environ['NL_DIR'] = self.tmp
+        night_dir = os.path.join(self.tmp, '20230101', 'Observers')
+        os.makedirs(night_dir)
+        with open(os.path.join(night_dir, 'problems_kpno.csv'), 'w') as f:
+            f.write('Time,Problem,alarm_id,action,Name\n20230101T20:00,FVC down,12,,x\n20230102T02:00,dome,,,y\n')
+        rollups._rollups.clear()
+
+    def tearDown(self):
+        rollups._rollups.clear()
+        if self.nl_dir is None:
+            del os.environ['NL_DIR']
+        else:
+            os.environ['NL_DIR'] = self.nl_dir
+        shutil.rmtree(self.tmp)
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            rollups.Rollup(self.tmp)
+
+    def test_built_in_background(self):
+        problems = rollups.get_rollup(rollups.ProblemRollup)
+        self.assertFalse(problems.built())
+        done = threading.Event()
+        rollups.queue(rollups.ProblemRollup, on_done=done.set)
+        self.assertTrue(done.wait(30))
+        self.assertTrue(problems.built())
+        alarms = problems.alarms().set_index('alarm_id')
+        self.assertEqual(alarms.loc['12', 'count'], 1)
+        self.assertEqual(alarms.loc[rollups.NO_ALARM, 'count'], 1)
+
+    def test_not_built_by_one_night(self):
+        problems = rollups.get_rollup(rollups.ProblemRollup)
+        self.assertEqual(problems.update_night('20230101'), 1)
+        self.assertEqual(len(problems.table()), 2)
+        self.assertFalse(problems.built())
+        self.assertEqual(problems.update(), 0)
+        self.assertTrue(problems.built())
+
+    def test_built_without_nights(self):
+        shutil.rmtree(os.path.join(self.tmp, '20230101'))
+        problems = rollups.get_rollup(rollups.ProblemRollup)
+        self.assertEqual(problems.update(), 0)
+        self.assertTrue(problems.built())
+
+
+class TestTimeUse(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.nl_dir = os.environ.get('NL_DIR')
+        os.environ['NL_DIR'] = self.tmp
+        #night -> location -> (obs_time, 12deg)
+        nights = {'20230115': {'kpno': (8, 10), 'nersc': (1, 10)},
+                  '20230131': {'nersc': (6, 10)},
+                  '20230201': {'kpno': (5, 0)}, #twilight time unknown
+                  '20230801': {'kpno': (4, 8)}}
+        for night, locs in nights.items():
+            os.makedirs(os.path.join(self.tmp, night))
+            for loc, (obs, deg12) in locs.items():
+                with open(os.path.join(self.tmp, night, 'time_use_{}.csv'.format(loc)), 'w') as f:
+                    f.write('obs_time,test_time,inst_loss,weather_loss,tel_loss,total,18deg,12deg\n')
+                    f.write('{},0.5,0,1,0,{},{},{}\n'.format(obs, obs + 1.5, deg12 - 1 if deg12 else 0, deg12))
+        rollups._rollups.clear()
+        self.time_use = rollups.get_rollup(rollups.TimeUseRollup)
+        self.assertEqual(self.time_use.update(), 4)
+
+    def tearDown(self):
+        rollups._rollups.clear()
+        if self.nl_dir is None:
+            del os.environ['NL_DIR']
+        else:
+            os.environ['NL_DIR'] = self.nl_dir
+        shutil.rmtree(self.tmp)
+
+    def test_kpno_first(self):
+        table = self.time_use.table().set_index('night')
+        self.assertEqual(table.loc['20230115', 'location'], 'kpno')
+        self.assertEqual(table.loc['20230115', 'obs_time'], 8)
+        self.assertEqual(table.loc['20230131', 'location'], 'nersc')
+
+    def test_month(self):
+        out = self.time_use.efficiency('month').set_index('period')
+        self.assertEqual(list(out.index), ['20230101', '20230201', '20230801'])
+        self.assertEqual(out.loc['20230101', 'nights'], 2)
+        self.assertEqual(out.loc['20230101', 'obs_time'], 14)
+        self.assertEqual(out.loc['20230101', 'open_12deg'], 0.7)
+        #No fraction without the twilight time
+        self.assertTrue(np.isnan(out.loc['20230201', 'open_12deg']))
+
+    def test_semester(self):
+        #January belongs to the B semester of the year before
+        out = self.time_use.efficiency('semester').set_index('period')
+        self.assertEqual(list(out.index), ['2022B', '2023A', '2023B'])
+        self.assertEqual(out.loc['2022B', 'nights'], 2)
+        self.assertEqual(out.loc['2023B', 'open_12deg'], 0.5)
+        self.assertEqual(out.loc['2023B', 'open_18deg'], round(4/7, 3))
+
+    def test_range(self):
+        out = self.time_use.efficiency('night', first_night=20230131, last_night='20230201')
+        self.assertEqual(list(out.period), ['20230131', '20230201'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('USER', 'test')
+import search
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.nl_dir = os.environ.get('NL_DIR')
+        os.environ['NL_DIR'] = self.tmp
+        for night, problem in [('20230101', 'FVC timeout'), ('20230102', 'dome stuck')]:
+            night_dir = os.path.join(self.tmp, night, 'Observers')
+            os.makedirs(night_dir)
+            with open(os.path.join(night_dir, 'problems_kpno.csv'), 'w') as f:
+                f.write('Time,Problem,alarm_id,action,Name\n{}T20:00,{},,,x\n'.format(night, problem))
+        self.index = search.SearchIndex(self.tmp)
+
+    def tearDown(self):
+        if self.nl_dir is None:
+            del os.environ['NL_DIR']
+        else:
+            os.environ['NL_DIR'] = self.nl_dir
+        shutil.rmtree(self.tmp)
+
+    def test_rollback_journal(self):
+        #The DB is on NFS, where WAL is not safe; a DB created in WAL mode is switched back
+        conn = sqlite3.connect(self.index.db_file)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.close()
+        index = search.SearchIndex(self.tmp)
+        with index._connect() as conn:
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+
+    def test_index_night(self):
+        self.assertFalse(self.index.built())
+        self.assertTrue(self.index.index_night('20230101'))
+        self.assertFalse(self.index.index_night('20230101'))
+        hits, _ = self.index.search('fvc')
+        self.assertEqual([h['night'] for h in hits], ['20230101'])
+        #One night does not make the index complete
+        self.assertFalse(self.index.built())
+
+    def test_update_in_background(self):
+        done = threading.Event()
+        self.assertTrue(self.index.queue_update(on_done=done.set))
+        self.assertTrue(done.wait(30))
+        self.assertTrue(self.index.built())
+        hits, _ = self.index.search('dome')
+        self.assertEqual([h['night'] for h in hits], ['20230102'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('USER', 'test')
+import sources
+
+
+class TestSources(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.nl_dir = os.environ.get('NL_DIR')
+        os.environ['NL_DIR'] = self.tmp
+        for name in ['20230101', '20230102', '20230103', '2023', 'ops']:
+            os.makedirs(os.path.join(self.tmp, name, 'Observers'))
+        with open(os.path.join(self.tmp, '20230102', 'Observers', 'problems_nersc.csv'), 'w') as f:
+            f.write('Time,Problem\n')
+
+    def tearDown(self):
+        if self.nl_dir is None:
+            del os.environ['NL_DIR']
+        else:
+            os.environ['NL_DIR'] = self.nl_dir
+        shutil.rmtree(self.tmp)
+
+    def test_nights(self):
+        self.assertEqual(sources.nights(self.tmp), ['20230101', '20230102', '20230103'])
+        self.assertEqual(sources.nights(self.tmp, first_night=20230102, last_night='20230102'), ['20230102'])
+
+    def test_by_location(self):
+        found = sources.by_location('20230102', 'obs_pb')
+        self.assertEqual(list(found), ['nersc'])
+        filen, (_, size) = found['nersc']
+        self.assertEqual(filen, os.path.join(self.tmp, '20230102', 'Observers', 'problems_nersc.csv'))
+        self.assertEqual(size, len('Time,Problem\n'))
+        self.assertEqual(sources.by_location('20230101', 'obs_pb'), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import base64
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('USER', 'test')
+import nightsum
+import staticsite
+
+PNG = b'\x89PNG\r\n\x1a\n'
+
+
+class TestStaticSite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.out_dir = os.path.join(self.tmp, 'ops', 'site')
+        self.write_summary('20230130', '<p>FVC timeout</p>' + nightsum.image_tag('nightstats20230130.png'))
+        with open(os.path.join(self.tmp, '20230130', 'nightstats20230130.png'), 'wb') as f:
+            f.write(PNG + b'1')
+        #Summary written with an inline image
+        self.write_summary('20230201', '<p>dome stuck</p><img src="data:image/png;base64,{}" \\>'.format(base64.b64encode(PNG + b'2').decode('ascii')))
+        self.write_summary('20230205', '<p>clear night</p>')
+        self.site = staticsite.StaticSite(self.out_dir, index=nightsum.SummaryIndex(self.tmp))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_summary(self, night, body):
+        root_dir = os.path.join(self.tmp, night)
+        os.makedirs(root_dir, exist_ok=True)
+        with open(nightsum.summary_file(root_dir, night), 'w') as f:
+            f.write('<h1>DESI Night Summary {}</h1>{}'.format(night, body))
+
+    def build(self):
+        results = self.site.build(workers=2, report=lambda line: None)
+        self.assertEqual([r[1] for r in results], ['rendered']*len(results), results)
+        return [r[0] for r in results]
+
+    def read(self, *path):
+        return open(os.path.join(self.out_dir, *path), 'r').read()
+
+    def test_build(self):
+        self.assertEqual(self.build(), ['20230130', '20230201', '20230205'])
+        page = self.read('20230201', 'index.html')
+        self.assertIn('<a href="../20230130/index.html">&laquo; 20230130</a>', page)
+        self.assertIn('<a href="../20230205/index.html">20230205 &raquo;</a>', page)
+        self.assertIn('<a href="../202302.html">February 2023</a>', page)
+        self.assertNotIn('base64', page)
+        self.assertEqual(open(os.path.join(self.out_dir, '20230201', 'NightSummary20230201_1.png'), 'rb').read(), PNG + b'2')
+        self.assertEqual(open(os.path.join(self.out_dir, '20230130', 'nightstats20230130.png'), 'rb').read(), PNG + b'1')
+
+        index = self.read('index.html')
+        self.assertLess(index.index('February 2023'), index.index('January 2023'))
+        self.assertIn('(2 nights)', index)
+        self.assertIn('<a href="20230205/index.html">20230205</a>', self.read('202302.html'))
+        texts = {e['night']: e['text'] for e in json.loads(self.read('search.json'))}
+        self.assertEqual(sorted(texts), ['20230130', '20230201', '20230205'])
+        self.assertIn('FVC timeout', texts['20230130'])
+        self.assertNotIn('<p>', texts['20230130'])
+
+    def test_incremental(self):
+        self.build()
+        self.assertEqual(self.build(), [])
+
+        #A changed summary is rendered again, and so are the neighbours of a new night
+        self.write_summary('20230130', '<p>FVC timeout, then fixed</p>')
+        self.write_summary('20230210', '<p>new night</p>')
+        self.assertEqual(self.build(), ['20230130', '20230205', '20230210'])
+        self.assertIn('then fixed', self.read('search.json'))
+
+        #A night without its summary any more is removed, with its month
+        shutil.rmtree(os.path.join(self.tmp, '20230130'))
+        self.assertEqual(self.build(), ['20230201'])
+        self.assertFalse(os.path.exists(os.path.join(self.out_dir, '20230130')))
+        self.assertFalse(os.path.exists(os.path.join(self.out_dir, '202301.html')))
+        self.assertNotIn('20230130', self.read('search.json'))
+
+    def test_force(self):
+        self.build()
+        self.assertEqual(len(self.site.build(workers=2, force=True, report=lambda line: None)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()